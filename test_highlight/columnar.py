@@ -0,0 +1,222 @@
+"""
+glue ``Data`` from memory-mapped column files, with optional reduced-precision display columns.
+
+Datasets built from Python lists (``Data(x=list(...))``) hold a private float64 copy
+of every column in every session, so memory grows with the class size. This module
+builds the components straight from memory-mapped files instead:
+
+- a directory of ``.npy`` files (one per column, e.g. a `shared_data.SharedArrayStore` entry)
+- a ``.npy`` file with a structured dtype (each field is a view, not a copy)
+- an Arrow IPC/Feather file (``.arrow``, ``.feather``, ``.ipc``), if ``pyarrow`` is installed.
+  Numeric columns without nulls are zero-copy views of the mapped file
+
+With ``display='float32'`` the glue components of the float64 columns are float32
+copies (half the memory, and half the bytes sent to plotly), while the full precision
+mapped columns are kept in ``data.meta`` for the statistics: `full_values` is what
+`BinManager`, `range_stats` and `BinningEngine` read, so counts, means and quantiles
+are computed from the full precision values.
+
+`memory_report` gives the bytes a dataset holds in memory, the bytes that are mapped
+(shared by all sessions and workers through the OS page cache), and the bytes saved
+compared to float64 columns in memory.
+
+Usage:
+
+    data = load_data("assets/galaxies.arrow", label="galaxies", display="float32")
+    memory_report(data)  # {'label': 'galaxies', 'rows': ..., 'saved_bytes': ...}
+
+    python -m test_highlight.columnar data_dir/ galaxies.arrow --display float32
+"""
+import argparse
+import mmap
+import os
+import sys
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# display dtypes of the float64 columns (None keeps the full precision column)
+DISPLAY_DTYPES = {"float32": np.float32}
+DISPLAY_DTYPE = os.environ.get("TEST_HIGHLIGHT_DISPLAY_DTYPE") or None
+
+# data.meta keys
+FULL_PRECISION_KEY = "full_precision_columns"
+_SOURCE_KEY = "columnar_source"
+
+_ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+
+def _is_mapped(values) -> bool:
+    """Whether an array is a view of a memory-mapped file (numpy or Arrow)"""
+    base = values
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return True
+        # results of operations on a memmap are np.memmap instances too, without a map
+        if isinstance(base, np.memmap) and getattr(base, "_mmap", None) is not None:
+            return True
+        if type(base).__module__.startswith("pyarrow"):
+            # only created by _load_arrow, from a memory-mapped file
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+
+def _load_npy_directory(path: str) -> Dict[str, np.ndarray]:
+    columns = {}
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".npy"):
+            columns[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+    return columns
+
+
+def _load_npy(path: str) -> Dict[str, np.ndarray]:
+    values = np.load(path, mmap_mode="r", allow_pickle=False)
+    if values.dtype.names is None:
+        return {os.path.splitext(os.path.basename(path))[0]: values}
+    # fields of a mapped structured array are strided views of the file
+    return {name: values[name] for name in values.dtype.names}
+
+
+def _load_arrow(path: str) -> Dict[str, np.ndarray]:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError(f"Reading {path} needs pyarrow (pip install pyarrow)") from None
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    columns = {}
+    for name in table.column_names:
+        chunks = table.column(name)
+        # several chunks are concatenated, i.e. copied
+        column = chunks.chunk(0) if chunks.num_chunks == 1 else chunks.combine_chunks()
+        try:
+            columns[name] = column.to_numpy(zero_copy_only=True)
+        except (pa.ArrowInvalid, NotImplementedError):
+            # strings and columns with nulls are copied
+            columns[name] = column.to_numpy(zero_copy_only=False)
+    return columns
+
+
+def load_columns(path: str) -> Dict[str, np.ndarray]:
+    """Memory map the columns of a directory of .npy files, a (structured) .npy file or an Arrow file"""
+    if os.path.isdir(path):
+        return _load_npy_directory(path)
+    if path.endswith(".npy"):
+        return _load_npy(path)
+    if path.endswith(_ARROW_SUFFIXES):
+        return _load_arrow(path)
+    raise ValueError(f"Can not memory map {path}. Use a directory of .npy files, a .npy file or an Arrow file ({', '.join(_ARROW_SUFFIXES)})")
+
+
+def columnar_data(label: str, columns: Dict[str, np.ndarray], display: Optional[str] = DISPLAY_DTYPE):
+    """
+    glue ``Data`` with the columns as components, without copying them.
+
+    With ``display`` (e.g. 'float32') the float64 columns are plotted from a copy in that
+    dtype, and `full_values` returns the full precision columns for statistics.
+    """
+    from glue.core import Data
+
+    if display is not None and display not in DISPLAY_DTYPES:
+        raise ValueError(f"Unknown display dtype {display!r}. Options are {list(DISPLAY_DTYPES)}")
+    components = {}
+    full_precision = {}
+    for name, values in columns.items():
+        if display is not None and values.dtype == np.float64:
+            # np.array, so the copy is a plain in-memory array (not an np.memmap instance)
+            components[name] = np.array(values, dtype=DISPLAY_DTYPES[display])
+            full_precision[name] = values
+        else:
+            components[name] = values
+    data = Data(label=label, **components)
+    data.meta[FULL_PRECISION_KEY] = full_precision
+    data.meta[_SOURCE_KEY] = {"display": display, "columns": list(columns)}
+    return data
+
+
+def load_data(path: str, label: Optional[str] = None, display: Optional[str] = DISPLAY_DTYPE):
+    """`columnar_data` of the memory-mapped columns of `path`"""
+    if label is None:
+        label = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+    return columnar_data(label, load_columns(path), display=display)
+
+
+def full_precision_column(data, attribute) -> Optional[np.ndarray]:
+    """The full precision column of `attribute` in a dataset with a display dtype, or None"""
+    columns = getattr(data, "meta", {}).get(FULL_PRECISION_KEY) or {}
+    name = getattr(attribute, "label", str(attribute))
+    if name not in columns:
+        return None
+    if not isinstance(attribute, str):
+        try:
+            own = data.id[name]
+        except Exception:
+            return None
+        # a component of another (linked) dataset with the same name is not this column
+        if own is not attribute:
+            return None
+    return columns[name]
+
+
+def full_values(layer, attribute) -> np.ndarray:
+    """
+    The values of `attribute` in a glue Data or Subset, at full precision.
+
+    For a dataset from `columnar_data` with a display dtype that is the mapped column,
+    not the (reduced precision) component that is plotted.
+    """
+    data = getattr(layer, "data", layer)
+    full = full_precision_column(data, attribute)
+    if full is None:
+        return layer[attribute]
+    return full if data is layer else full[layer.to_mask()]
+
+
+def memory_report(data) -> Dict[str, object]:
+    """Bytes of a dataset's columns: in memory, memory-mapped, and saved compared to float64 columns in memory"""
+    full_precision = data.meta.get(FULL_PRECISION_KEY) or {}
+    rows = int(data.size)
+    in_memory = mapped = baseline = 0
+    for cid in data.main_components:
+        values = data.get_component(cid).data
+        arrays = [values]
+        if cid.label in full_precision:
+            arrays.append(full_precision[cid.label])
+        for array in arrays:
+            if _is_mapped(array):
+                mapped += array.nbytes
+            else:
+                in_memory += array.nbytes
+        # what a numeric column built from a list costs
+        baseline += rows * 8 if values.dtype.kind in "fiub" else values.nbytes
+    return {
+        "label": data.label,
+        "rows": rows,
+        "display": (data.meta.get(_SOURCE_KEY) or {}).get("display"),
+        "in_memory_bytes": in_memory,
+        "mapped_bytes": mapped,
+        "float64_bytes": baseline,
+        "saved_bytes": baseline - in_memory,
+    }
+
+
+def format_report(reports: List[Dict[str, object]]) -> str:
+    lines = [f"{'dataset':<30} {'rows':>9} {'display':>8} {'in memory':>11} {'mapped':>11} {'saved':>11}"]
+    for r in reports:
+        lines.append(f"{str(r['label'])[:30]:<30} {r['rows']:>9} {str(r['display'] or '-'):>8} "
+                     f"{r['in_memory_bytes'] / 1e6:>9.2f}MB {r['mapped_bytes'] / 1e6:>9.2f}MB {r['saved_bytes'] / 1e6:>9.2f}MB")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m test_highlight.columnar", description="Memory map datasets and report their memory use")
+    parser.add_argument("paths", nargs="+", help="directories of .npy files, .npy files or Arrow files")
+    parser.add_argument("--display", choices=list(DISPLAY_DTYPES), default=None, help="dtype of the plotted copy of float64 columns")
+    args = parser.parse_args(argv)
+    reports = [memory_report(load_data(path, display=args.display)) for path in args.paths]
+    print(format_report(reports))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
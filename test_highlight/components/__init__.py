@@ -1,3 +1,86 @@
-from .dotplot_viewer import DotplotViewer
-from .test_viewer import TestViewer
-from .PlotlyHighlighting import PlotlyHighlighting
\ No newline at end of file
+"""
+Viewer components for the testbed.
+
+The public names are imported lazily (PEP 562 module ``__getattr__``), so
+importing ``test_highlight.components`` (or a light submodule such as
+``binning``) does not pull in glue, plotly, solara, hubbleds and cosmicds
+until a viewer is first used. Use ``python -m test_highlight.profile_startup``
+to measure the import cost.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+# public name -> submodule that defines it
+_LAZY_IMPORTS = {
+    "DotplotViewer": ".dotplot_viewer",
+    "TestViewer": ".test_viewer",
+    "PlotlyHighlighting": ".plotly_highlighting",
+    "BinManager": ".bin_manager",
+    # library only, no viewer of the app uses it (see the class docstring)
+    "BinManager2D": ".bin_manager_2d",
+    "BinHighlighter": ".bin_highligher",
+    "HighlightModeController": ".highlight_modes",
+    "CallbackDispatcher": ".callback_dispatcher",
+    "selection_dispatcher": ".callback_dispatcher",
+    "BinningEngine": ".binning",
+    "BINNING_ENGINE": ".binning",
+    "DensityOverlay": ".density",
+    "MarkerManager": ".marker_manager",
+    "RangeStatsIndex": ".range_stats",
+    "range_index": ".range_stats",
+    "LayerVisibilityController": ".layer_visibility",
+    "ViewerPool": ".viewer_pool",
+    "InteractionRecorder": ".interaction_recorder",
+    "LatencyTracer": ".latency_tracing",
+    "latency_tracer": ".latency_tracing",
+    "remove_tracer": ".latency_tracing",
+    "UpdateScheduler": ".update_scheduler",
+    "ViewerSnapshot": ".viewer_snapshot",
+    "SNAPSHOTS": ".viewer_snapshot",
+    "WebGLDots": ".webgl",
+    "SvgPreview": ".svg_preview",
+}
+
+# no public name may be the name of a submodule: importing the submodule sets it as
+# an attribute of the package, which would then be the module or the name depending on
+# the import order (the per-app `viewer_pool` and `update_scheduler` are imported from
+# their modules)
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_IMPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    # cache it, so __getattr__ is only called on first use
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .bin_highligher import BinHighlighter
+    from .bin_manager import BinManager
+    from .bin_manager_2d import BinManager2D
+    from .binning import BINNING_ENGINE, BinningEngine
+    from .callback_dispatcher import CallbackDispatcher, selection_dispatcher
+    from .density import DensityOverlay
+    from .dotplot_viewer import DotplotViewer
+    from .highlight_modes import HighlightModeController
+    from .interaction_recorder import InteractionRecorder
+    from .latency_tracing import LatencyTracer, latency_tracer, remove_tracer
+    from .layer_visibility import LayerVisibilityController
+    from .marker_manager import MarkerManager
+    from .plotly_highlighting import PlotlyHighlighting
+    from .range_stats import RangeStatsIndex, range_index
+    from .svg_preview import SvgPreview
+    from .test_viewer import TestViewer
+    from .update_scheduler import UpdateScheduler
+    from .viewer_pool import ViewerPool
+    from .viewer_snapshot import SNAPSHOTS, ViewerSnapshot
+    from .webgl import WebGLDots
@@ -4,7 +4,10 @@ from plotly.basedatatypes import BaseTraceType
 from plotly.callbacks import Points, InputDeviceState
 from typing import Callable, Optional
 
-from .BinManager import BinManager
+from .bin_manager import BinManager
+from .callback_dispatcher import selection_dispatcher
+from .latency_tracing import now_ms
+from .update_scheduler import HIGH
 from cosmicds.utils import debounce
 from time import sleep
 
@@ -51,7 +54,14 @@ class BinHighlighter(BinManager):
         show_bins_with_data_only: bool = False,
         visible_bins: bool = False,
         setup_selection_layer: bool = False,
-        highlight_on_click: bool = False
+        highlight_on_click: bool = False,
+        edges: Optional[np.ndarray] = None,
+        recorder = None,
+        tracer = None,
+        scheduler = None,
+        stacked: bool = False,
+        hovertemplate = None,
+        shared_store = None,
     ):
         """
         Initialize the BinHighlighter.
@@ -98,6 +108,28 @@ class BinHighlighter(BinManager):
         setup_selection_layer : bool, optional
             If True, sets up the necessary hover and click modes for the selection layer.
             This should be used when the selection layer isn't already configured. Default is False.
+        edges : array, optional
+            Explicit (possibly variable width) bin edges, e.g. from `binning.BinningEngine`.
+            Default is None, which uses the viewer's bins.
+        recorder : InteractionRecorder, optional
+            Records hover, unhover and click points and bin changes for replay
+            (see `interaction_recorder`). Default is None.
+        tracer : LatencyTracer, optional
+            Stamps the start and end of every hover handler, to be matched with the browser
+            timings collected by a tracing `_PlotlyHighlighting` (see `latency_tracing`). Default is None.
+        scheduler : UpdateScheduler, optional
+            The viewer's `update_scheduler`. Highlight updates are submitted with high priority
+            and redraws with low priority, instead of being written to the figure directly.
+            Default is None.
+        stacked : bool, optional
+            Highlight the hovered bin with one segment per layer, stacked and sized by the
+            layer's count in the bin (subsets, plus the rest of their data), in the layer colors.
+            The counts come from the cached bin table, so a hover costs O(layers). Overlapping
+            subsets are clipped, see `_update_stack_table`. Default is False.
+        hovertemplate : str or callable, optional
+            Tooltip of the bins, see `BinManager`. Default is None.
+        shared_store : SharedArrayStore, optional
+            Store shared by the workers for the bin tables, see `BinManager`. Default is None.
         """
         super().__init__(viewer,
                             bin_width=bin_width,
@@ -107,7 +139,12 @@ class BinHighlighter(BinManager):
                             use_selection_layer=use_selection_layer,
                             on_hover=self._on_hover,  # Generated by Copilot: Attach hover event
                             on_unhover=self._on_unhover,  # Generated by Copilot: Attach unhover event
-                            on_click=self._on_click  # Generated by Copilot: Attach click event
+                            on_click=self._on_click,  # Generated by Copilot: Attach click event
+                            edges=edges,
+                            recorder=recorder,
+                            scheduler=scheduler,
+                            hovertemplate=hovertemplate,
+                            shared_store=shared_store,
                             )
         self.setup_bin_layer()
         
@@ -135,6 +172,14 @@ class BinHighlighter(BinManager):
         self.only_show = only_show
         
         self._setup_selection_layer = setup_selection_layer
+        
+        self.tracer = tracer
+        
+        self.stacked = stacked
+        # per bin (rows of self.bins) and stack segment counts, see _update_stack_table
+        self.stack_counts = None
+        self.stack_labels = []
+        self.stack_colors = []
 
 
     def clear_callbacks(self):
@@ -162,6 +207,83 @@ class BinHighlighter(BinManager):
     
     
 
+    def _create_stack_trace(self) -> go.Bar:
+        n = len(self.stack_labels)
+        return go.Bar(
+            name="hover_stack",
+            meta="hover_stack_meta",
+            x=[0] * n,
+            y=[0] * n,
+            base=[0] * n,
+            width=self.dx * self.bin_width,
+            marker={"color": self.stack_colors, "line": {"color": self.line_color, "width": self.line_width}},
+            customdata=self.stack_labels,
+            hoverinfo="skip",
+            zorder=0,
+            visible=False,
+            showlegend=False,
+        )
+    
+    def _update_stack_table(self):
+        """
+        Counts of the stack segments in every bin, from the per-layer count columns of the
+        bin table: each subset, plus the rest of its data, or every data layer if there are
+        no subsets.
+
+        The table only has a count per layer, not per row, so rows in several (overlapping)
+        subsets can not be split between them. The subset segments are clipped so the stack
+        of a data layer never exceeds its count: a row is drawn in the first subset that
+        reaches it, and a later subset is cut short by the overlap. Subsets of data that is
+        not shown can not be clipped and are stacked with their full count.
+        """
+        self.stack_counts, self.stack_labels, self.stack_colors = None, [], []
+        if self.customdata is None:
+            return
+        first = len(self.CUSTOMDATA_COLUMNS)
+        column = {label: first + k for k, label in enumerate(self.customdata_labels[first:])}
+        layers = [layer for layer in self.viewer.state.layers if hasattr(layer, "histogram") and layer.layer.label in column]
+        is_subset = lambda layer: getattr(layer.layer, "data", layer.layer) is not layer.layer
+        subsets = [layer for layer in layers if is_subset(layer)]
+        counts, labels, colors = [], [], []
+        if len(subsets) > 0:
+            parents = {id(layer.layer.data): layer.layer.data for layer in subsets}
+            for parent in parents.values():
+                parent_layer = next((layer for layer in layers if layer.layer is parent), None)
+                kids = [layer for layer in subsets if layer.layer.data is parent]
+                kid_counts = [self.customdata[:, column[layer.layer.label]] for layer in kids]
+                if parent_layer is not None:
+                    # overlapping subsets would otherwise stack the shared rows twice
+                    top = np.minimum(np.cumsum(kid_counts, axis=0), self.customdata[:, column[parent.label]])
+                    kid_counts = list(np.diff(top, axis=0, prepend=0))
+                counts.extend(kid_counts)
+                labels.extend(layer.layer.label for layer in kids)
+                colors.extend(getattr(layer, "color", self.fill_color) for layer in kids)
+                if parent_layer is not None:
+                    # the rows of the data in none of its subsets (subsets may overlap)
+                    rest = self.customdata[:, column[parent.label]] - np.sum(kid_counts, axis=0)
+                    counts.append(np.clip(rest, 0, None))
+                    labels.append(parent.label)
+                    colors.append(getattr(parent_layer, "color", self.fill_color))
+        else:
+            for layer in layers:
+                counts.append(self.customdata[:, column[layer.layer.label]])
+                labels.append(layer.layer.label)
+                colors.append(getattr(layer, "color", self.fill_color))
+        if len(counts) == 0:
+            return
+        self.stack_counts = np.column_stack(counts)
+        self.stack_labels = labels
+        self.stack_colors = colors
+    
+    def _stack_patch(self, x: float) -> Optional[dict]:
+        """Trace update for the segments of the bin nearest x. O(layers)"""
+        i = self.nearest_bin_index(x)
+        if i is None or self.stack_counts is None:
+            return None
+        row = self.stack_counts[i]
+        base = np.cumsum(row) - row
+        return {"x": [self.bins[i]] * len(row), "y": row, "base": base, "width": self.widths[i] * self.bin_width, "visible": True}
+    
     def setup_bin_highlight(self, on_hover_callback: Optional[Callable] = None) -> None:
         """
         Setup the bin highlighting.
@@ -183,7 +305,11 @@ class BinHighlighter(BinManager):
         
 
         # Add the trace to be shown on hover
-        self.viewer.figure.add_trace(self._create_hover_trace())
+        if self.stacked:
+            self._update_stack_table()
+            self.viewer.figure.add_trace(self._create_stack_trace())
+        else:
+            self.viewer.figure.add_trace(self._create_hover_trace())
 
         # append user supplied callback
         if on_hover_callback is not None:
@@ -205,40 +331,68 @@ class BinHighlighter(BinManager):
     
     def add_callbacks_to_selection_layer(self):
         if hasattr(self.viewer, "selection_layer"):
+            dispatcher = selection_dispatcher(self.viewer)
             if self.highlight_on_click:
-                self.viewer.selection_layer.on_click(self._on_hover)
+                dispatcher.register("click", self._on_hover)
             else:
-                self.viewer.selection_layer.on_hover(self._on_hover)
-                self.viewer.selection_layer.on_unhover(self._on_unhover)
+                dispatcher.register("hover", self._on_hover)
+                dispatcher.register("unhover", self._on_unhover)
 
     
 
     @property
     def highlight_trace(self) -> Optional[go.Bar]:
-        return next(self.viewer.figure.select_traces({"meta": "hover_trace_meta"}), None)
+        meta = "hover_stack_meta" if self.stacked else "hover_trace_meta"
+        return next(self.viewer.figure.select_traces({"meta": meta}), None)
 
     
     def _on_hover(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        self._record("hover", points)
         if len(points.xs) > 0:  # hover condition
-            if self.highlight_trace:  # hover condition
-                self.highlight_trace.x = [self.nearest_bin(points.xs[0])]
-                self.highlight_trace.dx = self.dx * self.bin_width # type: ignore
-                self.highlight_trace.visible = True
+            start = now_ms() if self.tracer is not None else None
+            highlight_trace = self.highlight_trace
+            if highlight_trace:  # hover condition
+                if self.stacked:
+                    patch = self._stack_patch(points.xs[0])
+                    if patch is None:
+                        return
+                else:
+                    patch = {"x": [self.nearest_bin(points.xs[0])], "dx": self.dx * self.bin_width, "visible": True} # type: ignore
+                if self.custom_edges is not None and not self.stacked:
+                    # variable width bins
+                    patch["width"] = self.bin_width_at(points.xs[0]) * self.bin_width
+                if self.tracer is not None:
+                    # lets the browser match the trace update to the hover that caused it
+                    patch["customdata"] = [points.xs[0]]
+                self._update_highlight(highlight_trace, patch)
+                if self.tracer is not None:
+                    self.tracer.kernel_hover(points.xs[0], start, now_ms())
                 # run hover callbacks
                 if self.hover_callbacks is not None:
                     for callback in self.hover_callbacks:
                         callback(trace, points, state)
 
+    def _update_highlight(self, highlight_trace: go.Bar, patch: dict):
+        if self.scheduler is not None:
+            self.scheduler.submit(highlight_trace, patch, priority=HIGH)
+        else:
+            # one trace update message instead of one per property
+            with self.viewer.figure.batch_update():
+                highlight_trace.update(patch)
+
     def _on_unhover(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        self._record("unhover", points)
         if len(points.xs) == 0:  # unhover condition
-            if self.highlight_trace:
-                self.highlight_trace.visible = False
+            highlight_trace = self.highlight_trace
+            if highlight_trace:
+                self._update_highlight(highlight_trace, {"visible": False})
                 if self.unhover_callbacks is not None:
                     # run unhover callbacks
                     for callback in self.unhover_callbacks:
                         callback(trace, points, state)
     
     def _on_click(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        self._record("click", points)
         if self.highlight_trace:
             if self.click_callbacks is not None:
                 for callback in self.click_callbacks:
@@ -255,7 +409,7 @@ class BinHighlighter(BinManager):
         # print('turn_off_bin_highlight')
         if self.highlight_trace:
             # Get all traces except the highlight trace
-            traces_to_keep = lambda t: t != self.highlight_trace and getattr(t, "meta", None) != "hover_trace_meta"
+            traces_to_keep = lambda t: t != self.highlight_trace and getattr(t, "meta", None) not in ("hover_trace_meta", "hover_stack_meta")
             self.viewer.figure.data = tuple(
                 filter(traces_to_keep, self.viewer.figure.data)
             )
@@ -263,13 +417,20 @@ class BinHighlighter(BinManager):
         self.turn_off_bins()
 
         if hasattr(self.viewer, "selection_layer"):
-            self.viewer.selection_layer._hover_callbacks = [cb for cb in self.viewer.selection_layer._hover_callbacks if cb != self._on_hover]
-            self.viewer.selection_layer._unhover_callbacks = [cb for cb in self.viewer.selection_layer._unhover_callbacks if cb != self._on_unhover]
+            dispatcher = selection_dispatcher(self.viewer)
+            dispatcher.unregister("click", self._on_hover)
+            dispatcher.unregister("hover", self._on_hover)
+            dispatcher.unregister("unhover", self._on_unhover)
 
         self.enabled = False
     
     
         
+    def close(self):
+        """Remove the highlight, bins and callbacks for good"""
+        self.turn_off_bin_highlight()
+        super().close()
+    
     def show_hide_all_bins(self, show = None):
         if self.bin_layer is None: return
         if show is None:
@@ -284,6 +445,11 @@ class BinHighlighter(BinManager):
     @debounce(.1)
     def redraw(self):
         """Redwaw the bin highlight"""
+        self._schedule(self._redraw, "redraw")
+    
+    def _redraw(self):
+        if self.closed:
+            return
         # if self.enabled:
         # print('redraw')
         self.turn_off_bin_highlight()
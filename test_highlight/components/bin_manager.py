@@ -0,0 +1,514 @@
+import numpy as np
+import plotly.graph_objects as go
+from plotly.basedatatypes import BaseTraceType
+from plotly.callbacks import Points, InputDeviceState
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from time import sleep
+from cosmicds.utils import debounce
+
+from ..columnar import full_values
+from .binning import BIN_TABLE_COLUMNS, bin_table, bin_table_key, bin_table_name
+from .callback_dispatcher import selection_dispatcher
+from .range_stats import viewer_range_stats
+
+# bin tables by content key, shared by the BinManagers of this process (e.g. when
+# the highlight mode is switched and a new manager is made for the same bins)
+_BIN_TABLES: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_BIN_TABLES_SIZE = 32
+
+
+def _as_tuple(value):
+    """Lists back to (nested) tuples, e.g. a cache key that went through json"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_as_tuple(v) for v in value)
+    return value
+
+
+class BinManager:
+    """Base class for managing histogram bins"""
+    
+    # leading columns of the customdata matrix attached to the bin layer,
+    # followed by one count column per histogram layer (see customdata_labels)
+    CUSTOMDATA_COLUMNS = BIN_TABLE_COLUMNS
+    
+    def __init__(
+        self,
+        viewer,
+        bin_width: float = 1.0,
+        selection_bin_width: float = 1.0,
+        show_bins_with_data_only: bool = False,
+        visible_bins: bool = True,
+        use_selection_layer: bool = True,
+        on_click: Optional[Callable] = None,
+        on_hover: Optional[Callable] = None,
+        on_unhover: Optional[Callable] = None,
+        make_bins: bool = True,
+        edges: Optional[np.ndarray] = None,
+        hovertemplate: Optional[str | Callable[["BinManager"], str]] = None,
+        recorder = None,
+        scheduler = None,
+        shared_store = None,
+    ):
+        self.viewer = viewer
+        self.bin_width = bin_width
+        self.selection_bin_width = selection_bin_width
+        self.only_show_with_data = show_bins_with_data_only
+        self.visible_bins = visible_bins
+        self.make_bins = make_bins
+        self.traces_added = False
+        self.closed = False
+        self.bins = None
+        self.dx = None
+        self.widths = None
+        self.ymax = None
+        # explicit (possibly variable width) edges, e.g. from binning.BinningEngine
+        # when None the edges come from viewer.state.bins
+        self.custom_edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.edges = None
+        
+        # per-bin statistics rendered by plotly in the browser with hovertemplate
+        self.hovertemplate = hovertemplate
+        self.customdata = None
+        self.customdata_labels = list(self.CUSTOMDATA_COLUMNS)
+        self._full_customdata = None
+        self._customdata_key = None
+        # optional shared_data.SharedArrayStore. When set, the per-bin tables are
+        # computed once and memory mapped by every worker. Only for static data:
+        # every new table is written to disk and stays there
+        self.shared_store = shared_store
+        
+        # opt-in interaction_recorder.InteractionRecorder
+        self.recorder = recorder
+        self.recorder_source = recorder.register_viewer(viewer) if recorder is not None else None
+        
+        # optional update_scheduler.UpdateScheduler of the viewer. Redraws are queued
+        # behind hover feedback instead of being sent right away
+        self.scheduler = scheduler
+        
+        # called with this manager whenever the bin layer is added or removed,
+        # e.g. to send the bin intervals to the browser (see _PlotlyHighlighting.follow)
+        self.bins_callbacks: list[Callable[["BinManager"], None]] = []
+        
+        # subclasses pass their own handlers, which record the events themselves
+        self.on_click = self._recorded("click", on_click)
+        self.on_hover = self._recorded("hover", on_hover)
+        self.on_unhover = self._recorded("unhover", on_unhover)
+        
+        # I don't know if all viewers with histograms have 
+        # a selection layer. I think, but just in case
+        if not hasattr(viewer, 'selection_layer'):
+            self.use_selection_layer = False
+        else:
+            self.use_selection_layer = use_selection_layer
+
+    def _record(self, kind: str, points: Optional[Points] = None, **payload):
+        if self.recorder is None:
+            return
+        if points is not None:
+            self.recorder.record_points(kind, self.recorder_source, points)
+        else:
+            self.recorder.record(kind, self.recorder_source, **payload)
+    
+    def _recorded(self, kind: str, callback: Optional[Callable]) -> Optional[Callable]:
+        if self.recorder is None or callback is None or getattr(callback, "__self__", None) is self:
+            return callback
+        return self.recorder.wrap(kind, self.recorder_source, callback)
+
+    def _calculate_bins(self):
+        # Copy existing bin calculation logic
+        bin_edges = self.custom_edges if self.custom_edges is not None else self.viewer.state.bins
+        if bin_edges is None:
+            return
+        self.edges = np.asarray(bin_edges, dtype=float)
+        self.bins = (bin_edges[0:-1] + bin_edges[1:]) / 2
+        self.widths = np.diff(bin_edges)
+        self.dx = bin_edges[1] - bin_edges[0]
+        # print("finding dx", self.dx)
+        self.ymax = self.viewer.state.y_max
+    
+    def _filter_bins(self):
+        if self.bins is None: return
+        
+        keep = np.full_like(self.bins, False, dtype=bool)
+        for layer in self.viewer.state.layers:
+            if hasattr(layer, "histogram"):
+                data = self._layer_counts(layer)
+                if data is not None:
+                    keep = keep | (data > 0)
+        bins = self.bins[keep]
+        self.bins = bins
+        self.widths = self.widths[keep]
+        if self.customdata is not None:
+            self.customdata = self.customdata[keep]
+    
+    def _layer_counts(self, layer) -> np.ndarray | None:
+        """Counts of a histogram layer in the current (unfiltered) bins"""
+        if self.custom_edges is None:
+            return layer.histogram[1]
+        # glue bins the layer with viewer.state.bins, so re-bin on the custom edges
+        try:
+            values = np.asarray(layer.layer[self.viewer.state.x_att], dtype=float).ravel()
+        except Exception:
+            return None
+        return np.histogram(values[np.isfinite(values)], bins=self.custom_edges)[0]
+        
+    def _histogram_layer_values(self):
+        """(label, x values, is subset) for every histogram layer in the viewer"""
+        layers = []
+        for layer in self.viewer.state.layers:
+            if not hasattr(layer, "histogram"):
+                continue
+            try:
+                # full precision, also when the layer is plotted from a float32 copy (columnar.py)
+                values = np.asarray(full_values(layer.layer, self.viewer.state.x_att), dtype=float).ravel()
+            except Exception:
+                continue
+            is_subset = getattr(layer.layer, "data", layer.layer) is not layer.layer
+            layers.append((layer.layer.label, values, is_subset))
+        return layers
+    
+    def _covers_layers(self, layers) -> bool:
+        """Whether the edges span the values of every layer (the default bins, not a zoomed in range)"""
+        for _, values, _ in layers:
+            finite = values[np.isfinite(values)]
+            if finite.size and (finite.min() < self.edges[0] or finite.max() > self.edges[-1]):
+                return False
+        return True
+    
+    def _update_customdata(self):
+        """Rebuild the per-bin customdata matrix, but only if the bins or the data changed"""
+        if self.edges is None:
+            return
+        layers = self._histogram_layer_values()
+        key = bin_table_key(self.edges, layers)
+        if key != self._customdata_key:
+            if key in _BIN_TABLES:
+                _BIN_TABLES.move_to_end(key)
+                self._full_customdata = _BIN_TABLES[key]
+            elif self.shared_store is not None and self._covers_layers(layers):
+                # the table only depends on the content, so workers can share it
+                # (and `python -m test_highlight.precompute` can write it ahead of time).
+                # Only for bins over the whole data: every zoom has new edges, and sharing
+                # those would add a store entry per zoom
+                table = self.shared_store.get_or_create(bin_table_name(key), lambda: {"customdata": bin_table(self.edges, layers)})
+                self._full_customdata = table["customdata"]
+            else:
+                self._full_customdata = bin_table(self.edges, layers)
+            _BIN_TABLES[key] = self._full_customdata
+            if len(_BIN_TABLES) > _BIN_TABLES_SIZE:
+                _BIN_TABLES.popitem(last=False)
+            self.customdata_labels = list(self.CUSTOMDATA_COLUMNS) + [label for label, _, _ in layers]
+            self._customdata_key = key
+        self.customdata = self._full_customdata
+    
+    def customdata_index(self, name: str) -> int:
+        """Column of `name` (a CUSTOMDATA_COLUMNS entry or a layer label) in the customdata matrix"""
+        return self.customdata_labels.index(name)
+    
+    def default_hovertemplate(self, unit: Optional[str] = None) -> str:
+        """Tooltip with the bin range, count, mean and the count of every layer"""
+        unit_str = f" {unit}" if unit else ""
+        lines = [
+            f"%{{customdata[4]:,.1f}} – %{{customdata[5]:,.1f}}{unit_str}",
+            "count: %{customdata[0]}",
+            f"mean: %{{customdata[1]:,.1f}}{unit_str}",
+        ]
+        for i, label in enumerate(self.customdata_labels[len(self.CUSTOMDATA_COLUMNS):], start=len(self.CUSTOMDATA_COLUMNS)):
+            lines.append(f"{label}: %{{customdata[{i}]}}")
+        return "<br>".join(lines) + "<extra></extra>"
+    
+    def _resolved_hovertemplate(self) -> Optional[str]:
+        if callable(self.hovertemplate):
+            return self.hovertemplate(self)
+        return self.hovertemplate
+    
+    def set_hovertemplate(self, hovertemplate: Optional[str | Callable[["BinManager"], str]]):
+        """
+        Set the tooltip of the bin layer. The template can reference the columns of the
+        customdata matrix (see customdata_labels), e.g. "%{customdata[0]} students".
+        Plotly renders it in the browser, so no hover callback is needed.
+        """
+        self.hovertemplate = hovertemplate
+        if self.bin_layer is not None:
+            with self.viewer.figure.batch_update():
+                self.bin_layer.update(hovertemplate=self._resolved_hovertemplate(), hoverinfo=self._bin_layer_hoverinfo())
+                self._update_selection_layer_hoverinfo()
+    
+    def _bin_layer_hoverinfo(self) -> Optional[str]:
+        if self.use_selection_layer and self.hovertemplate is None:
+            return "skip"
+        return None
+    
+    def _update_selection_layer_hoverinfo(self):
+        # with a bin tooltip the selection layer still needs hover events, but no label of its own
+        if self.use_selection_layer and hasattr(self.viewer, "selection_layer"):
+            self.viewer.selection_layer.update(hoverinfo="all" if self.hovertemplate is None else "none")
+        
+    def _create_bin_layer(self, marker_style) -> go.Bar | None:
+        if self.dx is None or self.bins is None:
+            raise ValueError("Bin layer creation failed: Bins or dx is None")
+        bar = go.Bar(
+                name="all_bins",
+                meta="all_bins_meta",
+                x=self.bins,
+                y=[self.ymax * 1.2 if self.ymax is not None else self.ymax] * len(self.bins),
+                width=self.widths * self.selection_bin_width,
+                marker=marker_style,
+                hoverinfo=self._bin_layer_hoverinfo(),  # must capture the hover. skip will not work
+                customdata=self.customdata,
+                hovertemplate=self._resolved_hovertemplate(),
+                zorder=1000,
+                visible=True,
+                showlegend=False,
+            )
+        return bar
+    
+    def nearest_bin_index(self, x: float) -> int | None:
+        """Index of the bin center nearest to x (bins are sorted, so this is a binary search)"""
+        if self.bins is None or len(self.bins) == 0:
+            return None
+        i = int(np.searchsorted(self.bins, x))
+        if i == len(self.bins) or (i > 0 and x - self.bins[i - 1] <= self.bins[i] - x):
+            i -= 1
+        if np.abs(x - self.bins[i]) > self.widths[i]:
+            return None
+        return i
+
+    def nearest_bin(self, x: float) -> float | None:
+        if self.bins is None:
+            return x
+        i = self.nearest_bin_index(x)
+        if i is None:
+            return None
+        return self.bins[i]
+
+    def bin_width_at(self, x: float) -> float | None:
+        """Width of the bin nearest to x (bins may have variable width)"""
+        i = self.nearest_bin_index(x)
+        if i is None:
+            return self.dx
+        return self.widths[i]
+
+    def range_stats(self, lo: Optional[float] = None, hi: Optional[float] = None, layers: bool = False) -> dict:
+        """Count, sum, mean, std, median, min and max of the viewer's data in [lo, hi), in O(log n) (see range_stats.py)"""
+        return viewer_range_stats(self.viewer, lo, hi, layers=layers)
+    
+    def bin_range_stats(self, x: float, layers: bool = False) -> Optional[dict]:
+        """`range_stats` of the bin nearest to x, e.g. for a clicked bin. Like np.histogram the last bin includes its right edge"""
+        i = self.nearest_bin_index(x)
+        if i is None or self.edges is None:
+            return None
+        # self.bins may be filtered, so find the bin in the edges
+        j = int(np.clip(np.searchsorted(self.edges, self.bins[i], side="right") - 1, 0, len(self.edges) - 2))
+        lo, hi = self.edges[j], self.edges[j + 1]
+        if j == len(self.edges) - 2:
+            hi = np.nextafter(hi, np.inf)
+        return self.range_stats(lo, hi, layers=layers)
+    
+    def hit_intervals(self) -> np.ndarray | None:
+        """(lo, hi) of each bin of the bin layer as drawn (after filtering, scaled by selection_bin_width)"""
+        if self.bins is None or self.widths is None:
+            return None
+        half = self.widths * self.selection_bin_width / 2
+        return np.column_stack((self.bins - half, self.bins + half))
+    
+    def on_bins_changed(self, callback: Callable[["BinManager"], None]) -> Callable[[], None]:
+        """Call `callback(self)` whenever the bin layer changes. Returns a function that removes it"""
+        self.bins_callbacks.append(callback)
+        def remove():
+            if callback in self.bins_callbacks:
+                self.bins_callbacks.remove(callback)
+        return remove
+    
+    def _bins_changed(self):
+        for callback in self.bins_callbacks:
+            callback(self)
+    
+    def setup_bin_layer(self):
+        # print("Setting up bins")
+        self._calculate_bins()
+        if self.bins is None or self.dx is None:
+            return
+        self._record("bins",
+                     nbins=getattr(self.viewer.state, "hist_n_bin", None),
+                     edges=None if self.custom_edges is None else self.custom_edges.tolist())
+
+        self._update_customdata()
+        if self.only_show_with_data:
+            self._filter_bins()
+        
+        self._add_bin_layer()
+    
+    def _add_bin_layer(self):
+        if self.visible_bins:
+            marker_style = {"color": "rgba(0,0,0,0)", "line": {"color": "rgba(0,0,0,1)"}}
+        else:
+            marker_style = {"color": "rgba(0,0,0,0)", "line": {"color": "rgba(0,0,0,0)"}}
+        
+        if self.make_bins or not self.use_selection_layer:
+            self.viewer.figure.add_trace(self._create_bin_layer(marker_style = marker_style))
+
+        self.traces_added = True
+        self._bins_changed()
+        
+
+        self.setup_selection_layer()
+        if self.hovertemplate is not None:
+            self._update_selection_layer_hoverinfo()
+        if not self.use_selection_layer:
+            bin_layer = self.bin_layer
+            if bin_layer:
+                # print('adding callbacks')
+                self.add_callbacks_to_bin_layer()
+    
+    # scalar attributes and arrays that make up the computed bins, see snapshot_state
+    _SNAPSHOT_VALUES = ("dx", "ymax", "bin_width", "selection_bin_width", "only_show_with_data", "customdata_labels")
+    _SNAPSHOT_ARRAYS = ("edges", "bins", "widths", "custom_edges", "customdata", "_full_customdata")
+    
+    def snapshot_state(self) -> Optional[dict]:
+        """The computed bins and bin tables, to restore the bin layer later without recomputing it"""
+        if self.bins is None:
+            return None
+        state = {name: getattr(self, name) for name in self._SNAPSHOT_VALUES + self._SNAPSHOT_ARRAYS}
+        state["customdata_key"] = self._customdata_key
+        return state
+    
+    def restore_state(self, state: dict):
+        """Set the bins from `snapshot_state` (possibly after a json round trip)"""
+        for name in self._SNAPSHOT_VALUES:
+            setattr(self, name, state.get(name, getattr(self, name)))
+        for name in self._SNAPSHOT_ARRAYS:
+            value = state.get(name)
+            setattr(self, name, None if value is None else np.asarray(value, dtype=float))
+        self.customdata_labels = list(self.customdata_labels)
+        self._customdata_key = _as_tuple(state.get("customdata_key"))
+    
+    def snapshot_matches(self, state: dict, versions: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Whether `snapshot_state` was taken of the viewer's current bins and data, i.e. its bin table is current.
+        `versions` are the known content hashes of the datasets by label (`viewer_snapshot.viewer_source`),
+        so only the subsets are hashed
+        """
+        edges, key = state.get("edges"), state.get("customdata_key")
+        if edges is None or key is None:
+            return False
+        edges = np.asarray(edges, dtype=float)
+        if state.get("custom_edges") is None:
+            current = self.viewer.state.bins
+            if current is None or not np.array_equal(np.asarray(current, dtype=float), edges):
+                return False
+        return bin_table_key(edges, self._histogram_layer_values(), versions) == _as_tuple(key)
+    
+    def restore_bin_layer(self, state: dict, versions: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Restore the bins and add the bin layer from them, without histogramming the data again.
+        Returns False, and restores nothing, if the bins or the data changed since the snapshot.
+        """
+        if not self.snapshot_matches(state, versions):
+            return False
+        self.restore_state(state)
+        if self.bins is None or self.dx is None:
+            return False
+        self._add_bin_layer()
+        return True
+    
+    def add_callbacks_to_bin_layer(self):
+        if self.bin_layer:
+            if self.on_click:
+                self.bin_layer.on_click(self.on_click)
+            if self.on_hover:
+                self.bin_layer.on_hover(self.on_hover)
+            if self.on_unhover:
+                self.bin_layer.on_unhover(self.on_unhover)
+    
+    def setup_selection_layer(self):
+        if not hasattr(self.viewer, 'selection_layer'):
+            raise AttributeError(f'Can not setup the selection layer as viewer {self.viewer} has not selection layer')
+        resolution = 200
+        def new_update_selection(viewer=self.viewer):
+            state = viewer.state
+            x0 = state.x_min
+            dx = (state.x_max - state.x_min) * (1/resolution)
+            y0 = state.y_min
+            dy = (state.y_max - state.y_min) * 2
+            viewer.selection_layer.update(x0=x0 - dx, dx=dx, y0=y0, dy=dy)
+        self.viewer.set_selection_active(True)
+        self.viewer.figure.update_layout(clickmode="event", hovermode="closest", showlegend=False)
+        self.viewer.selection_layer.update(visible=True, z=[list(range(resolution + 1))], opacity=0, coloraxis="coloraxis")
+        self.viewer.figure.update_coloraxes(showscale=False)
+        new_update_selection()
+        self.viewer._update_selection_layer_bounds = new_update_selection
+        self.reset_selection_layer()
+    
+    def reset_selection_layer(self):
+        self.viewer.set_selection_active(True)
+        self.viewer.selection_layer.update(visible=True, z=[list(range(201))], opacity=0, coloraxis="coloraxis")
+        self.viewer.figure.update_coloraxes(showscale=False)
+        
+    def add_callbacks_to_selection_layer(self):
+        if hasattr(self.viewer, "selection_layer"):
+            # one dispatcher per selection layer: registering twice does not call twice
+            dispatcher = selection_dispatcher(self.viewer)
+            if self.on_click:
+                dispatcher.register("click", self.on_click)
+            if self.on_hover:
+                dispatcher.register("hover", self.on_hover)
+            if self.on_unhover:
+                dispatcher.register("unhover", self.on_unhover)
+                
+    def remove_callbacks_from_selection_layer(self):
+        if hasattr(self.viewer, "selection_layer"):
+            dispatcher = selection_dispatcher(self.viewer)
+            for event, callback in (("click", self.on_click), ("hover", self.on_hover), ("unhover", self.on_unhover)):
+                if callback:
+                    dispatcher.unregister(event, callback)
+
+    
+    @property
+    def bin_layer(self) -> Optional[go.Bar]:
+        return next(self.viewer.figure.select_traces({"meta": "all_bins_meta"}), None)
+    
+    def turn_off_bins(self):
+        if self.bin_layer:
+            traces_to_keep = lambda t: t != self.bin_layer and getattr(t, "meta", None) != "all_bins_meta"
+            self.viewer.figure.data = tuple(filter(traces_to_keep, self.viewer.figure.data))
+            self.traces_added = False
+            self._bins_changed()
+    
+    def close(self):
+        """Remove the bin layer and callbacks for good. Pending (debounced) redraws are dropped"""
+        self.closed = True
+        self.turn_off_bins()
+        self.remove_callbacks_from_selection_layer()
+    
+    def _schedule(self, update: Callable, key: str):
+        if self.closed:
+            return
+        if self.scheduler is not None:
+            self.scheduler.submit_call(update, priority=LOW, key=(id(self), key))
+        else:
+            update()
+    
+    def _redraw_bins(self):
+        if self.closed:
+            return
+        self.turn_off_bins()
+        self.setup_bin_layer()
+    
+    @debounce(.1)
+    def redraw_bins(self):
+        self._schedule(self._redraw_bins, "redraw_bins")
+    
+    def set_visible_bin_width(self, width: float):
+        self.selection_bin_width = width
+        self.redraw_bins()
+
+    def set_edges(self, edges: Optional[np.ndarray], redraw: bool = True):
+        """
+        Use explicit bin edges instead of viewer.state.bins. Pass None to follow the viewer again.
+        With `redraw=False` the caller redraws (e.g. the replayer, which times the redraw)
+        """
+        self.custom_edges = None if edges is None else np.asarray(edges, dtype=float)
+        if redraw and self.traces_added:
+            self.redraw_bins()
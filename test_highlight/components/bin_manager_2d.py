@@ -0,0 +1,430 @@
+import numpy as np
+import plotly.graph_objects as go
+from plotly.basedatatypes import BaseTraceType
+from plotly.callbacks import Points, InputDeviceState
+from typing import Callable, Dict, Optional, Tuple
+from uuid import uuid4
+from cosmicds.utils import debounce
+
+from .binning import data_version, is_uniform
+from .update_scheduler import HIGH, LOW
+
+
+class GridIndex:
+    """
+    Cell lookup and per-cell statistics for a 2D grid of (possibly variable width) bins.
+
+    On a uniform axis the cell of a value is one subtraction and division, otherwise a
+    binary search over the edges. The statistics of all cells are computed in one
+    vectorized pass over the rows (flat cell index + `np.bincount`), like `np.histogram2d`
+    but also giving the sums needed for the cell means.
+    """
+
+    def __init__(self, x_edges, y_edges):
+        self.x_edges = np.asarray(x_edges, dtype=float)
+        self.y_edges = np.asarray(y_edges, dtype=float)
+        if self.x_edges.size < 2 or self.y_edges.size < 2:
+            raise ValueError("GridIndex needs at least two edges per axis")
+        self.nx = self.x_edges.size - 1
+        self.ny = self.y_edges.size - 1
+        self._x_uniform = is_uniform(self.x_edges)
+        self._y_uniform = is_uniform(self.y_edges)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (self.nx, self.ny)
+
+    @property
+    def x_centers(self) -> np.ndarray:
+        return (self.x_edges[:-1] + self.x_edges[1:]) / 2
+
+    @property
+    def y_centers(self) -> np.ndarray:
+        return (self.y_edges[:-1] + self.y_edges[1:]) / 2
+
+    @staticmethod
+    def _indices(values: np.ndarray, edges: np.ndarray, uniform: bool) -> np.ndarray:
+        """Bin of every value, -1 outside the edges. Like np.histogram the last bin includes its right edge"""
+        n = edges.size - 1
+        if uniform:
+            # NaN casts to an arbitrary integer (with a warning); it is set to -1 below
+            with np.errstate(invalid="ignore"):
+                index = np.floor((values - edges[0]) / (edges[1] - edges[0])).astype(np.intp)
+        else:
+            index = np.searchsorted(edges, values, side="right") - 1
+        index[values == edges[-1]] = n - 1
+        index[~((values >= edges[0]) & (values <= edges[-1]))] = -1
+        return np.minimum(index, n - 1)
+
+    def cells(self, x, y) -> np.ndarray:
+        """Flat cell index (i * ny + j) of every (x, y) pair, -1 outside the grid"""
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        ix = self._indices(x, self.x_edges, self._x_uniform)
+        iy = self._indices(y, self.y_edges, self._y_uniform)
+        return np.where((ix >= 0) & (iy >= 0), ix * self.ny + iy, -1)
+
+    def cell_at(self, x: float, y: float) -> Optional[Tuple[int, int]]:
+        """(i, j) of the cell containing the point, or None"""
+        cell = int(self.cells([x], [y])[0])
+        if cell < 0:
+            return None
+        return divmod(cell, self.ny)
+
+    def cell_bounds(self, i: int, j: int) -> Tuple[float, float, float, float]:
+        """x0, x1, y0, y1 of a cell"""
+        return self.x_edges[i], self.x_edges[i + 1], self.y_edges[j], self.y_edges[j + 1]
+
+    def counts(self, x, y) -> np.ndarray:
+        """Number of points in every cell as an (nx, ny) array"""
+        cells = self.cells(x, y)
+        return np.bincount(cells[cells >= 0], minlength=self.nx * self.ny).reshape(self.shape)
+
+    def statistics(self, x, y) -> Dict[str, np.ndarray]:
+        """count, sum_x and sum_y of every cell as (nx, ny) arrays"""
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        cells = self.cells(x, y)
+        inside = cells >= 0
+        cells = cells[inside]
+        size = self.nx * self.ny
+        return {
+            "count": np.bincount(cells, minlength=size).reshape(self.shape),
+            "sum_x": np.bincount(cells, weights=x[inside], minlength=size).reshape(self.shape),
+            "sum_y": np.bincount(cells, weights=y[inside], minlength=size).reshape(self.shape),
+        }
+
+
+class BinManager2D:
+    """
+    Hover highlighting and click selection of the cells of a 2D grid on a scatter viewer
+    (e.g. velocity against distance), the 2D counterpart of `BinManager`.
+
+    An invisible heatmap trace ("grid layer") covers the grid and captures the hover and
+    click events. The hovered cell is shown with one rectangle layout shape that is moved
+    from cell to cell. The per-cell counts, means and per-layer counts are cached and only
+    recomputed when the edges or the data change.
+
+    Library only: the pages of this app have no scatter viewer, so nothing here creates
+    one. An app with a glue-plotly scatter viewer creates it after adding the data, calls
+    `setup_grid_layer` and, on cleanup, `turn_off_grid`.
+
+    Example:
+        ```python
+        grid = BinManager2D(viewer, nx=20, ny=15, on_click=lambda i, j, stats: print(stats))
+        grid.setup_grid_layer()
+        grid.cell_stats(3, 4)  # {'count': ..., 'mean_x': ..., 'mean_y': ..., 'layers': {...}}
+        grid.turn_off_grid()
+        ```
+    """
+
+    # columns of the customdata attached to every cell of the grid layer
+    CUSTOMDATA_COLUMNS = ("count", "mean_x", "mean_y", "x0", "x1", "y0", "y1")
+
+    def __init__(
+        self,
+        viewer,
+        nx: int = 20,
+        ny: int = 20,
+        x_edges: Optional[np.ndarray] = None,
+        y_edges: Optional[np.ndarray] = None,
+        fill_color: str = "rgba(126,126,126,0.5)",
+        line_color: str = "white",
+        line_width: float = 1.0,
+        show_cells_with_data_only: bool = False,
+        visible_grid: bool = False,
+        on_hover: Optional[Callable] = None,
+        on_unhover: Optional[Callable] = None,
+        on_click: Optional[Callable] = None,
+        scheduler = None,
+    ):
+        """
+        Parameters
+        ----------
+        viewer : object
+            A viewer with a plotly figure and `x_att`/`y_att` in its state (e.g. a scatter viewer).
+        nx, ny : int, optional
+            Number of cells along x and y, spanning the viewer bounds. Ignored for an axis
+            with explicit edges. Default is 20.
+        x_edges, y_edges : array, optional
+            Explicit (possibly variable width) cell edges. Default is None.
+        fill_color, line_color, line_width : optional
+            Style of the hover rectangle.
+        show_cells_with_data_only : bool, optional
+            Only cells with data capture hover and clicks. Default is False.
+        visible_grid : bool, optional
+            Draw the cell counts faintly, useful for debugging. Default is False.
+        on_hover, on_unhover, on_click : Callable, optional
+            Called with `(i, j, stats)` of the cell (`on_unhover` with no arguments).
+        scheduler : UpdateScheduler, optional
+            The viewer's `update_scheduler`. The highlight is submitted with high priority and
+            redraws with low priority. Default is None.
+        """
+        self.viewer = viewer
+        self.nx = nx
+        self.ny = ny
+        self.custom_x_edges = None if x_edges is None else np.asarray(x_edges, dtype=float)
+        self.custom_y_edges = None if y_edges is None else np.asarray(y_edges, dtype=float)
+        self.fill_color = fill_color
+        self.line_color = line_color
+        self.line_width = line_width
+        self.only_show_with_data = show_cells_with_data_only
+        self.visible_grid = visible_grid
+        self.on_hover = on_hover
+        self.on_unhover = on_unhover
+        self.on_click = on_click
+        self.scheduler = scheduler
+
+        self.grid: Optional[GridIndex] = None
+        self.stats: Optional[Dict[str, np.ndarray]] = None
+        self.layer_counts: Dict[str, np.ndarray] = {}
+        self._stats_key = None
+        self.traces_added = False
+        self.hovered: Optional[Tuple[int, int]] = None
+        self.selected: Optional[Tuple[int, int]] = None
+        # the highlight shape has a unique name, so several managers can share a figure
+        self._shape_name = f"bin2d_highlight_{uuid4().hex[:8]}"
+        self._shape_index: Optional[int] = None
+
+    # ---- grid and statistics ----
+
+    def _axis_edges(self, custom: Optional[np.ndarray], lo: Optional[float], hi: Optional[float], n: int) -> Optional[np.ndarray]:
+        if custom is not None:
+            return custom
+        if lo is None or hi is None or not np.isfinite([lo, hi]).all() or lo == hi:
+            return None
+        return np.linspace(min(lo, hi), max(lo, hi), n + 1)
+
+    def _calculate_grid(self):
+        state = self.viewer.state
+        x_edges = self._axis_edges(self.custom_x_edges, getattr(state, "x_min", None), getattr(state, "x_max", None), self.nx)
+        y_edges = self._axis_edges(self.custom_y_edges, getattr(state, "y_min", None), getattr(state, "y_max", None), self.ny)
+        if x_edges is None or y_edges is None:
+            self.grid = None
+            return
+        self.grid = GridIndex(x_edges, y_edges)
+
+    def _layer_values(self):
+        """(label, x values, y values, is subset) for every layer of the viewer"""
+        state = self.viewer.state
+        layers = []
+        for layer in state.layers:
+            try:
+                x = np.asarray(layer.layer[state.x_att], dtype=float).ravel()
+                y = np.asarray(layer.layer[state.y_att], dtype=float).ravel()
+            except Exception:
+                continue
+            is_subset = getattr(layer.layer, "data", layer.layer) is not layer.layer
+            layers.append((layer.layer.label, x, y, is_subset))
+        return layers
+
+    def _update_stats(self):
+        """Recompute the per-cell statistics, but only if the grid or the data changed"""
+        if self.grid is None:
+            return
+        layers = self._layer_values()
+        key = (data_version(self.grid.x_edges), data_version(self.grid.y_edges),
+               tuple((label, data_version(x), data_version(y)) for label, x, y, _ in layers))
+        if key == self._stats_key:
+            return
+        data = [(x, y) for _, x, y, is_subset in layers if not is_subset]
+        x = np.concatenate([x for x, _ in data]) if len(data) > 0 else np.array([])
+        y = np.concatenate([y for _, y in data]) if len(data) > 0 else np.array([])
+        stats = self.grid.statistics(x, y)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean_x"] = np.where(stats["count"] > 0, stats["sum_x"] / stats["count"], np.nan)
+            stats["mean_y"] = np.where(stats["count"] > 0, stats["sum_y"] / stats["count"], np.nan)
+        self.stats = stats
+        self.layer_counts = {label: self.grid.counts(x, y) for label, x, y, _ in layers}
+        self._stats_key = key
+
+    def cell_stats(self, i: int, j: int) -> Optional[dict]:
+        """Count, means, bounds and per-layer counts of cell (i, j) from the cache"""
+        if self.grid is None or self.stats is None:
+            return None
+        x0, x1, y0, y1 = self.grid.cell_bounds(i, j)
+        return {
+            "count": int(self.stats["count"][i, j]),
+            "mean_x": float(self.stats["mean_x"][i, j]),
+            "mean_y": float(self.stats["mean_y"][i, j]),
+            "x0": x0, "x1": x1, "y0": y0, "y1": y1,
+            "layers": {label: int(counts[i, j]) for label, counts in self.layer_counts.items()},
+        }
+
+    def cell_at(self, x: float, y: float) -> Optional[Tuple[int, int]]:
+        if self.grid is None:
+            return None
+        return self.grid.cell_at(x, y)
+
+    # ---- traces ----
+
+    def _customdata(self) -> np.ndarray:
+        """(ny, nx, columns) array, in the row major order of the heatmap z"""
+        grid = self.grid
+        x0, y0 = np.meshgrid(grid.x_edges[:-1], grid.y_edges[:-1], indexing="ij")
+        x1, y1 = np.meshgrid(grid.x_edges[1:], grid.y_edges[1:], indexing="ij")
+        columns = [self.stats["count"], self.stats["mean_x"], self.stats["mean_y"], x0, x1, y0, y1]
+        return np.stack(columns, axis=-1).transpose(1, 0, 2)
+
+    def _create_grid_layer(self) -> go.Heatmap:
+        if self.grid is None or self.stats is None:
+            raise ValueError("Grid layer creation failed: the grid is None")
+        z = self.stats["count"].T.astype(float)
+        if self.only_show_with_data:
+            # gaps do not capture hover or clicks
+            z[z == 0] = np.nan
+        return go.Heatmap(
+            name="all_cells",
+            meta="all_cells_meta",
+            x=self.grid.x_edges,
+            y=self.grid.y_edges,
+            z=z,
+            customdata=self._customdata(),
+            hoverinfo="none" if not self.visible_grid else None,  # must capture the hover. skip will not work
+            hovertemplate="count: %{customdata[0]}<extra></extra>" if self.visible_grid else None,
+            hoverongaps=False,
+            colorscale=[[0, "rgba(0,0,0,0)"], [1, "rgba(0,0,0,0.25)" if self.visible_grid else "rgba(0,0,0,0)"]],
+            showscale=False,
+            zorder=1000,
+            showlegend=False,
+        )
+
+    @property
+    def grid_layer(self) -> Optional[go.Heatmap]:
+        return next(self.viewer.figure.select_traces({"meta": "all_cells_meta"}), None)
+
+    def setup_grid_layer(self):
+        self._calculate_grid()
+        if self.grid is None:
+            return
+        self._update_stats()
+        figure = self.viewer.figure
+        figure.add_trace(self._create_grid_layer())
+        grid_layer = self.grid_layer
+        grid_layer.on_hover(self._on_hover)
+        grid_layer.on_unhover(self._on_unhover)
+        grid_layer.on_click(self._on_click)
+        self._add_highlight_shape()
+        self.traces_added = True
+
+    def turn_off_grid(self):
+        if self.grid_layer:
+            keep = lambda t: getattr(t, "meta", None) != "all_cells_meta"
+            self.viewer.figure.data = tuple(filter(keep, self.viewer.figure.data))
+        self._remove_highlight_shape()
+        self.hovered = None
+        self.traces_added = False
+
+    def _schedule(self, update: Callable, key: str):
+        if self.scheduler is not None:
+            self.scheduler.submit_call(update, priority=LOW, key=(id(self), key))
+        else:
+            update()
+
+    def _redraw(self):
+        self.turn_off_grid()
+        self.setup_grid_layer()
+
+    @debounce(.1)
+    def redraw(self):
+        """Rebuild the grid (e.g. after a zoom), reusing the statistics if nothing changed"""
+        self._schedule(self._redraw, "redraw")
+
+    def set_edges(self, x_edges: Optional[np.ndarray] = None, y_edges: Optional[np.ndarray] = None):
+        """Use explicit cell edges. Pass None for an axis to span the viewer bounds again"""
+        self.custom_x_edges = None if x_edges is None else np.asarray(x_edges, dtype=float)
+        self.custom_y_edges = None if y_edges is None else np.asarray(y_edges, dtype=float)
+        if self.traces_added:
+            self.redraw()
+
+    # ---- highlight shape ----
+
+    def _flush_scheduled(self):
+        # queued updates to shapes are lost when layout.shapes is replaced, so send them first
+        if self.scheduler is not None:
+            self.scheduler.flush(force=True)
+
+    def _add_highlight_shape(self):
+        if self.highlight_shape is not None:
+            return
+        self._flush_scheduled()
+        shape = dict(type="rect", name=self._shape_name, xref="x", yref="y", x0=0, x1=0, y0=0, y1=0,
+                     fillcolor=self.fill_color, line={"color": self.line_color, "width": self.line_width},
+                     layer="above", visible=False)
+        self.viewer.figure.layout.shapes = tuple(self.viewer.figure.layout.shapes) + (shape,)
+        self._shape_index = len(self.viewer.figure.layout.shapes) - 1
+
+    def _remove_highlight_shape(self):
+        if self.highlight_shape is None:
+            return
+        self._flush_scheduled()
+        layout = self.viewer.figure.layout
+        layout.shapes = tuple(shape for shape in layout.shapes if shape.name != self._shape_name)
+        self._shape_index = None
+
+    @property
+    def highlight_shape(self):
+        shapes = self.viewer.figure.layout.shapes
+        i = self._shape_index
+        if i is None or i >= len(shapes) or shapes[i].name != self._shape_name:
+            # other code added or removed shapes
+            i = next((k for k, shape in enumerate(shapes) if shape.name == self._shape_name), None)
+            self._shape_index = i
+        return None if i is None else shapes[i]
+
+    def _update_highlight(self, patch: dict):
+        shape = self.highlight_shape
+        if shape is None:
+            return
+        if self.scheduler is not None:
+            self.scheduler.submit(shape, patch, priority=HIGH)
+        else:
+            with self.viewer.figure.batch_update():
+                shape.update(patch)
+
+    def highlight_cell(self, cell: Optional[Tuple[int, int]]):
+        """Move the highlight to cell (i, j), or hide it for None"""
+        if cell == self.hovered:
+            return
+        self.hovered = cell
+        if cell is None or self.grid is None:
+            self._update_highlight({"visible": False})
+            return
+        x0, x1, y0, y1 = self.grid.cell_bounds(*cell)
+        self._update_highlight({"x0": x0, "x1": x1, "y0": y0, "y1": y1, "visible": True})
+
+    # ---- events ----
+
+    def _event_cell(self, points: Points) -> Optional[Tuple[int, int]]:
+        if len(points.xs) == 0 or len(points.ys) == 0:
+            return None
+        return self.cell_at(points.xs[0], points.ys[0])
+
+    def _on_hover(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        cell = self._event_cell(points)
+        if cell is None:
+            return
+        self.highlight_cell(cell)
+        if self.on_hover is not None:
+            self.on_hover(*cell, self.cell_stats(*cell))
+
+    def _on_unhover(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        self.highlight_cell(None)
+        if self.on_unhover is not None:
+            self.on_unhover()
+
+    def _on_click(self, trace: BaseTraceType, points: Points, state: InputDeviceState) -> None:
+        cell = self._event_cell(points)
+        if cell is None:
+            return
+        self.selected = cell
+        if self.on_click is not None:
+            self.on_click(*cell, self.cell_stats(*cell))
+
+    def cell_mask(self, x, y, cell: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Which of the points are in `cell` (default: the selected cell), e.g. to make a subset"""
+        cell = self.selected if cell is None else cell
+        if cell is None or self.grid is None:
+            return np.zeros(np.size(x), dtype=bool)
+        i, j = cell
+        return self.grid.cells(x, y) == i * self.grid.ny + j
@@ -0,0 +1,342 @@
+"""
+Rule based histogram binning for the dotplot viewers.
+
+The rules compute bin edges directly from the data instead of relying on a
+hard-coded bin count. All rules are vectorized with NumPy, and the expensive
+ones (Knuth, Bayesian blocks) avoid per-row Python loops so they stay well
+within interactive latency on ~100k rows:
+
+- ``knuth`` sorts once and counts each candidate binning with ``searchsorted``
+  (O(M log N) per candidate instead of O(N)).
+- ``bayesian_blocks`` runs the O(K^2) dynamic program on at most ``max_cells``
+  pre-binned cells rather than on every row.
+
+Example:
+    ```python
+    from .binning import BINNING_ENGINE
+
+    edges = BINNING_ENGINE.apply_to_viewer(viewer, 'fd', bin_manager=bin_manager)
+    ```
+"""
+
+import math
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from ..columnar import full_values
+
+MAX_BINS = 500
+BAYESIAN_BLOCKS_MAX_CELLS = 1024
+
+
+def data_version(values) -> str:
+    """Return a content hash for an array, used as the data version in cache keys"""
+    values = np.ascontiguousarray(values)
+    digest = blake2b(values.tobytes(), digest_size=16)
+    digest.update(str((values.dtype.str, values.shape)).encode())
+    return digest.hexdigest()
+
+
+def _finite(values) -> np.ndarray:
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+
+def _edges_from_width(lo: float, hi: float, width: float, max_bins: int = MAX_BINS) -> np.ndarray:
+    if hi <= lo:
+        return np.array([lo - 0.5, hi + 0.5])
+    if not np.isfinite(width) or width <= 0:
+        nbins = 1
+    else:
+        nbins = int(np.clip(np.ceil((hi - lo) / width), 1, max_bins))
+    return np.linspace(lo, hi, nbins + 1)
+
+
+def freedman_diaconis_edges(values, max_bins: int = MAX_BINS) -> np.ndarray:
+    """Equal width bins with width ``2 IQR n^(-1/3)``"""
+    x = _finite(values)
+    if x.size == 0:
+        return np.array([0.0, 1.0])
+    q75, q25 = np.percentile(x, [75, 25])
+    width = 2 * (q75 - q25) * x.size ** (-1 / 3)
+    return _edges_from_width(x.min(), x.max(), width, max_bins)
+
+
+def scott_edges(values, max_bins: int = MAX_BINS) -> np.ndarray:
+    """Equal width bins with width ``3.49 sigma n^(-1/3)``"""
+    x = _finite(values)
+    if x.size == 0:
+        return np.array([0.0, 1.0])
+    width = 3.49 * np.std(x) * x.size ** (-1 / 3)
+    return _edges_from_width(x.min(), x.max(), width, max_bins)
+
+
+def knuth_edges(values, max_bins: int = MAX_BINS) -> np.ndarray:
+    """
+    Equal width bins maximizing Knuth's (2006) posterior for the number of bins.
+
+    The data are sorted once, so counting a candidate with ``M`` bins is a single
+    ``searchsorted`` on ``M - 1`` inner edges. ``lgamma(n_k + 1/2)`` is looked up
+    from a table built with a cumulative sum instead of calling ``lgamma`` per bin.
+    """
+    x = np.sort(_finite(values))
+    n = x.size
+    if n == 0:
+        return np.array([0.0, 1.0])
+    lo, hi = x[0], x[-1]
+    if hi <= lo:
+        return _edges_from_width(lo, hi, 0)
+
+    # lgamma(k + 1/2) for k = 0..n via lgamma(z + 1) = lgamma(z) + log(z)
+    lgamma_half = math.lgamma(0.5) + np.concatenate(([0.0], np.cumsum(np.log(np.arange(n) + 0.5))))
+
+    best_m, best_logp = 1, -np.inf
+    for m in range(1, min(max_bins, n) + 1):
+        inner = np.linspace(lo, hi, m + 1)[1:-1]
+        counts = np.diff(np.concatenate(([0], np.searchsorted(x, inner, side="left"), [n])))
+        logp = (
+            n * math.log(m)
+            + math.lgamma(m / 2)
+            - m * math.lgamma(0.5)
+            - math.lgamma(n + m / 2)
+            + lgamma_half[counts].sum()
+        )
+        if logp > best_logp:
+            best_m, best_logp = m, logp
+    return np.linspace(lo, hi, best_m + 1)
+
+
+def bayesian_blocks_edges(values, p0: float = 0.05, max_cells: int = BAYESIAN_BLOCKS_MAX_CELLS) -> np.ndarray:
+    """
+    Variable width bins from Scargle et al. (2013) Bayesian blocks (event data).
+
+    When the data have more than ``max_cells`` unique values they are first
+    histogrammed onto ``max_cells`` equal cells, and the optimal partition is
+    searched over the non-empty cells. This bounds the O(K^2) dynamic program
+    independently of the number of rows.
+    """
+    x = _finite(values)
+    n = x.size
+    if n == 0:
+        return np.array([0.0, 1.0])
+    lo, hi = x.min(), x.max()
+    if hi <= lo:
+        return _edges_from_width(lo, hi, 0)
+
+    t, nn = np.unique(x, return_counts=True)
+    if t.size > max_cells:
+        cell_edges = np.linspace(lo, hi, max_cells + 1)
+        nn, _ = np.histogram(x, bins=cell_edges)
+        t = 0.5 * (cell_edges[1:] + cell_edges[:-1])
+        keep = nn > 0
+        t, nn = t[keep], nn[keep]
+
+    cells = np.concatenate(([lo], 0.5 * (t[1:] + t[:-1]), [hi]))
+    block_length = hi - cells
+    prefix = np.concatenate(([0], np.cumsum(nn)))
+    ncp_prior = 4 - math.log(73.53 * p0 * n ** (-0.478))
+
+    k = t.size
+    best = np.zeros(k)
+    last = np.zeros(k, dtype=int)
+    for r in range(k):
+        width = block_length[: r + 1] - block_length[r + 1]
+        count = prefix[r + 1] - prefix[: r + 1]
+        fitness = count * (np.log(count) - np.log(width)) - ncp_prior
+        fitness[1:] += best[:r]
+        i_max = int(np.argmax(fitness))
+        last[r] = i_max
+        best[r] = fitness[i_max]
+
+    change_points = []
+    ind = k
+    while ind > 0:
+        change_points.append(ind)
+        ind = last[ind - 1]
+    change_points.append(0)
+    return cells[np.array(change_points[::-1])]
+
+
+def bin_statistics(values, edges) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, sum, min and max of ``values`` in each bin.
+
+    Like ``np.histogram`` the last bin includes its right edge. The values are
+    sorted once, so every statistic is a slice boundary or prefix-sum lookup.
+    """
+    x = np.sort(_finite(values))
+    edges = np.asarray(edges, dtype=float)
+    bounds = np.searchsorted(x, edges, side="left")
+    bounds[-1] = np.searchsorted(x, edges[-1], side="right")
+    counts = np.diff(bounds)
+    prefix = np.concatenate(([0.0], np.cumsum(x)))
+    sums = prefix[bounds[1:]] - prefix[bounds[:-1]]
+    has_data = counts > 0
+    mins = np.full(counts.shape, np.nan)
+    maxs = np.full(counts.shape, np.nan)
+    mins[has_data] = x[bounds[:-1][has_data]]
+    maxs[has_data] = x[bounds[1:][has_data] - 1]
+    return counts, sums, mins, maxs
+
+
+# leading columns of a bin table, followed by one count column per layer
+BIN_TABLE_COLUMNS = ("count", "mean", "min", "max", "lo", "hi")
+
+
+def bin_table_key(edges, layers, versions: Optional[Dict[str, str]] = None) -> tuple:
+    """
+    Content key of the bin table of ``layers`` (label, values, is subset) in ``edges``.
+    ``versions`` are the known `data_version` of data layers by label, which are not hashed again.
+    """
+    versions = versions or {}
+    layer_versions = tuple((label, versions.get(label) if not is_subset and label in versions else data_version(values))
+                           for label, values, is_subset in layers)
+    return (data_version(np.asarray(edges, dtype=float)), layer_versions)
+
+
+def bin_table_name(key: tuple) -> str:
+    """Entry name of a bin table in a `shared_data.SharedArrayStore`"""
+    return "bin_tables/" + blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+def bin_table(edges, layers) -> np.ndarray:
+    """
+    One row per bin (see BIN_TABLE_COLUMNS): count, mean, min and max of the data
+    layers (not the subsets), the bin range, then the count of every layer.
+    """
+    edges = np.asarray(edges, dtype=float)
+    data_values = [values for _, values, is_subset in layers if not is_subset]
+    all_values = np.concatenate(data_values) if len(data_values) > 0 else np.array([])
+    counts, sums, mins, maxs = bin_statistics(all_values, edges)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    layer_counts = [bin_statistics(values, edges)[0] for _, values, _ in layers]
+    return np.column_stack([counts, means, mins, maxs, edges[:-1], edges[1:], *layer_counts])
+
+
+BINNING_RULES: Dict[str, Callable[..., np.ndarray]] = {
+    "fd": freedman_diaconis_edges,
+    "freedman-diaconis": freedman_diaconis_edges,
+    "scott": scott_edges,
+    "knuth": knuth_edges,
+    "bayesian_blocks": bayesian_blocks_edges,
+    "blocks": bayesian_blocks_edges,
+}
+
+
+def is_uniform(edges, rtol: float = 1e-6) -> bool:
+    widths = np.diff(edges)
+    return widths.size > 0 and bool(np.allclose(widths, widths[0], rtol=rtol, atol=0))
+
+
+class BinningEngine:
+    """Computes rule based bin edges and memoizes them per (data version, attribute, rule)"""
+
+    def __init__(self, max_bins: int = MAX_BINS, cache_size: int = 64):
+        self.max_bins = max_bins
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        # optional precompute.PrecomputedStore with the edges of static data
+        self.precomputed = None
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _rule(self, rule: str) -> Callable[..., np.ndarray]:
+        try:
+            return BINNING_RULES[rule.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown binning rule {rule!r}. Options are {sorted(BINNING_RULES)}") from None
+
+    def edges(self, values, rule: str = "fd", attribute: Hashable = None, version: Optional[Hashable] = None) -> np.ndarray:
+        """
+        Bin edges for ``values`` using ``rule``.
+
+        ``version`` identifies the data; if it is not given a content hash is used.
+        The returned array is shared with the cache and must not be modified.
+        """
+        func = self._rule(rule)
+        if version is None:
+            version = data_version(values)
+        key = (version, attribute, func.__name__, self.max_bins)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        edges = None
+        # precomputed edges are per dataset, by content hash: use the version when it is one
+        content_version = self._content_version(version)
+        if self.precomputed is not None and content_version is not None:
+            edges = self.precomputed.edges(content_version, func.__name__, self.max_bins)
+        if edges is None:
+            edges = self.compute(values, rule)
+        else:
+            edges = np.array(edges)
+        edges.setflags(write=False)
+
+        self._cache[key] = edges
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return edges
+
+    def compute(self, values, rule: str = "fd", max_bins: Optional[int] = None) -> np.ndarray:
+        """Bin edges for ``values`` using ``rule``, without the cache or the precomputed edges"""
+        func = self._rule(rule)
+        if func is bayesian_blocks_edges:
+            return func(values)
+        return func(values, max_bins=self.max_bins if max_bins is None else max_bins)
+
+    @staticmethod
+    def _content_version(version: Hashable) -> Optional[str]:
+        """The `data_version` in ``version``: itself, or the one of a single dataset (`viewer_values`)"""
+        if isinstance(version, tuple) and len(version) == 1:
+            version = version[0]
+        return version if isinstance(version, str) else None
+
+    def viewer_values(self, viewer) -> Tuple[np.ndarray, Tuple]:
+        """Concatenate the x attribute of every dataset (not subsets) shown in a histogram viewer"""
+        state = viewer.state
+        arrays, versions = [], []
+        for layer in state.layers:
+            data = getattr(layer, "layer", None)
+            # subsets are contained in their parent data
+            if data is None or getattr(data, "data", data) is not data:
+                continue
+            try:
+                values = np.asarray(full_values(data, state.x_att), dtype=float).ravel()
+            except Exception:
+                continue
+            arrays.append(values)
+            versions.append(data_version(values))
+        if len(arrays) == 0:
+            return np.array([]), ()
+        return np.concatenate(arrays), tuple(versions)
+
+    def apply_to_viewer(self, viewer, rule: str, bin_manager=None) -> Optional[np.ndarray]:
+        """
+        Compute edges for the data in ``viewer`` and feed them to the viewer and ``bin_manager``.
+
+        Equal width rules set ``hist_x_min``, ``hist_x_max`` and ``hist_n_bin`` so that
+        ``viewer.state.bins`` matches the edges exactly. Variable width rules set the same
+        range and number of bins on the viewer, and pass the exact edges to ``bin_manager``.
+        """
+        values, versions = self.viewer_values(viewer)
+        if values.size == 0:
+            return None
+        edges = self.edges(values, rule, attribute=str(viewer.state.x_att), version=versions)
+
+        state = viewer.state
+        with state.delay_callback("hist_x_min", "hist_x_max", "hist_n_bin"):
+            state.hist_x_min = float(edges[0])
+            state.hist_x_max = float(edges[-1])
+            state.hist_n_bin = len(edges) - 1
+
+        if bin_manager is not None:
+            bin_manager.set_edges(None if is_uniform(edges) else edges)
+        return edges
+
+
+BINNING_ENGINE = BinningEngine()
@@ -0,0 +1,135 @@
+"""
+One hover/unhover/click dispatcher per selection layer.
+
+Plotly keeps the callbacks of a trace in plain lists, and ``on_hover`` appends without
+checking for duplicates. Turning bin highlighting on and off, redraws and remounts of a
+pooled viewer could leave the same handler in the list several times, and removing a
+handler meant rebuilding the list. `CallbackDispatcher` installs one function per event
+on the trace and fans out to a registry of handlers by key:
+
+- registering is idempotent: the same key replaces the handler instead of adding another
+- removing is a dict delete, O(1)
+- every handler's calls and time are counted, see `report`
+
+Example:
+    ```python
+    dispatcher = selection_dispatcher(viewer)
+    dispatcher.register("click", on_click, key="dotplot_click")
+    dispatcher.unregister("click", "dotplot_click")
+    print(dispatcher.report())
+    ```
+"""
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+from plotly.basedatatypes import BaseTraceType
+from plotly.callbacks import InputDeviceState, Points
+
+EVENTS = ("hover", "unhover", "click")
+
+# the trace attribute holding its dispatcher
+_ATTRIBUTE = "_callback_dispatcher"
+
+
+class _HandlerStats:
+    __slots__ = ("calls", "total", "max")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class CallbackDispatcher:
+    """Fans the hover, unhover and click events of one trace out to keyed handlers"""
+
+    def __init__(self, trace: BaseTraceType):
+        self.trace = trace
+        # dicts keep insertion order, so handlers run in the order they were first registered
+        self._handlers: Dict[str, Dict[Hashable, Callable]] = {event: {} for event in EVENTS}
+        self._stats: Dict[str, Dict[Hashable, _HandlerStats]] = {event: {} for event in EVENTS}
+        self._dispatch = {event: self._dispatcher(event) for event in EVENTS}
+
+    def _dispatcher(self, event: str) -> Callable:
+        def dispatch(trace, points: Points, state: InputDeviceState):
+            # copy, so handlers can (un)register handlers
+            for key, handler in list(self._handlers[event].items()):
+                start = time.perf_counter()
+                try:
+                    handler(trace, points, state)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    stats = self._stats[event].setdefault(key, _HandlerStats())
+                    stats.calls += 1
+                    stats.total += elapsed
+                    stats.max = max(stats.max, elapsed)
+        dispatch.__name__ = f"dispatch_{event}"
+        return dispatch
+
+    def _install(self, event: str):
+        # the callback lists may have been reset (e.g. by viewer_pool), so check them
+        callbacks = getattr(self.trace, f"_{event}_callbacks")
+        if self._dispatch[event] not in callbacks:
+            getattr(self.trace, f"on_{event}")(self._dispatch[event])
+
+    def register(self, event: str, handler: Callable, key: Optional[Hashable] = None) -> Hashable:
+        """Call `handler(trace, points, state)` on `event`. A handler with the same key (default: the handler) is replaced"""
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event {event!r}. Options are {EVENTS}")
+        key = handler if key is None else key
+        self._handlers[event][key] = handler
+        self._install(event)
+        return key
+
+    def unregister(self, event: str, key: Hashable) -> bool:
+        """Remove a handler by key (or the handler itself). Returns whether it was registered"""
+        self._stats[event].pop(key, None)
+        return self._handlers[event].pop(key, None) is not None
+
+    def is_registered(self, event: str, key: Hashable) -> bool:
+        return key in self._handlers[event]
+
+    def handlers(self, event: str) -> Dict[Hashable, Callable]:
+        return dict(self._handlers[event])
+
+    def clear(self):
+        for event in EVENTS:
+            self._handlers[event].clear()
+            self._stats[event].clear()
+
+    def timings(self) -> Dict[str, Dict[Hashable, dict]]:
+        """Per event and handler key: calls, total and mean time in ms, and the slowest call"""
+        return {
+            event: {
+                key: {"calls": s.calls, "total_ms": s.total * 1000, "mean_ms": s.total * 1000 / s.calls if s.calls else 0.0, "max_ms": s.max * 1000}
+                for key, s in stats.items()
+            }
+            for event, stats in self._stats.items()
+        }
+
+    def report(self) -> str:
+        lines = [f"{'event':>8} {'calls':>7} {'mean ms':>8} {'max ms':>8}  handler"]
+        for event, rows in self.timings().items():
+            for key, row in rows.items():
+                name = getattr(key, "__qualname__", None) or repr(key)
+                lines.append(f"{event:>8} {row['calls']:>7} {row['mean_ms']:8.3f} {row['max_ms']:8.3f}  {name}")
+        return "\n".join(lines)
+
+
+def dispatcher_for(trace: BaseTraceType) -> CallbackDispatcher:
+    """The dispatcher of a trace (created on first use)"""
+    dispatcher = getattr(trace, _ATTRIBUTE, None)
+    if dispatcher is None:
+        dispatcher = CallbackDispatcher(trace)
+        # underscore attributes are not plotly properties, so they can be set on the trace
+        setattr(trace, _ATTRIBUTE, dispatcher)
+    return dispatcher
+
+
+def existing_dispatcher(trace: BaseTraceType) -> Optional[CallbackDispatcher]:
+    return getattr(trace, _ATTRIBUTE, None)
+
+
+def selection_dispatcher(viewer) -> CallbackDispatcher:
+    """The dispatcher of a viewer's selection layer"""
+    return dispatcher_for(viewer.selection_layer)
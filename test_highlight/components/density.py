@@ -0,0 +1,270 @@
+"""
+A smooth density curve (kernel density estimate) drawn over a dotplot.
+
+The KDE is binned: the values are histogrammed on a fine grid spanning the data
+(``grid_size`` cells, default 2048) and the counts are convolved with a Gaussian
+kernel by FFT, which costs O(M log M) in the grid size instead of O(N M) for a
+direct sum over the rows. The fine curve is cached per (data version, bandwidth,
+data range) and is only looked up again when the layers, the hidden layers or the
+bandwidth change. Zooming or moving ``x_bounds`` only cuts the visible part out of
+it, and changing the layers that are hidden recomputes only if the visible values
+are different.
+
+Example:
+    ```python
+    density = DensityOverlay(viewer, bandwidth=None)  # Scott's rule
+    density.show()
+    density.set_hidden_layers(hide_layers.value)
+    density.set_bandwidth(2.5)
+    density.remove()
+    ```
+"""
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional, Tuple
+
+import numpy as np
+import plotly.graph_objects as go
+
+from .binning import data_version
+from .update_scheduler import NORMAL
+
+DENSITY_GRID_SIZE = 2048
+# the kernel is cut off this many bandwidths from its center
+KERNEL_SUPPORT = 4.0
+
+
+def scott_bandwidth(values) -> float:
+    """Scott's rule bandwidth, 1.06 sigma n^(-1/5)"""
+    values = np.asarray(values, dtype=float)
+    if values.size < 2:
+        return 1.0
+    sigma = np.std(values, ddof=1)
+    return float(1.06 * sigma * values.size ** (-1 / 5)) if sigma > 0 else 1.0
+
+
+def binned_kde(values, lo: float, hi: float, bandwidth: float, grid_size: int = DENSITY_GRID_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gaussian KDE of ``values`` on ``grid_size`` points between lo and hi.
+
+    Returns the grid centers and the density (integrates to 1 over the values
+    inside [lo, hi]).
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    edges = np.linspace(lo, hi, grid_size + 1)
+    centers = (edges[:-1] + edges[1:]) / 2
+    if values.size == 0 or bandwidth <= 0:
+        return centers, np.zeros(grid_size)
+    counts = np.histogram(values, bins=edges)[0].astype(float)
+    delta = edges[1] - edges[0]
+    half = min(int(np.ceil(KERNEL_SUPPORT * bandwidth / delta)), grid_size)
+    offsets = np.arange(-half, half + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum() * delta
+    # linear (not circular) convolution, so pad to the full output length
+    n = counts.size + kernel.size - 1
+    size = 1 << (n - 1).bit_length()
+    smooth = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)[half:half + grid_size]
+    density = np.clip(smooth, 0, None) / values.size
+    return centers, density
+
+
+class DensityOverlay:
+    """Manages the density curve trace of a dotplot viewer, next to the bin layer of its `BinManager`"""
+
+    def __init__(
+        self,
+        viewer,
+        bandwidth: Optional[float] = None,
+        grid_size: int = DENSITY_GRID_SIZE,
+        color: str = "rgba(30, 30, 30, 0.8)",
+        line_width: float = 2.0,
+        scale: str = "counts",
+        hidden_layers: Iterable = (),
+        scheduler = None,
+        cache_size: int = 16,
+    ):
+        """
+        Parameters
+        ----------
+        viewer : object
+            A dotplot/histogram viewer with a plotly figure.
+        bandwidth : float, optional
+            Kernel standard deviation in data units. Default is None (Scott's rule).
+        grid_size : int, optional
+            Number of cells of the fine grid. Default is 2048.
+        scale : str, optional
+            'counts' scales the curve to the counts per viewer bin, so it follows the dots.
+            'density' draws the probability density. Default is 'counts'.
+        hidden_layers : iterable, optional
+            Data and subsets whose values are left out (the `hide_layers` of the viewer).
+        scheduler : UpdateScheduler, optional
+            The viewer's `update_scheduler`. Curve updates are submitted with normal priority.
+        """
+        self.viewer = viewer
+        self.bandwidth = bandwidth
+        self.grid_size = grid_size
+        self.color = color
+        self.line_width = line_width
+        self.scale = scale
+        self.hidden_layers = list(hidden_layers)
+        self.scheduler = scheduler
+        self.visible = False
+        self._cache: "OrderedDict[Hashable, Tuple[np.ndarray, np.ndarray, int]]" = OrderedDict()
+        self._cache_size = cache_size
+        # the fine curve of the current layers, None when they (or the bandwidth) changed
+        self._fine: Optional[Tuple[np.ndarray, np.ndarray, int]] = None
+        self.stats = {"computed": 0, "cached": 0}
+        self._callbacks_added = False
+
+    # ---- values ----
+
+    def _visible_values(self) -> np.ndarray:
+        """x values of the shown data layers, or of the shown subsets of hidden data"""
+        state = self.viewer.state
+        hidden = {id(layer) for layer in self.hidden_layers}
+        arrays = []
+        for layer in state.layers:
+            if not getattr(layer, "visible", True) or id(layer.layer) in hidden:
+                continue
+            data = getattr(layer.layer, "data", layer.layer)
+            is_subset = data is not layer.layer
+            if is_subset and id(data) not in hidden:
+                # already counted with its data
+                continue
+            try:
+                arrays.append(np.asarray(layer.layer[state.x_att], dtype=float).ravel())
+            except Exception:
+                continue
+        if len(arrays) == 0:
+            return np.array([])
+        values = np.concatenate(arrays)
+        return values[np.isfinite(values)]
+
+    def _fine_curve(self) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(grid, density, number of values) over the whole data range of the current layers"""
+        if self._fine is None:
+            self._fine = self._lookup_fine_curve()
+        return self._fine
+
+    def _lookup_fine_curve(self) -> Tuple[np.ndarray, np.ndarray, int]:
+        """The fine curve of the visible values, from the cache if possible"""
+        values = self._visible_values()
+        if values.size == 0:
+            return np.array([]), np.array([]), 0
+        bandwidth = self.bandwidth if self.bandwidth is not None else scott_bandwidth(values)
+        lo = values.min() - KERNEL_SUPPORT * bandwidth
+        hi = values.max() + KERNEL_SUPPORT * bandwidth
+        key = (data_version(values), bandwidth, lo, hi, self.grid_size)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["cached"] += 1
+            return self._cache[key]
+        grid, density = binned_kde(values, lo, hi, bandwidth, self.grid_size)
+        self._cache[key] = (grid, density, values.size)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        self.stats["computed"] += 1
+        return self._cache[key]
+
+    def curve(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The part of the curve inside the viewer's x range, scaled as `scale`"""
+        grid, density, n = self._fine_curve()
+        if grid.size == 0:
+            return grid, density
+        state = self.viewer.state
+        x_min = getattr(state, "x_min", None)
+        x_max = getattr(state, "x_max", None)
+        if x_min is not None and x_max is not None:
+            # one grid point past each side, so the line reaches the plot edges
+            start = max(int(np.searchsorted(grid, min(x_min, x_max))) - 1, 0)
+            stop = int(np.searchsorted(grid, max(x_min, x_max))) + 1
+            grid, density = grid[start:stop], density[start:stop]
+        if self.scale == "counts":
+            bins = getattr(state, "bins", None)
+            width = float(np.mean(np.diff(bins))) if bins is not None and len(bins) > 1 else 1.0
+            density = density * n * width
+        return grid, density
+
+    # ---- trace ----
+
+    @property
+    def trace(self) -> Optional[go.Scatter]:
+        return next(self.viewer.figure.select_traces({"meta": "density_meta"}), None)
+
+    def _create_trace(self, x, y) -> go.Scatter:
+        return go.Scatter(
+            name="density",
+            meta="density_meta",
+            x=x,
+            y=y,
+            mode="lines",
+            line={"color": self.color, "width": self.line_width, "shape": "spline"},
+            hoverinfo="skip",
+            showlegend=False,
+        )
+
+    def update(self, *args):
+        """Redraw the curve (e.g. after a zoom). Only cuts the range out of the current fine curve"""
+        if not self.visible:
+            return
+        x, y = self.curve()
+        trace = self.trace
+        if trace is None:
+            self.viewer.figure.add_trace(self._create_trace(x, y))
+        elif self.scheduler is not None:
+            self.scheduler.submit(trace, {"x": x, "y": y}, priority=NORMAL)
+        else:
+            with self.viewer.figure.batch_update():
+                trace.update(x=x, y=y)
+
+    def _layers_changed(self, *args):
+        self._fine = None
+        self.update()
+
+    def _add_callbacks(self):
+        if self._callbacks_added:
+            return
+        for name in ("x_min", "x_max"):
+            self.viewer.state.add_callback(name, self.update)
+        self.viewer.state.add_callback("layers", self._layers_changed)
+        self._callbacks_added = True
+
+    def _remove_callbacks(self):
+        if not self._callbacks_added:
+            return
+        for name in ("x_min", "x_max"):
+            self.viewer.state.remove_callback(name, self.update)
+        self.viewer.state.remove_callback("layers", self._layers_changed)
+        self._callbacks_added = False
+
+    def show(self):
+        self.visible = True
+        # the layers may have changed while hidden
+        self._fine = None
+        self._add_callbacks()
+        self.update()
+
+    def hide(self):
+        self.visible = False
+        self._remove_callbacks()
+        if self.trace is not None:
+            keep = lambda t: getattr(t, "meta", None) != "density_meta"
+            self.viewer.figure.data = tuple(filter(keep, self.viewer.figure.data))
+
+    def remove(self):
+        """Remove the trace and the viewer callbacks"""
+        self.hide()
+        self._cache.clear()
+        self._fine = None
+
+    def set_hidden_layers(self, hidden_layers: Iterable):
+        self.hidden_layers = list(hidden_layers)
+        self._fine = None
+        self.update()
+
+    def set_bandwidth(self, bandwidth: Optional[float]):
+        """Kernel bandwidth in data units, None for Scott's rule"""
+        self.bandwidth = bandwidth
+        self._fine = None
+        self.update()
@@ -28,8 +28,20 @@ logger = setup_logger("DOTPLOT")
 
 from glue_jupyter import JupyterApplication
 
-from .BinManager import BinManager
-from .PlotlyHighlighting import _PlotlyHighlighting
+from .bin_manager import BinManager
+from .bin_highligher import BinHighlighter
+from .plotly_highlighting import _PlotlyHighlighting
+from .webgl import WebGLDots
+from .density import DensityOverlay
+from .svg_preview import SvgPreview
+from .binning import BINNING_ENGINE, is_uniform
+from ..columnar import full_values
+from .marker_manager import MarkerManager
+from .layer_visibility import LayerVisibilityController
+from .viewer_pool import viewer_pool, reset_selection_layer
+from .callback_dispatcher import selection_dispatcher
+from .update_scheduler import update_scheduler, LOW
+from .viewer_snapshot import SNAPSHOTS, ViewerSnapshot, current_session_id, viewer_source
 
 
 def valid_two_element_array(arr: Union[None, list]):
@@ -64,10 +76,15 @@ def DotplotViewer(
     line_marker_color = LIGHT_GENERIC_COLOR, 
     vertical_line_visible: bool = True, # type: ignore
     on_vertical_line_visible_changed: Callable = lambda x: None,
+    markers: dict = {},  # type: ignore
+    on_markers_changed: Callable = lambda x: None,
+    markers_color: str = LIGHT_GENERIC_COLOR,
+    markers_as_trace: bool = False,
     unit: Optional[str] = None,
     x_label: Optional[str] = None,
     y_label: Optional[str] = None,
     nbin: int = 75,
+    bin_rule: Optional[str] = None,
     x_bounds: list[float] = [],  # type: ignore
     on_x_bounds_changed: Callable = lambda x: None,
     reset_bounds: list = [],  # type: ignore
@@ -75,7 +92,17 @@ def DotplotViewer(
     hide_layers: List[Data | Subset] = [],  # type: ignore
     on_hide_layers_changed: Callable = lambda x: None,
     highlight_bins: bool = False,
+    bin_tooltips: bool = False,
     on_figure_id: Optional[Callable] = None,
+    recorder = None,
+    snapshot_key: Optional[str] = None,
+    webgl: bool = False,
+    density: bool = False,
+    density_bandwidth: Optional[float] = None,
+    on_range_stats: Optional[Callable] = None,
+    svg_preview: bool = False,
+    shared_store = None,
+    stacked_highlight: bool = False,
     ):
     
     """
@@ -98,9 +125,31 @@ def DotplotViewer(
     - `line_marker_at`: The value at which the vertical line marker should be placed (passed value is displayed)
     - `line_marker_color`: The color of the vertical line marker (default: 'red')
     - `vertical_line_visible`: Whether the vertical line marker should be visible (default: True)
+    - `markers`: Additional vertical markers as a dict of key (e.g. student id) to x value. Changing the dict moves
+       all markers in one update.
+    - `markers_as_trace`: Draw the additional markers as a single scatter trace instead of one layout shape per
+       marker, which is faster for many markers (default: False)
     - `unit`: The unit for the x-axis values, used in the label for the vertical line (default: None)
     - `x_label`: x_label (Optional[str]): The label for the x-axis of the dot plot. If None, the label will be the name of the x attribute.
     - `y_label`: y_label (Optional[str]): The label for the y-axis of the dot plot. If None, the label will be the name of the y attribute.
+    - `nbin`: The number of bins (default: 75). Ignored if `bin_rule` is given.
+    - `bin_tooltips`: Show per-bin tooltips (range, count, mean and count per layer) rendered in the browser from
+       the bin layer's precomputed customdata, instead of the plain x value (default: False)
+    - `bin_rule`: Compute the bins from the data with a rule ('fd', 'scott', 'knuth' or 'bayesian_blocks') instead of `nbin`.
+    - `recorder`: An `InteractionRecorder` to record clicks, reactive changes and tool activations for replay (default: None)
+    - `snapshot_key`: Key of the viewer's state snapshot, saved on unmount and restored on the next mount in the same
+       session (e.g. after a reconnect) without recomputing the bins (default: the title; no snapshots without either)
+    - `webgl`: Draw the dots with WebGL (scattergl) for large data sets (default: False)
+    - `density`: Draw a smooth density curve (binned KDE) of the shown layers over the dots (default: False)
+    - `density_bandwidth`: Bandwidth of the density curve in data units (default: None, Scott's rule)
+    - `on_range_stats`: Called once the viewer is set up with a `range_stats(lo, hi, layers=False)` function that
+       returns the count, sum, mean, std, median, min and max of the viewer's data in [lo, hi) in O(log n)
+    - `svg_preview`: Show a static SVG of the dotplot (from cached bin counts) while the viewer is built, and swap
+       in the interactive figure when it is ready (default: False)
+    - `shared_store`: A `shared_data.SharedArrayStore` for the bin tables, so the workers compute them once and memory
+       map them. Only for static data, the tables are kept on disk (default: None)
+    - `stacked_highlight`: Highlight the hovered bin in Python with one stacked segment per layer (each subset and the
+       rest of its data), sized by the layer counts in the bin table, instead of one bar in the browser (default: False)
     
     """
     
@@ -110,6 +159,7 @@ def DotplotViewer(
     line_marker_at: Reactive[Number] = solara.use_reactive(line_marker_at, on_change=on_line_marker_at_changed) # type: ignore
     reset_bounds: Reactive[list] = solara.use_reactive(reset_bounds, on_change=on_reset_bounds_changed) # type: ignore
     hide_layers: Reactive[list] = solara.use_reactive(hide_layers, on_change=on_hide_layers_changed) # type: ignore
+    markers: Reactive[dict] = solara.use_reactive(markers, on_change=on_markers_changed) # type: ignore
     
     if len(x_bounds.value) == 0 and len(reset_bounds.value) == 2:
         x_bounds.set(reset_bounds.value)
@@ -128,13 +178,6 @@ def DotplotViewer(
         viewer_container = rv.Html(tag="div", style_=f"width: 100%; height: {height}px", class_="mb-4")
 
         
-        def _add_vertical_line(viewer: PlotlyBaseView, value: Number, color: str, label: str = None, line_ids: list[str] = []):
-            line_id = str(uuid4())
-            print(line_id)
-            line_ids.append(line_id)
-            viewer.figure.add_vline(x=value, line_color=color, line_width=2, name=line_id)
-
-        
         def _add_data(viewer: PlotlyBaseView, data: Union[Data, tuple]):
             if isinstance(data, Data):
                 logger.info(f"{title}: Adding data: {data.label}")
@@ -154,8 +197,32 @@ def DotplotViewer(
                 else:
                     viewer_data = data[0]
             
-            dotplot_view: HubbleDotPlotViewer = gjapp.new_data_viewer(
-                HubbleDotPlotView, show=False) # type: ignore
+            viewer_widget = solara.get_widget(viewer_container)
+            preview = None
+            if svg_preview:
+                # first paint, before glue and the figure widget are set up
+                preview = SvgPreview(viewer_widget, logger=logger, name=title)
+                try:
+                    preview_data = viewer_data[0] if isinstance(viewer_data, tuple) else viewer_data
+                    attribute = preview_data.id[component_id] if component_id is not None else preview_data.main_components[0]
+                    # full precision, the same values BinManager bins (not the float32 display copy)
+                    values = full_values(preview_data, attribute)
+                    preview.show(values,
+                                 nbin=nbin,
+                                 x_range=x_bounds.value if valid_two_element_array(x_bounds.value) else None,
+                                 edges=BINNING_ENGINE.edges(values, bin_rule) if bin_rule is not None else None,
+                                 height=height,
+                                 color=getattr(getattr(preview_data, "style", None), "color", None) or LIGHT_GENERIC_COLOR,
+                                 margins=PLOTLY_MARGINS,
+                                 x_label=x_label,
+                                 precomputed=BINNING_ENGINE.precomputed,
+                                 )
+                except Exception as e:
+                    logger.warning(f"{title}: no SVG preview: {e}")
+            
+            # a pre-built, pre-styled viewer (layout and selection layer already set up)
+            pool = viewer_pool(gjapp)
+            dotplot_view: HubbleDotPlotViewer = pool.acquire(height=height) # type: ignore
             if on_figure_id is not None:
                 print(f"Setting figure id: {dotplot_view._unique_class}")
                 on_figure_id(dotplot_view._unique_class)
@@ -172,12 +239,40 @@ def DotplotViewer(
                     for viewer_data in data[1:]:
                         _add_data(dotplot_view, viewer_data)
 
-            dotplot_view.state.hist_n_bin = nbin
+            if bin_rule is None:
+                dotplot_view.state.hist_n_bin = nbin
             if x_bounds.value is not None:
                 if len(x_bounds.value) == 2:
                     dotplot_view.state.x_min = x_bounds.value[0]
                     dotplot_view.state.x_max = x_bounds.value[1]
             
+            # the state saved when this viewer was unmounted earlier in the session (e.g. before a reconnect)
+            viewer_key = snapshot_key or title
+            session_id = current_session_id()
+            snapshot = SNAPSHOTS.take(session_id, viewer_key) if viewer_key is not None and session_id is not None else None
+            # the props the bins depend on. A snapshot of other data or bins is stale
+            bin_settings = {"nbin": nbin, "bin_rule": bin_rule}
+            source = viewer_source(dotplot_view, **bin_settings) if snapshot is not None else None
+            if snapshot is not None and not snapshot.matches(source):
+                logger.info(f"{title}: dropping the snapshot, the data or bin settings changed")
+                snapshot = None
+            if snapshot is not None:
+                logger.info(f"{title}: restoring snapshot")
+                snapshot.apply_to_viewer(dotplot_view)
+                if "x_min" in snapshot.state and "x_max" in snapshot.state:
+                    x_bounds.set([snapshot.state["x_min"], snapshot.state["x_max"]])
+                if snapshot.line_marker_at is not None:
+                    line_marker_at.set(snapshot.line_marker_at)
+                if snapshot.vertical_line_visible is not None:
+                    vertical_line_visible.set(snapshot.vertical_line_visible)
+                if len(snapshot.markers) > 0:
+                    markers.set(snapshot.markers)
+                hide_layers.set(snapshot.hidden_layers_in(gjapp))
+            
+            if recorder is not None:
+                recorder_source = recorder.register_viewer(dotplot_view, name=title)
+            
+            webgl_dots = WebGLDots(dotplot_view, logger=logger) if webgl else None
             
             
             
@@ -197,25 +292,17 @@ def DotplotViewer(
             # DotplotScatterLayerArtist._update_data = no_hover_update
             
                 
-            def get_layer(layer_name):
-                layer_artist = dotplot_view.layer_artist_for_data(layer_name) # type: ignore
-                if layer_artist is None:
-                    logger.warning(f"{title}: Layer not found: {layer_name}")
-                return layer_artist
+            # all updates to the figure go through one scheduler, hover feedback first
+            scheduler = update_scheduler(dotplot_view, logger=logger)
+            
+            layer_visibility = LayerVisibilityController(dotplot_view, logger=logger, name=title, scheduler=scheduler)
+            
+            density_overlay = DensityOverlay(dotplot_view, bandwidth=density_bandwidth, scheduler=scheduler) if density else None
             
             def hide_ignored_layers(*args):
-                logger.info(f"{title}: Hiding ignored layers")
-                layers = dotplot_view.layers
-                hidden_layers = [get_layer(l) for l in hide_layers.value] # type: ignore
-                # visible_layers = [l for l in layers if l not in hidden_layers]
-                for layer in hidden_layers:
-                    if layer is not None:
-                        logger.info(f"({title}): Hiding: {layer.layer.label}")
-                        layer.visible = False
-                for layer in layers:
-                    if (layer is not None) and not layer in hidden_layers:
-                        logger.info(f"({title}): Showing: {layer.layer.label}")
-                        layer.visible = True
+                layer_visibility.apply(hide_layers.value)
+                if density_overlay is not None:
+                    density_overlay.set_hidden_layers(hide_layers.value)
             
 
             # override the default selection layer
@@ -236,21 +323,22 @@ def DotplotViewer(
                 dotplot_view.state.y_axislabel = y_label
 
             
-            line_ids = [] #[_line_ids_for_viewer(dotplot_view)]
+            line_marker = MarkerManager(dotplot_view, color=line_marker_color, visible=vertical_line_visible.value, scheduler=scheduler)
             
-            def _update_lines(value = None):                
+            def _update_lines(value = None):
                 if value is not None:
-                    if len(line_ids) > 0:
-                        dotplot_view.figure.update_shapes(
-                            patch=dict(visible=vertical_line_visible.value and value is not None, x0=value, x1=value),
-                            selector={'name': line_ids[0]})
-                    elif len(line_ids) == 0:
-                        _add_vertical_line(dotplot_view, value, line_marker_color, label = "Line Marker", line_ids = line_ids)
-                elif len(line_ids) > 0:
-                    dotplot_view.figure.update_shapes(
-                        patch=dict(visible=vertical_line_visible.value),
-                        selector={'name': line_ids[0]})
-                
+                    line_marker.set_position("line_marker", value)
+                line_marker.set_visible(vertical_line_visible.value)
+            
+            extra_markers = MarkerManager(dotplot_view, color=markers_color, as_trace=markers_as_trace, scheduler=scheduler)
+            
+            def _update_markers(new_markers = None):
+                new_markers = markers.value if new_markers is None else new_markers
+                removed = [key for key in extra_markers.keys if key not in new_markers]
+                if len(removed) > 0:
+                    extra_markers.remove(removed)
+                if len(new_markers) > 0:
+                    extra_markers.set_positions(new_markers)
             
             
             
@@ -263,36 +351,17 @@ def DotplotViewer(
             toolbar_widget = solara.get_widget(toolbar_container)
             toolbar_widget.children = (dotplot_view.toolbar,)
 
-            viewer_widget = solara.get_widget(viewer_container)
-            pl = _PlotlyHighlighting(viewer_id=dotplot_view._unique_class, show=False, highlight=highlight_bins, debug=False)
-            viewer_widget.children = (pl, dotplot_view.figure_widget,)
-
-            # The auto sizing in the plotly widget only works if the height
-            #  and width are undefined. First, unset the height and width,
-            #  then enable auto sizing.
-            dotplot_view.figure_widget.update_layout(height=None, width=None)
-            dotplot_view.figure_widget.update_layout(autosize=True, height=height)
-            dotplot_view.figure_widget.update_layout(
-                margin=PLOTLY_MARGINS,
-                showlegend=False,
-                hovermode="x",
-                spikedistance=-1,
-                xaxis=dict(
-                    spikecolor="black",
-                    spikethickness=1,
-                    spikedash="solid",
-                    spikemode="across",
-                    spikesnap="cursor",
-                    showspikes=True,
-                    tickformat=",.0f",
-                    titlefont_size=16,
-                ),
-                yaxis=dict(
-                    tickmode="auto",
-                    titlefont_size=16,
-                ),
-            )
+            # stacked highlighting is done in python by the BinHighlighter
+            pl = _PlotlyHighlighting(viewer_id=dotplot_view._unique_class, show=False, highlight=highlight_bins and not stacked_highlight, debug=False)
             
+            def highlight_mode() -> Optional[str]:
+                """The highlighting in use, for the snapshot"""
+                if stacked_highlight:
+                    return "python" if bin_shower.enabled else None
+                return "js" if pl.highlight and bin_shower.bin_layer is not None else None
+            if preview is None:
+                viewer_widget.children = (pl, dotplot_view.figure_widget,)
+
             def on_click(trace, points, selector):
                 if len(points.xs) > 0:
                     value = points.xs[0]
@@ -304,15 +373,14 @@ def DotplotViewer(
 
                 
                 
-            dotplot_view.figure.update_layout(clickmode="event", hovermode="closest", showlegend=False)
-            dotplot_view.selection_layer.on_click(on_click)
+            if recorder is not None:
+                on_click = recorder.wrap("click", recorder_source, on_click)
+            click_dispatcher = selection_dispatcher(dotplot_view)
+            click_dispatcher.register("click", on_click, key="dotplot_click")
             unit_str = f" {unit}" if unit else ""
             dotplot_view.selection_layer.update(hovertemplate=f"%{{x:,.0f}}{unit_str}<extra></extra>")
             def reset_selection():
-                dotplot_view.set_selection_active(True)
-                # special treatment for go.Heatmap from https://stackoverflow.com/questions/58630928/how-to-hide-the-colorbar-and-legend-in-plotly-express-bar-graph#comment131880779_68555667
-                dotplot_view.selection_layer.update(visible=True, z = [list(range(201))], opacity=0, coloraxis='coloraxis')
-                dotplot_view.figure.update_coloraxes(showscale=False)
+                scheduler.submit_call(lambda: reset_selection_layer(dotplot_view), priority=LOW, key="reset_selection")
             
 
             
@@ -343,19 +411,57 @@ def DotplotViewer(
                 else:
                     logger.info(f'{title}: Bounds already set')
             
-            bin_shower = BinManager(dotplot_view,
+            hovertemplate = (lambda bm: bm.default_hovertemplate(unit)) if bin_tooltips else None
+            restored = False
+            if stacked_highlight:
+                # bins on construction, so the rule edges are passed in (like TestViewer)
+                rule_edges = BINNING_ENGINE.apply_to_viewer(dotplot_view, bin_rule) if bin_rule is not None else None
+                bin_shower = BinHighlighter(dotplot_view,
+                                            bin_width=1,
+                                            selection_bin_width=1,
+                                            visible_bins=False,
+                                            show_bins_with_data_only=False,
+                                            edges=None if rule_edges is None or is_uniform(rule_edges) else rule_edges,
+                                            hovertemplate=hovertemplate,
+                                            recorder=recorder,
+                                            scheduler=scheduler,
+                                            shared_store=shared_store,
+                                            stacked=True,
+                                            )
+                bin_shower.setup_bin_highlight()
+            else:
+                bin_shower = BinManager(dotplot_view,
                                         bin_width=1,
                                         selection_bin_width=1,
                                         visible_bins=False,
                                         show_bins_with_data_only=False,
+                                        hovertemplate=hovertemplate,
+                                        recorder=recorder,
+                                        scheduler=scheduler,
+                                        shared_store=shared_store,
                                         )
-            if highlight_bins:
-                bin_shower.setup_bin_layer()
+            if not stacked_highlight and snapshot is not None and snapshot.bins is not None:
+                # the bins computed before, without histogramming the data again (if they are still current)
+                # the datasets were hashed for the source check, only the subsets are hashed again
+                versions = source["data"]
+                if highlight_bins or bin_tooltips:
+                    restored = bin_shower.restore_bin_layer(snapshot.bins, versions)
+                elif bin_shower.snapshot_matches(snapshot.bins, versions):
+                    bin_shower.restore_state(snapshot.bins)
+                    restored = True
+            if not stacked_highlight and not restored:
+                if bin_rule is not None:
+                    BINNING_ENGINE.apply_to_viewer(dotplot_view, bin_rule, bin_manager=bin_shower)
+                if highlight_bins or bin_tooltips:
+                    bin_shower.setup_bin_layer()
             
             def turn_off_bins():
                     bin_shower.turn_off_bins()
             def turn_on_bins():
-                if highlight_bins:
+                if stacked_highlight:
+                    # the bins, the stack table and the highlight trace
+                    bin_shower.redraw()
+                elif highlight_bins or bin_tooltips:
                     bin_shower.redraw_bins()
             
             def extend_the_tools():  
@@ -365,7 +471,9 @@ def DotplotViewer(
             extend_the_tools()
             tool = dotplot_view.toolbar.tools['plotly:home']
             if tool:
-                tool.activate()
+                if snapshot is None:
+                    # a restored viewer keeps its bounds
+                    tool.activate()
                 old_activate = tool.activate
                 def new_activate():
                     if len(reset_bounds.value) == 2:
@@ -382,32 +490,84 @@ def DotplotViewer(
             
             if line_marker_at.value is not None:
                 _update_lines(value = line_marker_at.value)
+            
+            # undone in cleanup, since the (pooled) viewer outlives this component
+            unsubscribers = []
+            # the browser finds the hovered bin from these edges
+            unsubscribers.append(pl.follow(bin_shower))
+            unsubscribers.append(lambda: click_dispatcher.unregister("click", "dotplot_click"))
                 
-            line_marker_at.subscribe(lambda new_val: _update_lines(value = new_val))
-            vertical_line_visible.subscribe(lambda new_val: _update_lines())
+            unsubscribers.append(line_marker_at.subscribe(lambda new_val: _update_lines(value = new_val)))
+            unsubscribers.append(vertical_line_visible.subscribe(lambda new_val: _update_lines()))
+            _update_markers()
+            unsubscribers.append(markers.subscribe(_update_markers))
+            unsubscribers.append(line_marker.close)
+            unsubscribers.append(extra_markers.close)
             def update_x_bounds(new_val):
                 logger.info(f"{title}: Updating x_bounds")
                 if new_val is not None and len(new_val) == 2:
                     dotplot_view.state.x_min = new_val[0]
                     dotplot_view.state.x_max = new_val[1]
                 reset_selection()
-            x_bounds.subscribe(update_x_bounds)
+            unsubscribers.append(x_bounds.subscribe(update_x_bounds))
             
             home_tool = dotplot_view.toolbar.tools['plotly:home']
-            home_tool.activate()
+            if snapshot is None:
+                home_tool.activate()
             
             reset_selection()
             
+            if on_range_stats is not None:
+                on_range_stats(bin_shower.range_stats)
+            
+            if density_overlay is not None:
+                density_overlay.show()
+                unsubscribers.append(density_overlay.remove)
+            
             hide_ignored_layers()
-            hide_layers.subscribe(hide_ignored_layers)
+            unsubscribers.append(hide_layers.subscribe(hide_ignored_layers))
+            
+            if preview is not None:
+                # the figure is set up, replace the static preview
+                preview.swap((pl, dotplot_view.figure_widget,))
+            
+            if recorder is not None:
+                recorder.watch_tools(dotplot_view, recorder_source)
+                for name, reactive in (("x_bounds", x_bounds), ("line_marker_at", line_marker_at), ("vertical_line_visible", vertical_line_visible),
+                                       ("markers", markers), ("hide_layers", hide_layers), ("reset_bounds", reset_bounds)):
+                    unsubscribers.append(recorder.watch(recorder_source, name, reactive))
+                # the next mount (of this pooled viewer) may show other data
+                unsubscribers.append(lambda: recorder.unregister_viewer(dotplot_view))
             
             def cleanup():
                 for cnt in (title_widget, toolbar_widget, viewer_widget):
                     cnt.children = ()
 
-                for wgt in (dotplot_view.toolbar, dotplot_view.figure_widget):
-                    # wgt.layout.close()
-                    wgt.close()
+                for unsubscribe in unsubscribers:
+                    unsubscribe()
+                
+                if webgl_dots is not None:
+                    webgl_dots.remove()
+                
+                if viewer_key is not None and session_id is not None:
+                    try:
+                        SNAPSHOTS.put(session_id, ViewerSnapshot.capture(
+                            viewer_key, dotplot_view, bin_shower,
+                            hidden_layers=hide_layers.value,
+                            highlight=highlight_mode(),
+                            line_marker_at=line_marker_at.value,
+                            vertical_line_visible=vertical_line_visible.value,
+                            markers=dict(markers.value),
+                            source=viewer_source(dotplot_view, **bin_settings),
+                        ))
+                    except Exception as e:
+                        logger.warning(f"{title}: could not snapshot the viewer: {e}")
+                
+                # after the snapshot (it reads the bins). Also drops a pending debounced redraw
+                bin_shower.close()
+                
+                # reset the viewer and keep it for the next mount instead of closing it
+                pool.release(dotplot_view)
 
             return cleanup
 
@@ -0,0 +1,222 @@
+"""
+Switching the bin highlighting of a live viewer between modes.
+
+`TestViewer` used to rebuild everything (viewer, histograms, bin manager and
+`_PlotlyHighlighting`) when the highlight mode, the data-only bins or the selection
+layer switch changed. `HighlightModeController` keeps the viewer, its figure widget
+and one `_PlotlyHighlighting` widget, and only swaps the bin manager and the traces:
+
+- ``python``: a `BinHighlighter` moves a highlight trace on hover events
+- ``js``: a `BinManager` draws the bins and `_PlotlyHighlighting` highlights in the browser
+
+The bin tables are cached by content in `BinManager`, so a new manager for the same
+bins does not histogram the data again. Every change does one redraw: `set_nbins`
+sets the number of bins on the viewer and redraws once, instead of two subscriptions
+doing both.
+
+Example:
+    ```python
+    controller = HighlightModeController(viewer, container, mode='python')
+    controller.set_mode('js')
+    controller.set_show_bins_with_data_only(True)
+    controller.set_nbins(30)
+    controller.close()
+    ```
+"""
+from typing import Callable, Optional
+
+import numpy as np
+
+from .bin_highligher import BinHighlighter
+from .bin_manager import BinManager
+from .plotly_highlighting import _PlotlyHighlighting
+
+MODES = ("python", "js")
+
+# style of the browser side highlighting
+JS_OPTIONS = {
+    'fillColor': 'rgba(0, 0, 0)',
+    'fillOpacity': 0.5,
+    'strokeColor': 'rgba(255, 0, 255, 1)',
+    'strokeOpacity': 1,
+    'strokeWidth': 1,
+    'opacity': 1,
+    'debug': False,
+    'show': True,
+}
+
+
+class HighlightModeController:
+    """Owns the bin manager and highlighting widgets of one viewer and switches them in place"""
+
+    def __init__(
+        self,
+        viewer,
+        container,
+        mode: str = "python",
+        highlight: bool = True,
+        show_bins_with_data_only: bool = False,
+        use_selection_layer: bool = True,
+        bin_width: float = 1.0,
+        edges: Optional[np.ndarray] = None,
+        on_hover: Optional[Callable] = None,
+        on_click: Optional[Callable] = None,
+        recorder = None,
+        tracer = None,
+        scheduler = None,
+        logger = None,
+        stacked: bool = False,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown highlight mode {mode!r}. Options are {MODES}")
+        self.viewer = viewer
+        self.container = container
+        self.mode = mode
+        self.highlight = highlight
+        self.show_bins_with_data_only = show_bins_with_data_only
+        self.use_selection_layer = use_selection_layer
+        self.bin_width = bin_width
+        self.edges = edges
+        self.on_hover = on_hover
+        self.on_click = on_click
+        self.recorder = recorder
+        self.tracer = tracer
+        self.scheduler = scheduler
+        self.logger = logger
+        # python mode: per-layer stacked highlight segments
+        self.stacked = stacked
+
+        self.manager: Optional[BinManager] = None
+        # one widget for both modes: in python mode it only collects latency timings (if tracing)
+        self.plotly_highlighting = _PlotlyHighlighting(viewer_id=viewer._unique_class, tracer=tracer, **JS_OPTIONS)
+        self._unfollow: Optional[Callable] = None
+        self.stats = {"builds": 0, "redraws": 0}
+        self._build()
+
+    # ---- building ----
+
+    def _create_manager(self) -> BinManager:
+        if self.mode == "python":
+            return BinHighlighter(self.viewer,
+                                  line_color='rgba(255, 120, 255, 1)',
+                                  fill_color='rgba(0,0,0,.5)',
+                                  bin_width=self.bin_width,
+                                  selection_bin_width=self.bin_width,
+                                  visible_bins=True,
+                                  show_bins_with_data_only=True,
+                                  on_hover_callback=self.on_hover,
+                                  on_click_callback=self.on_click,
+                                  use_selection_layer=self.use_selection_layer,
+                                  setup_selection_layer=True,
+                                  only_show=False,
+                                  edges=self.edges,
+                                  recorder=self.recorder,
+                                  tracer=self.tracer,
+                                  scheduler=self.scheduler,
+                                  stacked=self.stacked,
+                                  )
+        manager = BinManager(self.viewer,
+                             bin_width=self.bin_width,
+                             selection_bin_width=self.bin_width,
+                             visible_bins=True,
+                             show_bins_with_data_only=self.show_bins_with_data_only,
+                             use_selection_layer=self.use_selection_layer,
+                             on_click=self.on_click,
+                             edges=self.edges,
+                             recorder=self.recorder,
+                             scheduler=self.scheduler,
+                             )
+        manager.setup_bin_layer()
+        return manager
+
+    def _build(self):
+        self.manager = self._create_manager()
+        pl = self.plotly_highlighting
+        if self.mode == "python":
+            if self.highlight:
+                self.manager.setup_bin_highlight()
+            else:
+                self.manager.turn_off_bin_highlight()
+            # the browser side only collects the timings, without highlighting
+            pl.highlight = False
+            self.container.children = (pl, self.viewer.figure_widget,) if self.tracer is not None else (self.viewer.figure_widget,)
+        else:
+            pl.highlight = self.highlight
+            self._unfollow = pl.follow(self.manager)
+            self.container.children = (pl, self.viewer.figure_widget,)
+        self.stats["builds"] += 1
+
+    def _teardown(self):
+        if self._unfollow is not None:
+            self._unfollow()
+            self._unfollow = None
+        if self.manager is not None:
+            self.manager.close()
+            self.manager = None
+
+    def _rebuild(self):
+        self._teardown()
+        self._build()
+        if self.logger is not None:
+            self.logger.info(f"Highlighting: mode={self.mode} selection_layer={self.use_selection_layer} data_only={self.show_bins_with_data_only}")
+
+    # ---- switches ----
+
+    def set_mode(self, mode: str):
+        """'python' or 'js'. Swaps the bin manager, the viewer and its figure are kept"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown highlight mode {mode!r}. Options are {MODES}")
+        if mode == self.mode:
+            return
+        self.mode = mode
+        self._rebuild()
+
+    def set_use_selection_layer(self, use_selection_layer: bool):
+        if use_selection_layer == self.use_selection_layer:
+            return
+        self.use_selection_layer = use_selection_layer
+        self._rebuild()
+
+    def set_show_bins_with_data_only(self, value: bool):
+        """Filter the bins in place (the python highlighter always shows only bins with data)"""
+        if value == self.show_bins_with_data_only:
+            return
+        self.show_bins_with_data_only = value
+        if self.mode == "js":
+            self.manager.only_show_with_data = value
+            self._redraw()
+
+    def set_highlight(self, highlight: bool):
+        self.highlight = highlight
+        if self.mode == "python":
+            if highlight:
+                self.manager.turn_on_bin_highlight()
+            else:
+                self.manager.turn_off_bin_highlight()
+        else:
+            self.plotly_highlighting.highlight = highlight
+
+    def set_nbins(self, nbins: int):
+        """Set the number of bins on the viewer and redraw the bins once"""
+        # a bin count from the slider replaces rule based edges
+        self.edges = None
+        self.manager.custom_edges = None
+        if getattr(self.viewer.state, "hist_n_bin", None) != nbins:
+            self.viewer.state.hist_n_bin = nbins
+        self._redraw()
+
+    def set_bin_width(self, width: float):
+        self.bin_width = width
+        self.manager.selection_bin_width = width
+        self._redraw()
+
+    def _redraw(self):
+        self.stats["redraws"] += 1
+        if isinstance(self.manager, BinHighlighter):
+            self.manager.redraw()
+        else:
+            self.manager.redraw_bins()
+
+    def close(self):
+        self._teardown()
+        self.container.children = ()
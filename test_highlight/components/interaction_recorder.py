@@ -0,0 +1,373 @@
+"""
+Record user interactions with the dotplot viewers and replay them headless.
+
+The recorder is opt in: pass an `InteractionRecorder` as ``recorder=`` to
+`DotplotViewer`, `TestViewer`, `BinHighlighter` or `BinManager` (or set
+``TEST_HIGHLIGHT_RECORD=<path>`` and use `InteractionRecorder.from_env()`). It logs
+
+- ``viewer``: the data and bins of a viewer when it is first seen, so it can be rebuilt
+- ``hover``, ``unhover``, ``click``: the plotly `points` of pointer events
+- ``bins``: bin recomputation (number of bins, explicit edges)
+- ``reactive``: changes of the reactive values of a component
+- ``tool``: toolbar tool activations
+
+as timestamped json lines in a gzip file. `replay` drives the same sequence against
+headless viewers and reports the time taken by every event.
+
+Example:
+    ```python
+    recorder = InteractionRecorder('session.jsonl.gz')
+    TestViewer(gjapp, data=data, recorder=recorder)
+    ...
+    recorder.close()
+    ```
+
+and later, for every release:
+
+    python -m test_highlight.components.interaction_recorder session.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT = "test_highlight-interactions"
+VERSION = 1
+
+POINTER_EVENTS = ("hover", "unhover", "click")
+
+
+def _jsonable(value):
+    """A compact json representation of a reactive value (glue Data/Subset are stored by label)"""
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if np.isfinite(value) else None
+    if isinstance(value, np.generic):
+        return _jsonable(value.item())
+    if isinstance(value, np.ndarray):
+        return [_jsonable(v) for v in value.tolist()]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, "label"):
+        return {"label": value.label}
+    return repr(value)
+
+
+def _points(points) -> dict:
+    return {
+        "inds": [int(i) for i in points.point_inds],
+        "xs": [_jsonable(x) for x in points.xs],
+        "ys": [_jsonable(y) for y in points.ys],
+        "trace_name": points.trace_name,
+    }
+
+
+class InteractionRecorder:
+    """
+    Appends interaction events to a gzip json lines file if `path` is given, else collects them in `events`.
+
+    Viewers are identified by a name (`register_viewer`), so events from the components and
+    bin managers of the same viewer end up under the same source. Components register the
+    viewer on every mount and `unregister_viewer` it on cleanup, so a pooled viewer mounted
+    again with other data is recorded as a new source.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_values: int = 100_000):
+        self.path = path
+        self.max_values = max_values
+        # only without a file, a long session would otherwise keep every event in memory
+        self.events: List[dict] = []
+        self._start = time.perf_counter()
+        # id(viewer) -> (viewer, name) of the mounted viewers. The viewer is kept so its id can not be reused
+        self._sources: Dict[int, Tuple[object, str]] = {}
+        # every name used, so a viewer registered again gets a new one
+        self._names: set = set()
+        self._file = None
+        if path is not None:
+            self._file = gzip.open(path, "wt")
+            self._write({"format": FORMAT, "version": VERSION, "created": datetime.now(timezone.utc).isoformat()})
+
+    @classmethod
+    def from_env(cls, variable: str = "TEST_HIGHLIGHT_RECORD") -> Optional["InteractionRecorder"]:
+        """A recorder writing to the path in the environment variable, or None if it is not set"""
+        path = os.environ.get(variable)
+        return cls(path) if path else None
+
+    def _write(self, line: dict):
+        if self._file is not None:
+            self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def record(self, kind: str, source: str, **payload):
+        event = {"t": round(time.perf_counter() - self._start, 6), "kind": kind, "source": source, **payload}
+        if self._file is None:
+            self.events.append(event)
+        else:
+            self._write(event)
+        return event
+
+    def source(self, viewer) -> Optional[str]:
+        entry = self._sources.get(id(viewer))
+        return entry[1] if entry is not None and entry[0] is viewer else None
+
+    def register_viewer(self, viewer, name: Optional[str] = None) -> str:
+        """Name a viewer and record its data (once per mount). Returns the name"""
+        existing = self.source(viewer)
+        if existing is not None:
+            return existing
+        name = name or f"viewer-{len(self._names)}"
+        if name in self._names:
+            name = f"{name}-{len(self._names)}"
+        self._names.add(name)
+        self._sources[id(viewer)] = (viewer, name)
+
+        state = viewer.state
+        layers = []
+        for artist in viewer.layers:
+            layer = artist.layer
+            if layer is not getattr(layer, "data", layer):
+                # subsets are not replayed
+                continue
+            try:
+                values = np.asarray(layer[state.x_att], dtype=float)
+            except Exception:
+                continue
+            layers.append({"label": layer.label, "x": _jsonable(values[np.isfinite(values)][: self.max_values])})
+        self.record(
+            "viewer",
+            name,
+            layers=layers,
+            nbins=_jsonable(getattr(state, "hist_n_bin", None)),
+            x_min=_jsonable(state.x_min),
+            x_max=_jsonable(state.x_max),
+        )
+        return name
+
+    def unregister_viewer(self, viewer):
+        """Forget a viewer (on cleanup), the next `register_viewer` records its data again"""
+        if self.source(viewer) is not None:
+            del self._sources[id(viewer)]
+
+    def record_points(self, kind: str, source: str, points):
+        return self.record(kind, source, **_points(points))
+
+    def wrap(self, kind: str, source: str, callback: Callable) -> Callable:
+        """A plotly `(trace, points, state)` callback that records the points before calling `callback`"""
+
+        def recorded(trace, points, state):
+            self.record_points(kind, source, points)
+            return callback(trace, points, state)
+
+        return recorded
+
+    def watch(self, source: str, name: str, reactive) -> Callable:
+        """Record changes of a solara reactive value. Returns the unsubscribe function"""
+        return reactive.subscribe(lambda value: self.record("reactive", source, name=name, value=_jsonable(value)))
+
+    def watch_tools(self, viewer, source: str):
+        """Record the activation of every tool in the toolbar of `viewer`"""
+        for tool_id, tool in viewer.toolbar.tools.items():
+            activate = tool.activate
+
+            def recorded_activate(*args, activate=activate, tool_id=tool_id, **kwargs):
+                self.record("tool", source, tool=tool_id)
+                return activate(*args, **kwargs)
+
+            tool.activate = recorded_activate
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path: str) -> List[dict]:
+    """The events of a recording (without the header)"""
+    with gzip.open(path, "rt") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not an interaction recording")
+        if header.get("version", 0) > VERSION:
+            raise ValueError(f"{path} has version {header['version']}, only up to {VERSION} is supported")
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Replayer:
+    """
+    Rebuilds the recorded viewers (with a `BinHighlighter` each) and replays the events.
+
+    Pointer events go through the selection layer callbacks like real ones; ``bins`` and
+    the ``nbins``/``x_bounds`` reactive values are applied to the viewer state. ``bins``
+    redraw right away (not through the debounced `redraw_bins`), so their timing is the redraw. Other
+    reactive values can be handled by passing `handlers` (name -> function(viewer, value)).
+    """
+
+    def __init__(self, gjapp=None, handlers: Optional[Dict[str, Callable]] = None, highlighter_options: Optional[dict] = None):
+        if gjapp is None:
+            from glue_jupyter import JupyterApplication
+
+            gjapp = JupyterApplication()
+        self.gjapp = gjapp
+        self.handlers = {"nbins": self._set_nbins, "x_bounds": self._set_x_bounds, **(handlers or {})}
+        self.highlighter_options = highlighter_options or {}
+        self.viewers: Dict[str, object] = {}
+        self.highlighters: Dict[str, object] = {}
+
+    @staticmethod
+    def _set_nbins(viewer, value):
+        viewer.state.hist_n_bin = value
+
+    @staticmethod
+    def _set_x_bounds(viewer, value):
+        if value is not None and len(value) == 2:
+            with viewer.state.delay_callback("x_min", "x_max"):
+                viewer.state.x_min, viewer.state.x_max = value
+
+    def _build(self, event: dict):
+        from glue.core import Data
+
+        from .bin_highligher import BinHighlighter
+        from .viewer_pool import viewer_pool
+
+        viewer = viewer_pool(self.gjapp).acquire()
+        for layer in event["layers"]:
+            data = Data(label=f"{event['source']}: {layer['label']}", x=np.asarray(layer["x"], dtype=float))
+            self.gjapp.data_collection.append(data)
+            viewer.add_data(data)
+        state = viewer.state
+        with state.delay_callback("hist_n_bin", "x_min", "x_max"):
+            if event.get("nbins") is not None:
+                state.hist_n_bin = event["nbins"]
+            if event.get("x_min") is not None and event.get("x_max") is not None:
+                state.x_min, state.x_max = event["x_min"], event["x_max"]
+        highlighter = BinHighlighter(viewer, setup_selection_layer=True, **self.highlighter_options)
+        highlighter.setup_bin_highlight()
+        self.viewers[event["source"]] = viewer
+        self.highlighters[event["source"]] = highlighter
+
+    def _dispatch(self, event: dict) -> bool:
+        """Apply one event. False if there is nothing to apply it to"""
+        kind, source = event["kind"], event["source"]
+        if kind == "viewer":
+            self._build(event)
+            return True
+        viewer = self.viewers.get(source)
+        if viewer is None:
+            return False
+        if kind in POINTER_EVENTS:
+            from plotly.callbacks import InputDeviceState, Points
+
+            layer = viewer.selection_layer
+            points = Points(point_inds=event["inds"], xs=event["xs"], ys=event["ys"], trace_name=event.get("trace_name"), trace_index=0)
+            state = InputDeviceState(ctrl=False, alt=False, shift=False, meta=False, button=0, buttons=1 if kind == "click" else 0)
+            dispatch = {"hover": layer._dispatch_on_hover, "unhover": layer._dispatch_on_unhover, "click": layer._dispatch_on_click}[kind]
+            dispatch(points, state)
+        elif kind == "bins":
+            highlighter = self.highlighters[source]
+            if event.get("nbins") is not None:
+                viewer.state.hist_n_bin = event["nbins"]
+            highlighter.set_edges(None if event.get("edges") is None else np.asarray(event["edges"]), redraw=False)
+            highlighter._redraw()
+        elif kind == "reactive":
+            handler = self.handlers.get(event["name"])
+            if handler is None:
+                return False
+            handler(viewer, event["value"])
+        elif kind == "tool":
+            tool = viewer.toolbar.tools.get(event["tool"])
+            if tool is None:
+                return False
+            tool.activate()
+        else:
+            return False
+        return True
+
+    def replay(self, events: Iterable[dict], speed: Optional[float] = None) -> "ReplayReport":
+        """
+        Replay `events` in order. With `speed` (1 = as recorded) the recorded gaps between
+        events are kept, otherwise events are sent back to back.
+        """
+        report = ReplayReport()
+        start = time.perf_counter()
+        first = None
+        for event in events:
+            if speed is not None:
+                first = event["t"] if first is None else first
+                delay = start + (event["t"] - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            begin = time.perf_counter()
+            applied = self._dispatch(event)
+            report.add(event, time.perf_counter() - begin, applied)
+        return report
+
+
+class ReplayReport:
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.skipped: Dict[str, int] = defaultdict(int)
+        self.slowest: List[Tuple[float, dict]] = []
+
+    @staticmethod
+    def _key(event: dict) -> str:
+        return f"{event['kind']}:{event['name']}" if event["kind"] == "reactive" else event["kind"]
+
+    def add(self, event: dict, seconds: float, applied: bool = True):
+        key = self._key(event)
+        if not applied:
+            self.skipped[key] += 1
+            return
+        self.timings[key].append(seconds)
+        self.slowest.append((seconds, event))
+        self.slowest = sorted(self.slowest, key=lambda item: -item[0])[:10]
+
+    def summary(self) -> Dict[str, dict]:
+        """Per event type: count, p50, p99 and max in ms"""
+        summary = {}
+        for key, timings in self.timings.items():
+            ms = np.asarray(timings) * 1000
+            summary[key] = {"count": len(ms), "p50": float(np.percentile(ms, 50)), "p99": float(np.percentile(ms, 99)), "max": float(ms.max())}
+        return summary
+
+    def __str__(self):
+        lines = [f"{'event':>24} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+        for key, row in sorted(self.summary().items()):
+            lines.append(f"{key:>24} {row['count']:>7} {row['p50']:8.2f} {row['p99']:8.2f} {row['max']:8.2f}")
+        for key, count in sorted(self.skipped.items()):
+            lines.append(f"{key:>24} {count:>7} skipped")
+        if len(self.slowest) > 0:
+            lines.append("slowest:")
+            for seconds, event in self.slowest:
+                lines.append(f"  {seconds * 1000:8.2f} ms  t={event['t']:.3f} {event['source']} {self._key(event)}")
+        return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded interaction session against headless viewers")
+    parser.add_argument("recording", help="a .jsonl.gz file written by InteractionRecorder")
+    parser.add_argument("--speed", type=float, default=None, help="replay speed (1 = as recorded); default: back to back")
+    parser.add_argument("--json", action="store_true", help="print the summary as json")
+    args = parser.parse_args(argv)
+
+    report = Replayer().replay(load(args.recording), speed=args.speed)
+    print(json.dumps(report.summary(), indent=2) if args.json else report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+End-to-end hover latency tracing, from the browser event to the repaint.
+
+In tracing mode (``trace=True`` on `_PlotlyHighlighting`) the browser stamps every
+hover with an id and collects its timings, and sends them to Python in batches.
+
+For Python highlighting (`BinHighlighter`) a hover goes
+
+    browser hover -> comm to kernel -> _on_hover -> trace update comm -> Plotly repaint
+
+The browser records the hover event time, the time the hover message was sent, the
+time the trace update arrived (``plotly_restyle``) and the next frame (paint). The
+`BinHighlighter` records when `_on_hover` started and ended, and the two are matched
+by the hovered x value. The kernel stamps use the kernel clock, the browser ones the
+browser clock (both epoch ms), so ``comm_in`` and ``comm_out`` include any clock
+offset between the two machines; ``total`` and ``paint`` do not.
+
+For JavaScript highlighting (`PlotlyHighlighting`) the browser records the mousemove
+time, the start and end of the ``requestAnimationFrame`` callback in ``hubFrame``,
+and the next frame.
+
+Example:
+    ```python
+    tracer = latency_tracer(viewer._unique_class)
+    BinHighlighter(viewer, tracer=tracer)
+    _PlotlyHighlighting(viewer_id=viewer._unique_class, highlight=False, tracer=tracer)
+    ...
+    print(tracer.report())
+    remove_tracer(viewer._unique_class)  # on viewer cleanup
+    ```
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# stages of the latency breakdown, in order, per highlighting mode
+STAGES = {
+    "python": ("event_to_sent", "comm_in", "python", "comm_out", "paint", "total"),
+    "js": ("input_delay", "work", "paint", "total"),
+}
+
+
+def now_ms() -> float:
+    """Epoch time in ms, comparable with ``performance.timeOrigin + performance.now()``"""
+    return time.time() * 1000
+
+
+def _difference(later, earlier):
+    if later is None or earlier is None:
+        return None
+    return later - earlier
+
+
+class LatencyTracer:
+    """Matches browser and kernel timings of hovers and keeps one latency breakdown per event"""
+
+    def __init__(self, name: Optional[str] = None, max_events: int = 10_000, match_window_ms: float = 10_000):
+        self.name = name
+        self.match_window_ms = match_window_ms
+        self.max_events = max_events
+        # kernel side of python hovers not matched with a browser event yet, by hovered x
+        # (the x survives the json round trip exactly): (start, end) in hover order, and
+        # the x values in the order they were last hovered, to drop the oldest
+        self._kernel: "OrderedDict[float, Deque[Tuple[float, float]]]" = OrderedDict()
+        self._pending = 0
+        self.breakdowns: Deque[dict] = deque(maxlen=max_events)
+        self.unmatched = 0
+
+    def clear(self):
+        self._kernel.clear()
+        self._pending = 0
+        self.breakdowns.clear()
+        self.unmatched = 0
+
+    def kernel_hover(self, x: float, start: float, end: float):
+        """Record the start and end (epoch ms) of the python hover handler for the hover at `x`"""
+        self._kernel.setdefault(float(x), deque()).append((start, end))
+        self._kernel.move_to_end(float(x))
+        self._pending += 1
+        if self._pending > self.max_events:
+            _, dropped = self._kernel.popitem(last=False)
+            self._pending -= len(dropped)
+
+    def _match_kernel(self, x, sent) -> Optional[Tuple[float, float]]:
+        if x is None:
+            return None
+        records = self._kernel.get(float(x))
+        if records is None:
+            return None
+        # hovers at this x too long before the event were never matched
+        while sent is not None and len(records) > 0 and records[0][0] < sent - self.match_window_ms:
+            records.popleft()
+            self._pending -= 1
+        record = None
+        if len(records) > 0 and (sent is None or abs(records[0][0] - sent) < self.match_window_ms):
+            record = records.popleft()
+            self._pending -= 1
+        if len(records) == 0:
+            del self._kernel[float(x)]
+        return record
+
+    def add_browser_events(self, events: Sequence[dict]):
+        """Turn a batch of browser timing records into latency breakdowns"""
+        for event in events:
+            mode = event.get("mode")
+            if mode == "python":
+                breakdown = self._python_breakdown(event)
+            elif mode == "js":
+                breakdown = self._js_breakdown(event)
+            else:
+                continue
+            if breakdown is not None:
+                self.breakdowns.append(breakdown)
+
+    def _python_breakdown(self, event: dict) -> Optional[dict]:
+        kernel = self._match_kernel(event.get("x"), event.get("sent"))
+        if kernel is None:
+            self.unmatched += 1
+            return None
+        start, end = kernel
+        return {
+            "id": event.get("id"),
+            "mode": "python",
+            "x": event.get("x"),
+            "event_to_sent": _difference(event.get("sent"), event.get("event")),
+            "comm_in": _difference(start, event.get("sent")),
+            "python": end - start,
+            "comm_out": _difference(event.get("update"), end),
+            "paint": _difference(event.get("paint"), event.get("update")),
+            "total": _difference(event.get("paint"), event.get("event")),
+        }
+
+    @staticmethod
+    def _js_breakdown(event: dict) -> dict:
+        return {
+            "id": event.get("id"),
+            "mode": "js",
+            "input_delay": _difference(event.get("frame"), event.get("event")),
+            "work": _difference(event.get("applied"), event.get("frame")),
+            "paint": _difference(event.get("paint"), event.get("applied")),
+            "total": _difference(event.get("paint"), event.get("event")),
+        }
+
+    def percentiles(self, q: Sequence[float] = (50, 90, 99)) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """mode -> stage -> {"p50": ms, ...} over the recorded breakdowns"""
+        result = {}
+        for mode, stages in STAGES.items():
+            rows = [b for b in self.breakdowns if b["mode"] == mode]
+            if len(rows) == 0:
+                continue
+            result[mode] = {}
+            for stage in stages:
+                values = np.array([b[stage] for b in rows if b[stage] is not None], dtype=float)
+                if len(values) > 0:
+                    result[mode][stage] = {f"p{p:g}": float(np.percentile(values, p)) for p in q}
+        return result
+
+    def report(self, q: Sequence[float] = (50, 90, 99)) -> str:
+        lines = [f"== hover latency {self.name or ''}: {len(self.breakdowns)} events, {self.unmatched} unmatched"]
+        for mode, stages in self.percentiles(q).items():
+            lines.append(f"{mode:>14} " + " ".join(f"{f'p{p:g} ms':>9}" for p in q))
+            for stage, values in stages.items():
+                lines.append(f"{stage:>14} " + " ".join(f"{value:9.1f}" for value in values.values()))
+        return "\n".join(lines)
+
+
+_TRACERS: Dict[str, LatencyTracer] = {}
+
+
+def latency_tracer(viewer_id: str) -> LatencyTracer:
+    """The tracer of a viewer (created on first use)"""
+    tracer = _TRACERS.get(viewer_id)
+    if tracer is None:
+        tracer = _TRACERS[viewer_id] = LatencyTracer(name=viewer_id)
+    return tracer
+
+
+def remove_tracer(viewer_id: str):
+    """Forget the tracer of a viewer (on viewer cleanup)"""
+    _TRACERS.pop(viewer_id, None)
+
+
+def tracers() -> List[LatencyTracer]:
+    return list(_TRACERS.values())
+
+
+def report_all(q: Sequence[float] = (50, 90, 99)) -> str:
+    """The percentiles of every traced viewer"""
+    return "\n".join(tracer.report(q) for tracer in tracers())
@@ -0,0 +1,77 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .update_scheduler import NORMAL
+
+
+class LayerVisibilityController:
+    """
+    Shows and hides the layers of a glue viewer as a diff.
+
+    `apply(hidden)` compares the desired visibility of every layer artist with its
+    current visibility, and only touches the artists that change, all inside one
+    `figure.batch_update()`. The layer artist for each hidden Data/Subset is cached
+    by the id of the data, so `layer_artist_for_data` only runs for new layers.
+    With a `scheduler` (the viewer's `update_scheduler`) the changes are queued
+    behind hover feedback, and a newer `apply` replaces a queued one.
+
+    Example:
+        ```python
+        visibility = LayerVisibilityController(viewer)
+        visibility.apply([subset_1, data_2])  # hide these, show everything else
+        ```
+    """
+
+    def __init__(self, viewer, logger=None, name: Optional[str] = None, scheduler=None):
+        self.viewer = viewer
+        self.scheduler = scheduler
+        self.logger = logger
+        self.name = name
+        # id(data) -> (data, layer artist). The data is kept so its id can not be reused
+        self._artists: Dict[int, Tuple[object, object]] = {}
+
+    def clear_cache(self):
+        self._artists.clear()
+
+    def _artist_for(self, data, current_artists: set):
+        cached = self._artists.get(id(data))
+        if cached is not None and cached[0] is data and id(cached[1]) in current_artists:
+            return cached[1]
+        artist = self.viewer.layer_artist_for_data(data)
+        if artist is None:
+            if self.logger is not None:
+                self.logger.warning(f"{self.name}: Layer not found: {data}")
+            self._artists.pop(id(data), None)
+            return None
+        self._artists[id(data)] = (data, artist)
+        return artist
+
+    def changes(self, hidden: Iterable) -> List[Tuple[object, bool]]:
+        """(layer artist, visible) for every layer whose visibility differs from the desired one"""
+        layers = list(self.viewer.layers)
+        current_artists = {id(artist) for artist in layers}
+        hidden_ids = set()
+        for data in hidden:
+            artist = self._artist_for(data, current_artists)
+            if artist is not None:
+                hidden_ids.add(id(artist))
+        return [(artist, id(artist) not in hidden_ids) for artist in layers if artist is not None and artist.visible != (id(artist) not in hidden_ids)]
+
+    def _set_visible(self, changes: List[Tuple[object, bool]]):
+        with self.viewer.figure.batch_update():
+            for artist, visible in changes:
+                artist.visible = visible
+
+    def apply(self, hidden: Iterable) -> List[Tuple[object, bool]]:
+        """Hide the layers for the data in `hidden` and show all others. Returns the changes made"""
+        changes = self.changes(hidden)
+        if len(changes) == 0:
+            return changes
+        if self.scheduler is not None:
+            self.scheduler.submit_call(lambda: self._set_visible(changes), priority=NORMAL, key=(id(self), "visibility"))
+        else:
+            self._set_visible(changes)
+        if self.logger is not None:
+            shown = [artist.layer.label for artist, visible in changes if visible]
+            hidden_labels = [artist.layer.label for artist, visible in changes if not visible]
+            self.logger.info(f"({self.name}): Showing: {shown}, Hiding: {hidden_labels}")
+        return changes
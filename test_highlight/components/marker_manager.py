@@ -0,0 +1,287 @@
+import numpy as np
+import plotly.graph_objects as go
+from itertools import count
+from typing import Dict, Hashable, Iterable, Mapping, Optional, Sequence
+from uuid import uuid4
+
+from .update_scheduler import NORMAL
+
+
+class MarkerManager:
+    """
+    Manages many vertical line markers on a viewer's plotly figure.
+
+    Markers are either layout shapes (one per marker, like `figure.add_vline`) or,
+    with `as_trace=True`, a single scatter trace where the lines are separated by
+    NaN. In shape mode the manager keeps the index of every shape, so updates do
+    not scan `figure.layout.shapes` by name. Updates to many markers are sent in
+    one `batch_update`, or submitted to the viewer's `update_scheduler` if one is given.
+
+    Example:
+        ```python
+        markers = MarkerManager(viewer, color='red')
+        markers.set_positions({'class mean': 52.1, 'student 3': 61.0})
+        markers.set_positions({'student 3': 58.4})  # moves one marker
+        markers.set_visible(False)
+        ```
+    """
+
+    def __init__(
+        self,
+        viewer,
+        color: str = "red",
+        line_width: float = 2,
+        as_trace: bool = False,
+        visible: bool = True,
+        scheduler=None,
+    ):
+        self.viewer = viewer
+        self.color = color
+        self.line_width = line_width
+        self.as_trace = as_trace
+        self.visible = visible
+        self.scheduler = scheduler
+        self._id = str(uuid4())
+        self._keys: list = []
+        self._positions = np.array([], dtype=float)
+        self._key_index: Dict[Hashable, int] = {}
+        self._shape_names: list = []
+        # never reused, so names stay unique after markers are removed
+        self._shape_counter = count()
+        self._shape_index: list = []
+        self._colors: list = []
+        self._extent_callbacks = as_trace and hasattr(viewer, "state")
+        if self._extent_callbacks:
+            for att in ("y_min", "y_max"):
+                viewer.state.add_callback(att, self._refresh_extent)
+
+    @property
+    def figure(self):
+        return self.viewer.figure
+
+    @property
+    def keys(self) -> list:
+        return list(self._keys)
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions.copy()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def position(self, key: Hashable) -> Optional[float]:
+        i = self._key_index.get(key)
+        return None if i is None else float(self._positions[i])
+
+    # ---- shape mode ----
+
+    def _shape_dict(self, name: str, x: float, color: str) -> dict:
+        return dict(
+            type="line",
+            name=name,
+            x0=float(x),
+            x1=float(x),
+            xref="x",
+            y0=0,
+            y1=1,
+            yref="y domain",
+            line=dict(color=color, width=self.line_width),
+            visible=self.visible and bool(np.isfinite(x)),
+        )
+
+    def _reindex_shapes(self):
+        """Find our shapes again if other code added or removed shapes"""
+        where = {shape.name: i for i, shape in enumerate(self.figure.layout.shapes)}
+        self._shape_index = [where.get(name, -1) for name in self._shape_names]
+
+    def _valid_shape_index(self) -> bool:
+        shapes = self.figure.layout.shapes
+        if len(self._shape_index) == 0:
+            return True
+        # spot check the ends rather than scanning every shape
+        for j in (0, -1):
+            i = self._shape_index[j]
+            if i < 0 or i >= len(shapes) or shapes[i].name != self._shape_names[j]:
+                return False
+        return True
+
+    def _add_shapes(self, keys: Sequence[Hashable], xs: np.ndarray, colors: Sequence[str]):
+        names = [f"{self._id}-{next(self._shape_counter)}" for _ in keys]
+        start = len(self.figure.layout.shapes)
+        new_shapes = [self._shape_dict(name, x, color) for name, x, color in zip(names, xs, colors)]
+        self._flush_scheduled()
+        # one relayout for all new shapes instead of one add_vline per marker
+        self.figure.layout.shapes = tuple(self.figure.layout.shapes) + tuple(new_shapes)
+        self._shape_names.extend(names)
+        self._shape_index.extend(range(start, start + len(names)))
+
+    def _readd_shapes(self, rows: Sequence[int]):
+        """Add the shapes of marker rows whose shape was removed by other code (e.g. a viewer reset)"""
+        start = len(self.figure.layout.shapes)
+        new_shapes = [self._shape_dict(self._shape_names[i], float(self._positions[i]), self._colors[i]) for i in rows]
+        self._flush_scheduled()
+        self.figure.layout.shapes = tuple(self.figure.layout.shapes) + tuple(new_shapes)
+        for k, i in enumerate(rows):
+            self._shape_index[i] = start + k
+
+    def _flush_scheduled(self):
+        # queued updates to shapes are lost when layout.shapes is replaced, so send them first
+        if self.scheduler is not None:
+            self.scheduler.flush(force=True)
+
+    def _update_shapes(self, indices: np.ndarray):
+        if not self._valid_shape_index():
+            self._reindex_shapes()
+        missing = [i for i in indices if self._shape_index[i] < 0]
+        if len(missing) > 0:
+            # shapes[-1] would be another shape. Add ours back, at their current positions
+            self._readd_shapes(missing)
+            readded = set(missing)
+            indices = [i for i in indices if i not in readded]
+        shapes = self.figure.layout.shapes
+        if self.scheduler is not None:
+            for i in indices:
+                x = float(self._positions[i])
+                self.scheduler.submit(shapes[self._shape_index[i]], dict(x0=x, x1=x, visible=self.visible and bool(np.isfinite(x))), priority=NORMAL)
+            return
+        with self.figure.batch_update():
+            for i in indices:
+                x = float(self._positions[i])
+                shape = shapes[self._shape_index[i]]
+                shape.update(x0=x, x1=x, visible=self.visible and bool(np.isfinite(x)))
+
+    # ---- trace mode ----
+
+    @property
+    def marker_trace(self) -> Optional[go.Scatter]:
+        return next(self.figure.select_traces({"meta": self._id}), None)
+
+    def _extent(self):
+        state = getattr(self.viewer, "state", None)
+        y_min = getattr(state, "y_min", None)
+        y_max = getattr(state, "y_max", None)
+        if y_min is None or y_max is None:
+            return 0, 1
+        return y_min, y_max
+
+    def _trace_xy(self):
+        n = len(self._positions)
+        xs = np.full(3 * n, np.nan)
+        xs[0::3] = self._positions
+        xs[1::3] = self._positions
+        y_min, y_max = self._extent()
+        ys = np.tile([y_min, y_max, np.nan], n)
+        return xs, ys
+
+    def _update_trace(self):
+        xs, ys = self._trace_xy()
+        trace = self.marker_trace
+        if trace is None:
+            self.figure.add_trace(
+                go.Scatter(
+                    x=xs,
+                    y=ys,
+                    mode="lines",
+                    meta=self._id,
+                    line=dict(color=self.color, width=self.line_width),
+                    hoverinfo="skip",
+                    showlegend=False,
+                    connectgaps=False,
+                    visible=self.visible,
+                )
+            )
+        elif self.scheduler is not None:
+            self.scheduler.submit(trace, dict(x=xs, y=ys, visible=self.visible), priority=NORMAL)
+        else:
+            with self.figure.batch_update():
+                trace.update(x=xs, y=ys, visible=self.visible)
+
+    def _refresh_extent(self, *args):
+        if len(self._keys) > 0:
+            self._update_trace()
+
+    # ---- public api ----
+
+    def set_positions(self, positions: Mapping[Hashable, float] | Sequence[float] | np.ndarray, colors: Optional[Mapping[Hashable, str]] = None):
+        """
+        Add or move markers. `positions` is a mapping of marker key to x value,
+        or an array, in which case the markers are keyed by their index.
+        A NaN (or None) position hides a marker.
+        """
+        if isinstance(positions, Mapping):
+            keys = list(positions.keys())
+            xs = np.array([np.nan if v is None else v for v in positions.values()], dtype=float)
+        else:
+            xs = np.asarray(positions, dtype=float).ravel()
+            keys = list(range(len(xs)))
+        colors = colors or {}
+
+        index = np.array([self._key_index.get(k, -1) for k in keys], dtype=int)
+        existing = index >= 0
+        self._positions[index[existing]] = xs[existing]
+
+        new_keys = [k for k, e in zip(keys, existing) if not e]
+        new_xs = xs[~existing]
+        new_colors = [colors.get(k, self.color) for k in new_keys]
+        start = len(self._keys)
+        for j, key in enumerate(new_keys):
+            self._key_index[key] = start + j
+        self._keys.extend(new_keys)
+        self._colors.extend(new_colors)
+        self._positions = np.concatenate([self._positions, new_xs])
+
+        if self.as_trace:
+            self._update_trace()
+            return
+        # adding replaces layout.shapes, so it must not happen inside the batch of updates
+        if len(new_keys) > 0:
+            self._add_shapes(new_keys, new_xs, new_colors)
+        if existing.any():
+            self._update_shapes(index[existing])
+
+    def set_position(self, key: Hashable, x: Optional[float]):
+        self.set_positions({key: x})
+
+    def set_visible(self, visible: bool):
+        if visible == self.visible:
+            return
+        self.visible = visible
+        if self.as_trace:
+            trace = self.marker_trace
+            if trace is not None and self.scheduler is not None:
+                self.scheduler.submit(trace, dict(visible=visible), priority=NORMAL)
+            elif trace is not None:
+                trace.visible = visible
+        else:
+            self._update_shapes(np.arange(len(self._keys)))
+
+    def close(self):
+        """Stop following the viewer's y range. The viewer may outlive the manager (see viewer_pool)"""
+        if self._extent_callbacks:
+            for att in ("y_min", "y_max"):
+                self.viewer.state.remove_callback(att, self._refresh_extent)
+            self._extent_callbacks = False
+
+    def remove(self, keys: Optional[Iterable[Hashable]] = None):
+        """Remove some (or, by default, all) markers"""
+        remove = set(self._keys if keys is None else keys)
+        keep = [i for i, k in enumerate(self._keys) if k not in remove]
+        if not self.as_trace:
+            if not self._valid_shape_index():
+                self._reindex_shapes()
+            drop = {self._shape_index[i] for i, k in enumerate(self._keys) if k in remove and self._shape_index[i] >= 0}
+            self._flush_scheduled()
+            self.figure.layout.shapes = tuple(s for i, s in enumerate(self.figure.layout.shapes) if i not in drop)
+            self._shape_names = [self._shape_names[i] for i in keep]
+            self._reindex_shapes()
+        self._keys = [self._keys[i] for i in keep]
+        self._colors = [self._colors[i] for i in keep]
+        self._positions = self._positions[keep]
+        self._key_index = {k: i for i, k in enumerate(self._keys)}
+        if self.as_trace:
+            trace = self.marker_trace
+            if len(self._keys) == 0 and trace is not None:
+                self.figure.data = tuple(t for t in self.figure.data if getattr(t, "meta", None) != self._id)
+            elif trace is not None:
+                self._update_trace()
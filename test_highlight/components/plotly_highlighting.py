@@ -0,0 +1,78 @@
+# type: ignore
+import solara
+from ipyvuetify import VuetifyTemplate
+import os
+import numpy as np
+from traitlets import Any, Unicode, Bool, Float, Int, List
+
+
+def _array_to_binary(value, widget):
+    """Send a float array as a little endian float64 buffer instead of a json list"""
+    if value is None:
+        return None
+    return memoryview(np.ascontiguousarray(value, dtype='<f8').ravel())
+
+
+class _PlotlyHighlighting(VuetifyTemplate):
+    template_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "PlotlyHighlighting.vue"))
+    # class of the viewer's root element, and the key of this widget in the page's pointer
+    # hub (one shared pointer listener for all instances, see pointerHub in the .vue file)
+    viewer_id = Unicode().tag(sync=True)
+    show = Bool(False).tag(sync=True)
+    highlight = Bool(True).tag(sync=True)
+    debug = Bool(False).tag(sync=True)
+    fillColor = Unicode('rgba(0, 0, 0)').tag(sync=True)
+    fillOpacity = Float(0.5).tag(sync=True)
+    strokeColor = Unicode('rgba(255, 120, 255, 1)').tag(sync=True)
+    strokeOpacity = Float(1).tag(sync=True)
+    strokeWidth = Float(1).tag(sync=True)
+    opacity = Float(1).tag(sync=True)
+    # 'geometry': find the hovered bin from bin_edges (or the bin layer data) and the
+    # axis transforms, 'dom': among the svg paths of the bin layer
+    hit_test = Unicode('geometry').tag(sync=True)
+    # lo, hi of each bin, flattened. Set by follow(bin_manager)
+    bin_edges = Any(None, allow_none=True).tag(sync=True, to_json=_array_to_binary)
+    # latency tracing (see latency_tracing.py): the browser stamps hovers and sends
+    # their timings back in batches, which end up in trace_events
+    trace = Bool(False).tag(sync=True)
+    trace_interval = Int(500).tag(sync=True)
+    trace_events = List()
+    max_trace_events = 1000
+    
+    def __init__(self, viewer_id = '', show = False, highlight = True, debug = False, tracer = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.viewer_id = viewer_id
+        self.show = show
+        self.highlight = highlight
+        self.debug = debug
+        self.tracer = tracer
+        if tracer is not None:
+            self.trace = True
+    
+    def follow(self, bin_manager):
+        """Keep bin_edges in sync with the bin layer of `bin_manager`. Returns a function that stops"""
+        def update(manager):
+            intervals = manager.hit_intervals() if manager.traces_added else None
+            self.bin_edges = None if intervals is None else intervals.ravel()
+        update(bin_manager)
+        return bin_manager.on_bins_changed(update)
+    
+    def vue_trace_batch(self, events):
+        """Called from the browser with a batch of hover timing records"""
+        self.trace_events = (self.trace_events + list(events))[-self.max_trace_events:]
+        if self.tracer is not None:
+            self.tracer.add_browser_events(events)
+
+
+@solara.component
+def PlotlyHighlighting(viewer_id: solara.Reactive[str] | str='', show=False, highlight=True, debug = False, tracer = None, hit_test = 'geometry'):
+    viewer_id = solara.reactive(viewer_id)
+    
+    return _PlotlyHighlighting.element(viewer_id=viewer_id.value, show=show, highlight=highlight, debug=debug, tracer=tracer, hit_test=hit_test)
+
+    
+    
+# @solara.component_vue('PlotlyHighlighting.vue')
+# def PlotlyHighlighting():
+#     pass
+
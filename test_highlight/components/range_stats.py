@@ -0,0 +1,213 @@
+"""
+Count, sum, mean, quantiles and min/max of the values inside any x interval.
+
+Zooming, moving ``x_bounds`` or clicking a bin used to recompute summary statistics
+over the raw glue arrays. A `RangeStatsIndex` sorts the values once and keeps prefix
+sums, so every statistic of the values in ``[lo, hi)`` is two binary searches and a
+few lookups, O(log n) instead of O(n).
+
+Indexes are cached per (dataset, attribute) and rebuilt only when the component array
+of the dataset is replaced. Subsets get their own index, rebuilt when their subset
+state (or the array of their dataset) is replaced.
+
+Example:
+    ```python
+    index = range_index(data, 'velocity_value')
+    index.stats(10, 20)  # {'count': ..., 'sum': ..., 'mean': ..., 'median': ..., 'min': ..., 'max': ...}
+    index.quantile(10, 20, [0.25, 0.75])
+    bin_manager.range_stats(10, 20, layers=True)  # also per layer of the viewer
+    ```
+"""
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary, ref
+
+import numpy as np
+
+from ..columnar import full_precision_column, full_values
+
+# a variance below this fraction of the squares summed up to the slice lost too many
+# digits to the prefix difference, and is computed from the slice instead
+_CANCELLATION = 1e-6
+
+
+class RangeStatsIndex:
+    """Sorted finite values with prefix sums of the values and of their squares, centered on the mean"""
+
+    def __init__(self, values, source=None):
+        values = np.asarray(values, dtype=float).ravel()
+        self.values = np.sort(values[np.isfinite(values)])
+        self.values.setflags(write=False)
+        # centered, so the squares (and their rounding errors) are of the spread, not of the offset
+        self.center = float(self.values.mean()) if len(self.values) > 0 else 0.0
+        centered = self.values - self.center
+        self.prefix = np.concatenate(([0.0], np.cumsum(centered)))
+        self.prefix_sq = np.concatenate(([0.0], np.cumsum(centered ** 2)))
+        # the array the index was built from, to notice when it is replaced
+        self.source = source
+
+    def __len__(self):
+        return len(self.values)
+
+    def bounds(self, lo: Optional[float] = None, hi: Optional[float] = None) -> Tuple[int, int]:
+        """Slice of the sorted values inside [lo, hi). None is unbounded"""
+        start = 0 if lo is None else int(np.searchsorted(self.values, lo, side="left"))
+        stop = len(self.values) if hi is None else int(np.searchsorted(self.values, hi, side="left"))
+        return start, max(start, stop)
+
+    def count(self, lo=None, hi=None) -> int:
+        start, stop = self.bounds(lo, hi)
+        return stop - start
+
+    def sum(self, lo=None, hi=None) -> float:
+        start, stop = self.bounds(lo, hi)
+        return float(self.prefix[stop] - self.prefix[start] + (stop - start) * self.center)
+
+    def mean(self, lo=None, hi=None) -> float:
+        start, stop = self.bounds(lo, hi)
+        if stop == start:
+            return np.nan
+        return float(self.center + (self.prefix[stop] - self.prefix[start]) / (stop - start))
+
+    def std(self, lo=None, hi=None) -> float:
+        start, stop = self.bounds(lo, hi)
+        n = stop - start
+        if n == 0:
+            return np.nan
+        mean = (self.prefix[stop] - self.prefix[start]) / n
+        variance = (self.prefix_sq[stop] - self.prefix_sq[start]) / n - mean ** 2
+        if variance * n <= _CANCELLATION * self.prefix_sq[stop]:
+            # a narrow slice: O(n) on the slice, not the whole index
+            variance = float(np.var(self.values[start:stop]))
+        return float(np.sqrt(max(variance, 0.0)))
+
+    def min(self, lo=None, hi=None) -> float:
+        start, stop = self.bounds(lo, hi)
+        return float(self.values[start]) if stop > start else np.nan
+
+    def max(self, lo=None, hi=None) -> float:
+        start, stop = self.bounds(lo, hi)
+        return float(self.values[stop - 1]) if stop > start else np.nan
+
+    def quantile(self, lo=None, hi=None, q: float | Sequence[float] = 0.5):
+        """Quantile(s) of the values in [lo, hi), linear interpolation like np.quantile"""
+        start, stop = self.bounds(lo, hi)
+        q_array = np.asarray(q, dtype=float)
+        if stop == start:
+            result = np.full(q_array.shape, np.nan)
+        else:
+            position = start + q_array * (stop - start - 1)
+            below = np.floor(position).astype(int)
+            above = np.minimum(below + 1, stop - 1)
+            fraction = position - below
+            result = self.values[below] * (1 - fraction) + self.values[above] * fraction
+        return float(result) if q_array.ndim == 0 else result
+
+    def median(self, lo=None, hi=None) -> float:
+        return self.quantile(lo, hi, 0.5)
+
+    def stats(self, lo=None, hi=None) -> Dict[str, float]:
+        """count, sum, mean, std, median, min and max of the values in [lo, hi)"""
+        return {
+            "count": self.count(lo, hi),
+            "sum": self.sum(lo, hi),
+            "mean": self.mean(lo, hi),
+            "std": self.std(lo, hi),
+            "median": self.median(lo, hi),
+            "min": self.min(lo, hi),
+            "max": self.max(lo, hi),
+        }
+
+
+# dataset -> attribute -> index. Datasets that are garbage collected drop out
+_DATA_INDEXES: "WeakKeyDictionary[object, Dict[Hashable, RangeStatsIndex]]" = WeakKeyDictionary()
+# combined datasets, by content
+_CONTENT_INDEXES: "OrderedDict[Hashable, RangeStatsIndex]" = OrderedDict()
+_CONTENT_INDEXES_SIZE = 32
+
+
+def _component_array(data, attribute):
+    full = full_precision_column(data, attribute)
+    if full is not None:
+        return full
+    try:
+        return data.get_component(attribute).data
+    except Exception:
+        return np.asarray(data[attribute])
+
+
+def _content_index(key: Hashable, values) -> RangeStatsIndex:
+    if key in _CONTENT_INDEXES:
+        _CONTENT_INDEXES.move_to_end(key)
+        return _CONTENT_INDEXES[key]
+    index = _CONTENT_INDEXES[key] = RangeStatsIndex(values)
+    if len(_CONTENT_INDEXES) > _CONTENT_INDEXES_SIZE:
+        _CONTENT_INDEXES.popitem(last=False)
+    return index
+
+
+def range_index(data, attribute) -> RangeStatsIndex:
+    """The index of `attribute` of a glue Data or Subset (built on first use)"""
+    name = str(attribute)
+    parent = getattr(data, "data", data)
+    if parent is not data:
+        # a subset: its rows change with its subset state. Kept with the indexes of its
+        # dataset, and rebuilt when the subset state or the dataset's array is replaced
+        array = _component_array(parent, attribute)
+        indexes = _DATA_INDEXES.setdefault(parent, {})
+        key = (name, id(data))
+        index = indexes.get(key)
+        if index is None or index.source[0]() is not data or index.source[1] is not data.subset_state or index.source[2] is not array:
+            values = np.asarray(full_values(data, attribute), dtype=float).ravel()
+            # a weak reference, so a deleted subset (whose id may be reused) is not kept alive
+            index = indexes[key] = RangeStatsIndex(values, source=(ref(data), data.subset_state, array))
+        return index
+    source = _component_array(data, attribute)
+    indexes = _DATA_INDEXES.setdefault(data, {})
+    index = indexes.get(name)
+    if index is None or index.source is not source:
+        index = indexes[name] = RangeStatsIndex(source, source=source)
+    return index
+
+
+def viewer_range_index(viewer) -> Optional[RangeStatsIndex]:
+    """One index of the x attribute of all the datasets (not subsets) shown in a viewer"""
+    state = viewer.state
+    datasets = [layer.layer for layer in state.layers
+                if getattr(layer, "layer", None) is not None and getattr(layer.layer, "data", layer.layer) is layer.layer]
+    indexes = [range_index(data, state.x_att) for data in datasets]
+    if len(indexes) == 0:
+        return None
+    if len(indexes) == 1:
+        return indexes[0]
+    # the dataset indexes identify their content, so they key the combined index
+    key = ("combined",) + tuple(id(index) for index in indexes)
+    combined = _CONTENT_INDEXES.get(key)
+    if combined is None or combined.source != tuple(indexes):
+        _CONTENT_INDEXES.pop(key, None)
+        combined = _content_index(key, np.concatenate([index.values for index in indexes]))
+        combined.source = tuple(indexes)
+    return combined
+
+
+def layer_range_indexes(viewer) -> Dict[str, RangeStatsIndex]:
+    """Index of the x attribute of every layer (datasets and subsets) of a viewer, by label"""
+    state = viewer.state
+    indexes = {}
+    for layer in state.layers:
+        if getattr(layer, "layer", None) is None:
+            continue
+        try:
+            indexes[layer.layer.label] = range_index(layer.layer, state.x_att)
+        except Exception:
+            continue
+    return indexes
+
+
+def viewer_range_stats(viewer, lo=None, hi=None, layers: bool = False) -> Dict[str, object]:
+    """Statistics of the viewer's data in [lo, hi); with `layers` also per layer under 'layers'"""
+    index = viewer_range_index(viewer)
+    result: Dict[str, object] = index.stats(lo, hi) if index is not None else RangeStatsIndex([]).stats()
+    if layers:
+        result["layers"] = {label: layer_index.stats(lo, hi) for label, layer_index in layer_range_indexes(viewer).items()}
+    return result
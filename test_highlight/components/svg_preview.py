@@ -0,0 +1,196 @@
+"""
+A static SVG of a dotplot, shown while the interactive viewer is built.
+
+Until glue, the plotly FigureWidget and the comm round trips are done, `DotplotViewer`
+shows an empty card, which takes seconds on slow machines. `SvgPreview` renders the
+histogram of the data as a plain SVG string in Python (stacked dots, or bars when
+there are too many dots) and puts it in the viewer container right away. When the
+viewer is set up, `swap` replaces it with the figure and logs how long the preview
+was shown.
+
+The bin counts are cached by content (and looked up in `BinningEngine.precomputed`
+first), so a remount or another session with the same data does not histogram it
+again. Rendering is a few milliseconds; the time is logged.
+
+Example:
+    ```python
+    preview = SvgPreview(viewer_widget, logger=logger, name=title)
+    preview.show(values, nbin=75, x_range=(0, 100), color="#1f77b4")
+    ...  # build the viewer
+    preview.swap((pl, viewer.figure_widget))
+    ```
+"""
+import time
+from collections import OrderedDict
+from html import escape
+from typing import Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .binning import bin_statistics, data_version
+
+# above this many dots the preview draws bars
+MAX_PREVIEW_DOTS = 3000
+PREVIEW_WIDTH = 800
+DEFAULT_MARGINS = {"l": 50, "r": 10, "t": 10, "b": 40}
+
+_PREVIEW_COUNTS: "OrderedDict[Hashable, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_PREVIEW_COUNTS_SIZE = 32
+
+
+def _finite(values) -> np.ndarray:
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+
+def preview_counts(values, nbin: int = 75, x_range: Optional[Sequence[float]] = None, edges=None, precomputed=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (counts, edges) of ``values`` in ``nbin`` bins over ``x_range`` (default: the data range),
+    or in the given ``edges``. Cached by content; `precomputed` is a `PrecomputedStore`.
+    """
+    values = _finite(values)
+    if edges is None:
+        if x_range is not None and len(x_range) == 2 and None not in x_range:
+            lo, hi = float(min(x_range)), float(max(x_range))
+        elif values.size > 0:
+            lo, hi = float(values.min()), float(values.max())
+        else:
+            lo, hi = 0.0, 1.0
+        if hi <= lo:
+            lo, hi = lo - 0.5, hi + 0.5
+        edges = np.linspace(lo, hi, max(int(nbin), 1) + 1)
+    edges = np.asarray(edges, dtype=float)
+    key = (data_version(values), data_version(edges))
+    if key in _PREVIEW_COUNTS:
+        _PREVIEW_COUNTS.move_to_end(key)
+        return _PREVIEW_COUNTS[key]
+    counts = precomputed.counts(values, edges, values_version=key[0], edges_version=key[1]) if precomputed is not None else None
+    if counts is None:
+        counts = bin_statistics(values, edges)[0]
+    _PREVIEW_COUNTS[key] = (np.asarray(counts), edges)
+    if len(_PREVIEW_COUNTS) > _PREVIEW_COUNTS_SIZE:
+        _PREVIEW_COUNTS.popitem(last=False)
+    return _PREVIEW_COUNTS[key]
+
+
+def _nice_ticks(lo: float, hi: float, target: int = 5) -> np.ndarray:
+    """Round tick values (steps of 1, 2 or 5 times a power of ten) inside [lo, hi]"""
+    span = hi - lo
+    if span <= 0:
+        return np.array([lo])
+    raw = span / target
+    power = 10 ** np.floor(np.log10(raw))
+    step = next(power * m for m in (1, 2, 5, 10) if power * m >= raw)
+    # + 0.0 turns -0.0 into 0.0
+    return np.arange(np.ceil(lo / step) * step, hi + step * 1e-9, step) + 0.0
+
+
+def render_svg(
+    counts,
+    edges,
+    width: int = PREVIEW_WIDTH,
+    height: int = 300,
+    color: str = "#808080",
+    margins: Optional[dict] = None,
+    x_label: Optional[str] = None,
+    max_dots: int = MAX_PREVIEW_DOTS,
+) -> str:
+    """The histogram as an SVG string: one dot per count stacked in each bin, or bars above `max_dots` dots"""
+    counts = np.asarray(counts, dtype=int)
+    edges = np.asarray(edges, dtype=float)
+    margins = {**DEFAULT_MARGINS, **(margins or {})}
+    left, top = margins["l"], margins["t"]
+    plot_w = max(width - margins["l"] - margins["r"], 1)
+    plot_h = max(height - margins["t"] - margins["b"], 1)
+    lo, hi = edges[0], edges[-1]
+    scale = plot_w / (hi - lo) if hi > lo else 0.0
+    x_px = left + (edges - lo) * scale
+    bottom = top + plot_h
+    top_count = max(int(counts.max()) if counts.size > 0 else 0, 1)
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="100%" height="{height}" viewBox="0 0 {width} {height}" '
+             f'preserveAspectRatio="xMinYMid meet" font-family="sans-serif" font-size="12">']
+    color = escape(color, quote=True)
+    if counts.sum() <= max_dots:
+        # dots fill the bin width, or the height for the fullest bin
+        bin_w = float(np.min(np.diff(x_px))) if len(x_px) > 1 else plot_w
+        r = max(min(bin_w / 2, plot_h / (2 * top_count)), 0.5)
+        parts.append(f'<g fill="{color}">')
+        for i in np.flatnonzero(counts):
+            cx = (x_px[i] + x_px[i + 1]) / 2
+            for k in range(counts[i]):
+                parts.append(f'<circle cx="{cx:.1f}" cy="{bottom - r * (2 * k + 1):.1f}" r="{r:.1f}"/>')
+        parts.append('</g>')
+    else:
+        parts.append(f'<g fill="{color}" shape-rendering="crispEdges">')
+        for i in np.flatnonzero(counts):
+            h = plot_h * counts[i] / top_count
+            parts.append(f'<rect x="{x_px[i]:.1f}" y="{bottom - h:.1f}" width="{max(x_px[i + 1] - x_px[i], 1):.1f}" height="{h:.1f}"/>')
+        parts.append('</g>')
+
+    # x axis
+    parts.append(f'<g stroke="#444" fill="#444"><line x1="{left}" y1="{bottom}" x2="{left + plot_w}" y2="{bottom}"/>')
+    ticks = _nice_ticks(lo, hi)
+    step = ticks[1] - ticks[0] if len(ticks) > 1 else 1.0
+    decimals = max(int(-np.floor(np.log10(step))), 0) if step > 0 else 0
+    for tick in ticks:
+        tx = left + (tick - lo) * scale
+        parts.append(f'<line x1="{tx:.1f}" y1="{bottom}" x2="{tx:.1f}" y2="{bottom + 5}"/>')
+        parts.append(f'<text x="{tx:.1f}" y="{bottom + 18}" text-anchor="middle" stroke="none">{tick:,.{decimals}f}</text>')
+    parts.append('</g>')
+    if x_label:
+        parts.append(f'<text x="{left + plot_w / 2:.1f}" y="{height - 4}" text-anchor="middle" font-size="14">{escape(x_label)}</text>')
+    parts.append('</svg>')
+    return "".join(parts)
+
+
+class SvgPreview:
+    """Shows a static SVG in a container widget until the interactive figure replaces it"""
+
+    def __init__(self, container, logger=None, name: Optional[str] = None):
+        """
+        Parameters
+        ----------
+        container : ipywidgets.Widget
+            The widget whose children are the preview, and then the figure (e.g. the viewer container).
+        logger : logging.Logger, optional
+            Logs the render time of the preview and how long it was shown.
+        """
+        self.container = container
+        self.logger = logger
+        self.name = name
+        self.render_ms: Optional[float] = None
+        self.shown_at: Optional[float] = None
+
+    def show(
+        self,
+        values,
+        nbin: int = 75,
+        x_range: Optional[Sequence[float]] = None,
+        edges=None,
+        height: int = 300,
+        color: str = "#808080",
+        margins: Optional[dict] = None,
+        x_label: Optional[str] = None,
+        precomputed=None,
+    ) -> str:
+        """Render the preview of ``values`` and put it in the container. Returns the SVG"""
+        # ipywidgets comes with ipyvuetify, but is only needed once a preview is shown
+        from ipywidgets import HTML
+
+        start = time.perf_counter()
+        counts, edges = preview_counts(values, nbin=nbin, x_range=x_range, edges=edges, precomputed=precomputed)
+        svg = render_svg(counts, edges, height=height, color=color, margins=margins, x_label=x_label)
+        self.render_ms = (time.perf_counter() - start) * 1000
+        self.container.children = (HTML(value=svg),)
+        self.shown_at = time.perf_counter()
+        if self.logger is not None:
+            self.logger.info(f"{self.name}: SVG preview rendered in {self.render_ms:.1f} ms ({int(np.sum(counts))} values, {len(counts)} bins)")
+        return svg
+
+    def swap(self, children: tuple):
+        """Replace the preview with the interactive figure (`children` of the container)"""
+        self.container.children = tuple(children)
+        if self.shown_at is not None and self.logger is not None:
+            self.logger.info(f"{self.name}: interactive figure replaced the preview after {(time.perf_counter() - self.shown_at) * 1000:.0f} ms")
+        self.shown_at = None
@@ -5,10 +5,14 @@ from hubbleds.viewers.hubble_dotplot import HubbleDotPlotView, HubbleDotPlotView
 from glue.core import Data
 import numpy as np
 from typing import Callable, Optional, List, cast
-from .bin_highligher import BinHighlighter
-from .BinManager import BinManager
-from .PlotlyHighlighting import _PlotlyHighlighting
+from .highlight_modes import HighlightModeController
+from .binning import BINNING_ENGINE, is_uniform
 from hubbleds.utils import PLOTLY_MARGINS
+from .viewer_pool import viewer_pool
+from .update_scheduler import update_scheduler
+from .latency_tracing import latency_tracer, remove_tracer
+from .webgl import WebGLDots
+from .callback_dispatcher import selection_dispatcher
 
 
 @solara.component
@@ -21,7 +25,12 @@ def TestViewer(gjapp,
                on_hover_callback = None,
                nbins: solara.Reactive[int] | int = 15,
                bin_width: solara.Reactive[float] | float = 1,
-               use_python_highlighing: bool = True
+               use_python_highlighing: bool = True,
+               bin_rule: Optional[str] = None,
+               recorder = None,
+               trace_latency: bool = False,
+               webgl: bool = False,
+               stacked_highlight: bool = False,
                ):
     """
     A Solara component to create a test viewer with bin highlighting.
@@ -43,6 +52,15 @@ def TestViewer(gjapp,
             - Default: 1.0 for both BinHighlighter and PlotlyHighlighting
         use_python_highlighing: Boolean to use Python-based highlighting (BinHighlighter) or Plotly-based highlighting (PlotlyHighlighting).
             - Default: True for BinHighlighter, False for PlotlyHighlighting
+        bin_rule: Optional binning rule ('fd', 'scott', 'knuth' or 'bayesian_blocks') used for the
+            initial bins instead of `nbins`. Changing `nbins` afterwards still sets the number of bins.
+        recorder: Optional `InteractionRecorder` that records the pointer events, bin changes and
+            reactive values of the viewer for replay.
+        trace_latency: Boolean to collect end-to-end hover latency (browser event to repaint) for
+            both highlighting modes. The breakdowns are in `latency_tracer(viewer._unique_class)`.
+        webgl: Boolean to draw the dots with WebGL (scattergl).
+        stacked_highlight: Boolean to highlight the hovered bin with one stacked segment per layer
+            (python highlighting only).
 
     Explanation:
         - `use_selection_layer`: When set to True, the selection layer is used to handle interactions like clicks and hovers. This is useful for more complex interactions.
@@ -75,26 +93,44 @@ def TestViewer(gjapp,
     nbins = solara.use_reactive(nbins)
     bin_width = solara.use_reactive(bin_width)
     show_bins_with_data_only = solara.use_reactive(show_bins_with_data_only)
+    controller_ref = solara.use_ref(None)
 
     def _viewer_setup(data):
         print('Setting up viewer')
         if data is None:
             if len(gjapp.data_collection) == 0:
-                data = Data(label='Dotplot Data', x = list(np.random.normal(0,3, 200)))
+                data = Data(label='Dotplot Data', x = np.random.normal(0,3, 200))
                 gjapp.data_collection.append(data)
             else:
                 data = gjapp.data_collection[0]
         if data not in gjapp.data_collection:
             gjapp.data_collection.append(data)
         
-        viewer = gjapp.new_data_viewer(HubbleDotPlotView, data=data, show=True)
-        viewer.figure_widget.update_layout(height=None, width=None)
-        viewer.figure_widget.update_layout(autosize=True, height=300)
+        # a pre-built, pre-styled viewer from the pool of this application
+        pool = viewer_pool(gjapp)
+        viewer = pool.acquire(height=300)
+        viewer.add_data(data)
+        # undone in cleanup, since the (pooled) viewer outlives this effect
+        unsubscribers = []
+        
+        if webgl:
+            unsubscribers.append(WebGLDots(viewer).remove)
         
         vc = solara.get_widget(viewer_container)
 
-        viewer.state.hist_n_bin = nbins.value
-        nbins.subscribe(lambda x: setattr(viewer.state, 'hist_n_bin', x))
+        rule_edges = None
+        if bin_rule is None:
+            viewer.state.hist_n_bin = nbins.value
+        else:
+            rule_edges = BINNING_ENGINE.apply_to_viewer(viewer, bin_rule)
+            if rule_edges is not None and is_uniform(rule_edges):
+                rule_edges = None
+        
+        if recorder is not None:
+            recorder_source = recorder.register_viewer(viewer)
+            unsubscribers.append(lambda: recorder.unregister_viewer(viewer))
+            for name, reactive in (("nbins", nbins), ("bin_width", bin_width), ("highlight_bins", highlight_bins)):
+                unsubscribers.append(recorder.watch(recorder_source, name, reactive))
         
         def on_click(trace, points, state):
             if on_click_callback is not None:
@@ -102,93 +138,63 @@ def TestViewer(gjapp,
             if len(points.xs) == 0:
                 print('No points selected')
         
-        viewer.selection_layer.on_click(on_click)
+        # keyed, so a remount of the pooled viewer replaces the handler instead of adding another
+        dispatcher = selection_dispatcher(viewer)
+        dispatcher.register("click", on_click, key="test_viewer_click")
+        unsubscribers.append(lambda: dispatcher.unregister("click", "test_viewer_click"))
         
-        # Create BinHighlighter instance
-        if use_python_highlighing:
-            vc.children = (viewer.figure_widget,) # type: ignore
-            
-            def on_hover(trace, points, state):
-                if on_hover_callback is not None:
-                    on_hover_callback(points)
-            
-            bin_highlighter = BinHighlighter(viewer, 
-                                            line_color='rgba(255, 120, 255, 1)',
-                                            fill_color='rgba(0,0,0,.5)',
-                                            visible_bins=True,
-                                            show_bins_with_data_only=True,
-                                            on_hover_callback=on_hover,
-                                            on_click_callback=on_click,
-                                            use_selection_layer=use_selection_layer,
-                                            setup_selection_layer=True,
-                                            only_show=False,
-                                            )
-
-            if highlight_bins.value:
-                bin_highlighter.setup_bin_highlight()
-
-            def toggle_bin_highlight(turn_on: bool):
-                if bin_highlighter is None:
-                    return
-                if turn_on:
-                    bin_highlighter.turn_on_bin_highlight()
-                else:
-                    bin_highlighter.turn_off_bin_highlight()
-            
-            toggle_bin_highlight(highlight_bins.value)
-            highlight_bins.subscribe(toggle_bin_highlight)      
-            
-            def on_nbins_change(value):
-                if bin_highlighter is not None:
-                    bin_highlighter.redraw()
-            nbins.subscribe(on_nbins_change)
-            
-            def on_bin_width_change(value):
-                if bin_highlighter is not None:
-                    bin_highlighter.set_visible_bin_width(value)
-            bin_width.subscribe(on_bin_width_change)
-            
-        else:
-            bin_shower = BinManager(viewer,
-                                    bin_width=bin_width.value,
-                                    selection_bin_width=bin_width.value,
-                                    visible_bins=True,
-                                    show_bins_with_data_only=show_bins_with_data_only.value,
-                                    use_selection_layer=use_selection_layer,
-                                    on_click=on_click,
-            )
-            bin_shower.setup_bin_layer()
-            # bin_shower.add_callbacks_to_selection_layer()
-            def on_nbins_change(value):
-                if bin_shower is not None:
-                    bin_shower.redraw_bins()
-            nbins.subscribe(on_nbins_change)
-            
-            def on_bin_width_change(value):
-                if bin_shower is not None:
-                    bin_shower.set_visible_bin_width(value)
-            bin_width.subscribe(on_bin_width_change)
-            
-            # debug = True will show redo button if not bins are found
-            options = {
-                'fillColor': 'rgba(0, 0, 0)',
-                'fillOpacity': 0.5,
-                'strokeColor': 'rgba(255, 0, 255, 1)',
-                'strokeOpacity': 1,
-                'strokeWidth': 1,
-                'opacity': 1,
-                'debug': False,
-                'show': True
-            }
-            vc.children = (_PlotlyHighlighting(viewer_id=viewer._unique_class, **options), viewer.figure_widget,) # type: ignore
+        tracer = latency_tracer(viewer._unique_class) if trace_latency else None
+        if tracer is not None:
+            unsubscribers.append(lambda: remove_tracer(viewer._unique_class))
+        scheduler = update_scheduler(viewer)
+        
+        def on_hover(trace, points, state):
+            if on_hover_callback is not None:
+                on_hover_callback(points)
+        
+        # switches change the highlighting of this viewer in place, see highlight_modes.py
+        controller = HighlightModeController(viewer, vc,
+                                             mode="python" if use_python_highlighing else "js",
+                                             highlight=highlight_bins.value,
+                                             show_bins_with_data_only=show_bins_with_data_only.value,
+                                             use_selection_layer=use_selection_layer,
+                                             bin_width=bin_width.value,
+                                             edges=rule_edges,
+                                             on_hover=on_hover,
+                                             on_click=on_click,
+                                             recorder=recorder,
+                                             tracer=tracer,
+                                             scheduler=scheduler,
+                                             stacked=stacked_highlight,
+                                             )
+        controller_ref.current = controller
+        
+        unsubscribers.append(highlight_bins.subscribe(controller.set_highlight))
+        unsubscribers.append(show_bins_with_data_only.subscribe(controller.set_show_bins_with_data_only))
+        # sets hist_n_bin and redraws once
+        unsubscribers.append(nbins.subscribe(controller.set_nbins))
+        unsubscribers.append(bin_width.subscribe(controller.set_bin_width))
 
         def cleanup():
-                vc.children = () # type: ignore
-                viewer.figure_widget.close()
+                controller_ref.current = None
+                for unsubscribe in unsubscribers:
+                    unsubscribe()
+                controller.close()
+                # reset the viewer and keep it for the next mount instead of closing it
+                pool.release(viewer)
 
         return cleanup
 
-    solara.use_effect(lambda :_viewer_setup(data), dependencies=[show_bins_with_data_only.value, use_python_highlighing, use_selection_layer])
+    # the viewer is built once, the switches only change its highlighting
+    solara.use_effect(lambda :_viewer_setup(data), dependencies=[])
+    
+    def _update_modes():
+        controller = controller_ref.current
+        if controller is not None:
+            controller.set_mode("python" if use_python_highlighing else "js")
+            controller.set_use_selection_layer(use_selection_layer)
+    
+    solara.use_effect(_update_modes, dependencies=[use_python_highlighing, use_selection_layer])
     
     return viewer_container
 
@@ -0,0 +1,284 @@
+"""
+A per-viewer scheduler for the updates sent to a plotly figure.
+
+Hover highlights, bin redraws, marker moves, selection layer resets and layer
+visibility changes submit their updates here instead of writing to
+``viewer.figure`` directly. The scheduler
+
+- merges patches to the same property of the same trace (or shape, or layout):
+  only the last value is sent
+- flushes at most once per frame interval (default 1/60 s). The first update after
+  an idle interval is sent right away, later ones wait for the next frame
+- sends ``HIGH`` priority updates (hover feedback) first, then ``NORMAL`` and ``LOW``
+  (bulk redraws) while the frame budget lasts; what does not fit waits for the next frame
+- keeps queue depth and queue wait metrics per priority
+
+Deferred flushes run on an event loop, never on a thread of their own: the loop of
+the caller, or (when called from a thread without one) the loop the scheduler last
+saw, e.g. the kernel's. Without any loop the updates are sent right away.
+
+Example:
+    ```python
+    scheduler = update_scheduler(viewer)
+    scheduler.submit(highlight_trace, {"x": [2.5], "visible": True}, priority=HIGH)
+    scheduler.submit_call(bin_manager.redraw_bins, priority=LOW, key="redraw")
+    print(scheduler.report())
+    ```
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+HIGH = 0  # hover and highlight feedback
+NORMAL = 1  # markers, layer visibility
+LOW = 2  # bin redraws, selection layer resets
+PRIORITIES = (HIGH, NORMAL, LOW)
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+
+def _current_context():
+    """The solara kernel context of the caller, so a deferred flush sends to the right kernel"""
+    try:
+        from solara.server import kernel_context
+
+        return kernel_context.get_current_context()
+    except Exception:
+        return None
+
+
+class _Patch:
+    __slots__ = ("target", "values", "priority", "submitted")
+
+    def __init__(self, target, priority: int, submitted: float):
+        self.target = target
+        self.values: Dict[str, object] = {}
+        self.priority = priority
+        self.submitted = submitted
+
+
+class _Call:
+    __slots__ = ("function", "priority", "submitted")
+
+    def __init__(self, function: Callable, priority: int, submitted: float):
+        self.function = function
+        self.priority = priority
+        self.submitted = submitted
+
+
+class UpdateScheduler:
+    """Merges, prioritizes and rate limits the updates to one plotly figure"""
+
+    def __init__(self, figure, interval: float = 1 / 60, budget: Optional[float] = None, logger=None, max_samples: int = 5000):
+        self.figure = figure
+        self.interval = interval
+        # time per flush for NORMAL and LOW updates once the HIGH ones are sent
+        self.budget = interval if budget is None else budget
+        self.logger = logger
+        # id(target) -> patch. The patch keeps the target, so its id can not be reused
+        self._patches: Dict[int, _Patch] = {}
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.RLock()
+        self._last_flush = 0.0
+        # a TimerHandle or concurrent Future of the deferred flush
+        self._timer = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._context = None
+        self.stats = {"submitted": 0, "merged": 0, "sent": 0, "flushes": 0, "deferred": 0, "max_depth": 0}
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=max_samples) for p in PRIORITIES}
+
+    # ---- submitting ----
+
+    def submit(self, target, patch: Dict[str, object], priority: int = NORMAL):
+        """
+        Queue property updates for `target` (a trace, a layout shape, or the layout).
+        Keys are property names or paths ("marker.color"). A later value for the same
+        property replaces the queued one.
+        """
+        with self._lock:
+            now = time.perf_counter()
+            entry = self._patches.get(id(target))
+            if entry is None or entry.target is not target:
+                entry = self._patches[id(target)] = _Patch(target, priority, now)
+            else:
+                entry.priority = min(entry.priority, priority)
+            for name, value in patch.items():
+                if name in entry.values:
+                    self.stats["merged"] += 1
+                entry.values[name] = value
+            self.stats["submitted"] += 1
+            self._submitted()
+
+    def submit_call(self, function: Callable, priority: int = LOW, key: Optional[Hashable] = None):
+        """
+        Queue a function that updates the figure itself (e.g. rebuilds the bin layer).
+        A queued call with the same `key` is replaced.
+        """
+        with self._lock:
+            key = function if key is None else key
+            if key in self._calls:
+                self.stats["merged"] += 1
+                priority = min(priority, self._calls[key].priority)
+                # keep the place in the queue of the replaced call
+                self._calls[key] = _Call(function, priority, self._calls[key].submitted)
+            else:
+                self._calls[key] = _Call(function, priority, time.perf_counter())
+            self.stats["submitted"] += 1
+            self._submitted()
+
+    def _submitted(self):
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth())
+        self._context = _current_context() or self._context
+        wait = self._last_flush + self.interval - time.perf_counter()
+        if (wait <= 0 and self._timer is None) or self._event_loop() is None:
+            self.flush()
+        else:
+            self._schedule(max(wait, 0))
+
+    def _event_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        """The loop deferred flushes run on: the caller's, else the last one seen. None if there is none"""
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is not None and not self._loop.is_running():
+                self._loop = None
+        return self._loop
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            return
+        loop = self._event_loop()
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._timer = loop.call_later(delay, self._deferred_flush)
+        else:
+            # a thread without a loop: the flush runs on the loop's thread, so the figure
+            # is not written from a thread of its own while the kernel writes to it
+            self._timer = asyncio.run_coroutine_threadsafe(self._flush_later(delay), loop)
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._deferred_flush()
+
+    def _deferred_flush(self):
+        with self._lock:
+            self._timer = None
+        context = self._context if self._context is not None else nullcontext()
+        with context:
+            self.flush()
+
+    # ---- flushing ----
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        """Number of queued patches and calls (of one priority)"""
+        items = list(self._patches.values()) + list(self._calls.values())
+        return sum(1 for item in items if priority is None or item.priority == priority)
+
+    def _take(self, priority: int) -> Tuple[List[_Patch], List[_Call]]:
+        patches = [p for p in self._patches.values() if p.priority == priority]
+        calls = sorted((c for c in self._calls.values() if c.priority == priority), key=lambda c: c.submitted)
+        self._patches = {k: p for k, p in self._patches.items() if p.priority != priority}
+        self._calls = {k: c for k, c in self._calls.items() if c.priority != priority}
+        return patches, calls
+
+    def _send(self, patches: List[_Patch], calls: List[_Call], now: float):
+        if len(patches) > 0:
+            with self.figure.batch_update():
+                for patch in patches:
+                    for name, value in patch.values.items():
+                        patch.target[name] = value
+        # calls may add or replace traces, which does not mix with batch_update
+        for call in calls:
+            try:
+                call.function()
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error(f"Scheduled figure update failed: {e}")
+                else:
+                    raise
+        for item in (*patches, *calls):
+            self._waits[item.priority].append(now - item.submitted)
+        self.stats["sent"] += len(patches) + len(calls)
+
+    def flush(self, force: bool = False):
+        """Send the queued updates, high priority first. With `force` ignore the frame budget"""
+        with self._lock:
+            # with no loop to defer to, what does not fit the budget is sent now
+            force = force or self._event_loop() is None
+            if self._timer is not None and force:
+                self._cancel_timer()
+            start = time.perf_counter()
+            self._last_flush = start
+            self.stats["flushes"] += 1
+            for priority in PRIORITIES:
+                if priority != HIGH and not force and time.perf_counter() - start > self.budget:
+                    break
+                patches, calls = self._take(priority)
+                self._send(patches, calls, start)
+            remaining = self.depth()
+            if remaining > 0:
+                self.stats["deferred"] += remaining
+                self._schedule(self.interval)
+
+    def _cancel_timer(self):
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def clear(self):
+        """Drop everything queued"""
+        with self._lock:
+            self._cancel_timer()
+            self._patches.clear()
+            self._calls.clear()
+
+    # ---- metrics ----
+
+    def metrics(self) -> Dict[str, dict]:
+        """Per priority: current queue depth and p50/p99/max queue wait in ms"""
+        result = {}
+        for priority in PRIORITIES:
+            waits = np.asarray(self._waits[priority]) * 1000
+            result[PRIORITY_NAMES[priority]] = {
+                "depth": self.depth(priority),
+                "count": len(waits),
+                "p50": float(np.percentile(waits, 50)) if len(waits) > 0 else None,
+                "p99": float(np.percentile(waits, 99)) if len(waits) > 0 else None,
+                "max": float(waits.max()) if len(waits) > 0 else None,
+            }
+        return result
+
+    def report(self) -> str:
+        lines = [" ".join(f"{k}={v}" for k, v in self.stats.items())]
+        lines.append(f"{'priority':>9} {'depth':>6} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, row in self.metrics().items():
+            if row["count"] == 0:
+                lines.append(f"{name:>9} {row['depth']:>6} {0:>7}")
+            else:
+                lines.append(f"{name:>9} {row['depth']:>6} {row['count']:>7} {row['p50']:8.2f} {row['p99']:8.2f} {row['max']:8.2f}")
+        return "\n".join(lines)
+
+
+_SCHEDULERS: "WeakKeyDictionary[object, UpdateScheduler]" = WeakKeyDictionary()
+
+
+def update_scheduler(viewer, **kwargs) -> UpdateScheduler:
+    """The update scheduler of a viewer's figure (created on first use)"""
+    scheduler = _SCHEDULERS.get(viewer)
+    if scheduler is None:
+        scheduler = _SCHEDULERS[viewer] = UpdateScheduler(viewer.figure, **kwargs)
+    return scheduler
+
+
+def existing_scheduler(viewer) -> Optional[UpdateScheduler]:
+    return _SCHEDULERS.get(viewer)
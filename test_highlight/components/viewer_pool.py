@@ -0,0 +1,271 @@
+"""
+A pool of pre-built, pre-styled dotplot viewers per glue application.
+
+Creating a `HubbleDotPlotView` and styling its figure is a large part of the time
+to interactive of a page. The pool builds viewers ahead of time (`prewarm`), hands
+them out on mount (`acquire`) and takes them back on cleanup (`release`), where the
+viewer is reset to its pre-built state instead of being closed.
+
+Example:
+    ```python
+    pool = viewer_pool(gjapp)
+    pool.prewarm(2)
+
+    viewer = pool.acquire(height=300)
+    viewer.add_data(data)
+    ...
+    pool.release(viewer)
+    ```
+"""
+from functools import partial
+from types import MethodType
+from typing import Dict, List, Optional
+from weakref import WeakKeyDictionary
+
+import plotly.graph_objects as go
+from hubbleds.utils import PLOTLY_MARGINS
+
+from cosmicds.logger import setup_logger
+
+from .update_scheduler import existing_scheduler
+from .callback_dispatcher import existing_dispatcher
+
+logger = setup_logger("VIEWERPOOL")
+
+# The layout every dotplot viewer gets, validated once. It merges the separate
+# update_layout calls the viewers used to make on every mount.
+DOTPLOT_LAYOUT_TEMPLATE = go.Layout(
+    autosize=True,
+    margin=PLOTLY_MARGINS,
+    showlegend=False,
+    clickmode="event",
+    hovermode="closest",
+    spikedistance=-1,
+    xaxis=dict(
+        spikecolor="black",
+        spikethickness=1,
+        spikedash="solid",
+        spikemode="across",
+        spikesnap="cursor",
+        showspikes=True,
+        tickformat=",.0f",
+        title_font_size=16,
+    ),
+    yaxis=dict(
+        tickmode="auto",
+        title_font_size=16,
+    ),
+)
+
+SELECTION_LAYER_RESOLUTION = 200
+
+
+def apply_layout_template(viewer, height: Optional[int] = None, layout: go.Layout = DOTPLOT_LAYOUT_TEMPLATE):
+    """Apply the precompiled layout (and height) to a viewer's figure as one update"""
+    figure = viewer.figure_widget
+    with figure.batch_update():
+        # The auto sizing in the plotly widget only works if the height
+        #  and width are undefined. First, unset the height and width,
+        #  then enable auto sizing.
+        figure.layout.width = None
+        figure.layout.height = None
+        figure.layout.update(layout)
+        if height is not None:
+            figure.layout.height = height
+
+
+def reset_selection_layer(viewer, resolution: int = SELECTION_LAYER_RESOLUTION):
+    viewer.set_selection_active(True)
+    with viewer.figure.batch_update():
+        # special treatment for go.Heatmap from https://stackoverflow.com/questions/58630928/how-to-hide-the-colorbar-and-legend-in-plotly-express-bar-graph#comment131880779_68555667
+        viewer.selection_layer.update(visible=True, z=[list(range(resolution + 1))], opacity=0, coloraxis="coloraxis")
+        viewer.figure.update_coloraxes(showscale=False)
+
+
+def _as_callback(callback):
+    """echo yields bound methods as `partial(func, instance)`, turn them back into the method `remove_callback` takes"""
+    if isinstance(callback, partial) and len(callback.args) == 1 and not callback.keywords:
+        return MethodType(callback.func, callback.args[0])
+    return callback
+
+
+def _state_callbacks(state) -> Dict[str, list]:
+    """The callbacks on each property of a glue state (echo keeps them per instance on the property)"""
+    callbacks = {}
+    for name, prop in state.iter_callback_properties():
+        callbacks[name] = [_as_callback(callback)
+                           for attribute in ("_callbacks", "_2arg_callbacks")
+                           for callback in getattr(prop, attribute, {}).get(state, ())]
+    return callbacks
+
+
+_CALLBACK_LISTS = ("_click_callbacks", "_hover_callbacks", "_unhover_callbacks", "_select_callbacks", "_deselect_callbacks")
+_SIMPLE_TYPES = (int, float, str, bool, type(None))
+
+
+class _PristineState:
+    """What a viewer looked like right after it was built, so it can be reset to it"""
+
+    def __init__(self, viewer):
+        # the traces are kept so their ids can not be reused
+        self.traces = tuple(viewer.figure.data)
+        self.trace_ids = {id(trace) for trace in self.traces}
+        self.shapes = tuple(viewer.figure.layout.shapes)
+        self.viewer_attributes = set(vars(viewer))
+        self.tool_attributes = {tool_id: dict(vars(tool)) for tool_id, tool in viewer.toolbar.tools.items()}
+        self.state = {k: v for k, v in viewer.state.as_dict().items() if isinstance(v, _SIMPLE_TYPES)}
+        self.callbacks = {name: list(getattr(viewer.selection_layer, name, [])) for name in _CALLBACK_LISTS}
+        self.state_callbacks = _state_callbacks(viewer.state)
+
+
+class ViewerPool:
+    """Keeps up to `size` idle, pre-built viewers of `viewer_class` for one JupyterApplication"""
+
+    def __init__(self, gjapp, viewer_class=None, size: int = 2, height: Optional[int] = 300):
+        if viewer_class is None:
+            from hubbleds.viewers.hubble_dotplot import HubbleDotPlotView
+
+            viewer_class = HubbleDotPlotView
+        self.gjapp = gjapp
+        self.viewer_class = viewer_class
+        self.size = size
+        self.height = height
+        self._idle: List = []
+        self._pristine: Dict[int, _PristineState] = {}
+        self._in_use: Dict[int, object] = {}
+        self.stats = {"built": 0, "reused": 0, "released": 0, "closed": 0}
+
+    def __len__(self):
+        return len(self._idle)
+
+    @property
+    def viewers_in_use(self) -> List:
+        return list(self._in_use.values())
+
+    def _build(self):
+        viewer = self.gjapp.new_data_viewer(self.viewer_class, show=False)
+        apply_layout_template(viewer, self.height)
+        reset_selection_layer(viewer)
+        self._pristine[id(viewer)] = _PristineState(viewer)
+        self.stats["built"] += 1
+        return viewer
+
+    def prewarm(self, n: Optional[int] = None):
+        """Build viewers until `n` (default: the pool size) are idle"""
+        n = self.size if n is None else n
+        while len(self._idle) < n:
+            self._idle.append(self._build())
+
+    def acquire(self, height: Optional[int] = None):
+        """An idle viewer (or a newly built one), styled and without data"""
+        if len(self._idle) > 0:
+            viewer = self._idle.pop()
+            self.stats["reused"] += 1
+            if height is not None and height != self.height:
+                viewer.figure_widget.layout.height = height
+        else:
+            viewer = self._build()
+            if height is not None and height != self.height:
+                viewer.figure_widget.layout.height = height
+        self._in_use[id(viewer)] = viewer
+        return viewer
+
+    def reset(self, viewer):
+        """Return a viewer to the state it was built in"""
+        pristine = self._pristine[id(viewer)]
+        scheduler = existing_scheduler(viewer)
+        if scheduler is not None:
+            # updates queued by the previous mount
+            scheduler.clear()
+        toolbar = viewer.toolbar
+        if toolbar.active_tool is not None:
+            toolbar.active_tool = None
+
+        # tools extended with extend_tool and other per-mount overrides are instance attributes
+        for tool_id, tool in toolbar.tools.items():
+            attributes = pristine.tool_attributes.get(tool_id, {})
+            for name in set(vars(tool)) - set(attributes):
+                delattr(tool, name)
+            for name, value in attributes.items():
+                if vars(tool).get(name) is not value:
+                    setattr(tool, name, value)
+        for name in set(vars(viewer)) - pristine.viewer_attributes:
+            if hasattr(type(viewer), name):
+                # instance overrides of methods, e.g. _update_selection_layer_bounds
+                delattr(viewer, name)
+
+        # subsets go with their data
+        for data in {getattr(layer.layer, "data", layer.layer) for layer in viewer.layers}:
+            viewer.remove_data(data)
+
+        for name, callbacks in pristine.callbacks.items():
+            if hasattr(viewer.selection_layer, name):
+                setattr(viewer.selection_layer, name, list(callbacks))
+        dispatcher = existing_dispatcher(viewer.selection_layer)
+        if dispatcher is not None:
+            # handlers of the previous mount. The dispatch functions were removed with the lists above
+            dispatcher.clear()
+
+        state = viewer.state
+        # components remove their own state callbacks (MarkerManager.close, WebGLDots.remove,
+        # DensityOverlay.remove). Any left over would act on the next mount, so remove them
+        # before the state is reset, and name them so the leak can be fixed
+        for name, callbacks in _state_callbacks(state).items():
+            leaked = [callback for callback in callbacks if callback not in pristine.state_callbacks.get(name, [])]
+            for callback in leaked:
+                logger.warning(f"Removing a state callback left on the viewer: {name} -> {getattr(callback, '__qualname__', callback)}")
+                state.remove_callback(name, callback)
+
+        with state.delay_callback(*pristine.state.keys()):
+            for name, value in pristine.state.items():
+                if getattr(state, name) != value:
+                    setattr(state, name, value)
+
+        figure = viewer.figure
+        if any(id(trace) not in pristine.trace_ids for trace in figure.data):
+            figure.data = tuple(trace for trace in figure.data if id(trace) in pristine.trace_ids)
+        if tuple(figure.layout.shapes) != pristine.shapes:
+            figure.layout.shapes = pristine.shapes
+        apply_layout_template(viewer, self.height)
+        reset_selection_layer(viewer)
+
+    def release(self, viewer):
+        """Reset a viewer and keep it for the next mount, or close it if the pool is full"""
+        self._in_use.pop(id(viewer), None)
+        self.stats["released"] += 1
+        try:
+            self.reset(viewer)
+        except Exception as e:
+            logger.warning(f"Could not reset viewer, closing it: {e}")
+            self.close(viewer)
+            return
+        if len(self._idle) < self.size:
+            self._idle.append(viewer)
+        else:
+            self.close(viewer)
+
+    def close(self, viewer):
+        self._pristine.pop(id(viewer), None)
+        self._in_use.pop(id(viewer), None)
+        for widget in (viewer.toolbar, viewer.figure_widget):
+            widget.close()
+        self.stats["closed"] += 1
+
+    def clear(self):
+        while len(self._idle) > 0:
+            self.close(self._idle.pop())
+
+
+_POOLS: "WeakKeyDictionary[object, ViewerPool]" = WeakKeyDictionary()
+
+
+def viewer_pool(gjapp, **kwargs) -> ViewerPool:
+    """The viewer pool of a JupyterApplication (created on first use)"""
+    pool = _POOLS.get(gjapp)
+    if pool is None:
+        pool = _POOLS[gjapp] = ViewerPool(gjapp, **kwargs)
+    return pool
+
+
+def pools() -> List[ViewerPool]:
+    return list(_POOLS.values())
@@ -0,0 +1,169 @@
+"""
+Snapshots of viewer state, to restore a viewer quickly when a session reconnects.
+
+When a student's websocket drops and reconnects, solara renders the page again and
+every viewer is set up from scratch. `DotplotViewer` saves a `ViewerSnapshot` of its
+viewer when it unmounts (bounds, number of bins, bin width, highlight mode, marker
+positions, hidden layers and the computed bin arrays of its `BinManager`). The
+snapshot is kept per session for a grace period (``TEST_HIGHLIGHT_SNAPSHOT_TTL``
+seconds, default 300) and used on the next mount in the same session, so the bin
+layer is rebuilt from the stored arrays instead of histogramming the data again.
+A snapshot also stores its `viewer_source`: the content hashes of the datasets and
+the bin settings. It is dropped, not restored, if the viewer is mounted again with
+other data or bins.
+
+Snapshots are plain data (`to_dict` gives json serializable values), so they can be
+moved to another store if sessions are not sticky to a worker.
+"""
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..columnar import full_values
+from .binning import data_version
+
+SNAPSHOT_TTL = float(os.environ.get("TEST_HIGHLIGHT_SNAPSHOT_TTL", 300))
+
+# viewer state attributes stored in a snapshot
+_STATE_ATTRIBUTES = ("x_min", "x_max", "hist_n_bin", "hist_x_min", "hist_x_max")
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+@dataclass
+class ViewerSnapshot:
+    key: str
+    state: Dict[str, float] = field(default_factory=dict)
+    bin_width: Optional[float] = None
+    highlight: Optional[str] = None  # 'python', 'js' or None
+    line_marker_at: Optional[float] = None
+    vertical_line_visible: Optional[bool] = None
+    markers: Dict[str, float] = field(default_factory=dict)
+    hidden_layers: List[str] = field(default_factory=list)
+    bins: Optional[dict] = None  # BinManager.snapshot_state()
+    source: Dict[str, object] = field(default_factory=dict)  # viewer_source()
+    created: float = field(default_factory=time.time)
+
+    @classmethod
+    def capture(cls, key: str, viewer, bin_manager=None, hidden_layers=(), **values) -> "ViewerSnapshot":
+        """Snapshot `viewer` (and the bins of `bin_manager`). `values` are the other fields"""
+        state = {}
+        for name in _STATE_ATTRIBUTES:
+            value = getattr(viewer.state, name, None)
+            if value is not None:
+                state[name] = value
+        bins = bin_manager.snapshot_state() if bin_manager is not None else None
+        if bin_manager is not None:
+            values.setdefault("bin_width", bin_manager.selection_bin_width)
+        return cls(
+            key=key,
+            state=state,
+            hidden_layers=[layer.label for layer in hidden_layers],
+            bins=bins,
+            **values,
+        )
+
+    def matches(self, source: Dict[str, object]) -> bool:
+        """Whether the snapshot was taken of a viewer with the same data and bin settings (a `viewer_source`)"""
+        return len(self.source) > 0 and _jsonable(self.source) == _jsonable(source)
+
+    def apply_to_viewer(self, viewer):
+        """Set the stored bounds and binning on the viewer state, in one update"""
+        state = viewer.state
+        names = [name for name in self.state if hasattr(state, name)]
+        with state.delay_callback(*names):
+            for name in names:
+                setattr(state, name, self.state[name])
+
+    def hidden_layers_in(self, gjapp) -> list:
+        """The data and subsets of `gjapp` that were hidden, found by label"""
+        labels = set(self.hidden_layers)
+        layers = []
+        for data in gjapp.data_collection:
+            if data.label in labels:
+                layers.append(data)
+            layers.extend(subset for subset in data.subsets if subset.label in labels)
+        return layers
+
+    def to_dict(self) -> dict:
+        return _jsonable(asdict(self))
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "ViewerSnapshot":
+        return cls(**values)
+
+
+class SnapshotStore:
+    """Snapshots by (session id, viewer key), each kept for `ttl` seconds"""
+
+    def __init__(self, ttl: float = SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshots: Dict[Tuple[str, str], ViewerSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for k in [k for k, snapshot in self._snapshots.items() if snapshot.created < cutoff]:
+            del self._snapshots[k]
+
+    def put(self, session_id: str, snapshot: ViewerSnapshot):
+        with self._lock:
+            self._expire()
+            self._snapshots[(session_id, snapshot.key)] = snapshot
+
+    def take(self, session_id: str, key: str) -> Optional[ViewerSnapshot]:
+        """Remove and return the snapshot of a viewer, if there is one that has not expired"""
+        with self._lock:
+            self._expire()
+            return self._snapshots.pop((session_id, key), None)
+
+    def discard_session(self, session_id: str):
+        with self._lock:
+            for k in [k for k in self._snapshots if k[0] == session_id]:
+                del self._snapshots[k]
+
+
+SNAPSHOTS = SnapshotStore()
+
+
+def viewer_source(viewer, **settings) -> Dict[str, object]:
+    """The x attribute, content hashes of the x values of the datasets in `viewer` by label, and the bin `settings`"""
+    state = viewer.state
+    versions = {}
+    for layer in state.layers:
+        data = getattr(layer, "layer", None)
+        if data is None or getattr(data, "data", data) is not data:
+            continue
+        try:
+            # the same values (and so hashes) as BinManager's bin tables
+            versions[data.label] = data_version(np.asarray(full_values(data, state.x_att), dtype=float).ravel())
+        except Exception:
+            continue
+    return {"x_att": str(state.x_att), "data": versions, **settings}
+
+
+def current_session_id() -> Optional[str]:
+    """The solara session of the caller (stays the same when the websocket reconnects)"""
+    try:
+        from solara.server import kernel_context
+
+        return kernel_context.get_current_context().session_id
+    except Exception:
+        return None
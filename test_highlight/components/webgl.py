@@ -0,0 +1,81 @@
+"""
+WebGL (``scattergl``) rendering for the dots of a viewer.
+
+The glue layer artists draw their dots as SVG ``scatter`` traces, which gets slow
+with hundreds of thousands of points. `WebGLDots` swaps each layer's scatter
+trace for an equivalent ``scattergl`` trace. The new trace keeps the ``meta`` and
+``uid`` of the old one, so the artists find it and keep updating it.
+
+Bin highlighting does not depend on the dots: `BinHighlighter` moves its own bar
+trace, and `_PlotlyHighlighting` (``hit_test='geometry'``, the default) finds the bin
+from the bin edges and the axis transforms instead of querying SVG paths.
+
+Example:
+    ```python
+    webgl = WebGLDots(viewer)  # converts now and whenever data or subsets are added
+    ...
+    webgl.remove()
+    ```
+"""
+from typing import List
+
+import plotly.graph_objects as go
+
+
+def to_scattergl(trace: go.Scatter) -> go.Scattergl:
+    """A scattergl trace with the properties of `trace` that scattergl supports"""
+    values = trace.to_plotly_json()
+    values.pop("type", None)
+    # e.g. cliponaxis and some marker options only exist for svg scatter
+    return go.Scattergl(values, skip_invalid=True)
+
+
+class WebGLDots:
+    """Keeps the scatter traces of a viewer's layers rendered with WebGL"""
+
+    def __init__(self, viewer, logger=None):
+        self.viewer = viewer
+        self.logger = logger
+        self.converted = 0
+        # the layers callback can run before a new artist has made its traces, so
+        # convert after add_data too
+        self._add_data = viewer.add_data
+
+        def add_data(*args, **kwargs):
+            result = self._add_data(*args, **kwargs)
+            self.convert()
+            return result
+
+        viewer.add_data = add_data
+        viewer.state.add_callback("layers", self.convert)
+        self.convert()
+
+    def _layer_scatter_traces(self) -> List[go.Scatter]:
+        traces = []
+        for artist in self.viewer.layers:
+            if not hasattr(artist, "traces"):
+                continue
+            traces.extend(trace for trace in artist.traces() if trace.type == "scatter")
+        return traces
+
+    def convert(self, *args) -> int:
+        """Replace the layers' svg scatter traces with scattergl. Returns the number converted"""
+        scatter = self._layer_scatter_traces()
+        if len(scatter) == 0:
+            return 0
+        figure = self.viewer.figure
+        ids = {id(trace) for trace in scatter}
+        # figure.data can only drop traces, so remove the svg traces and add the gl ones
+        gl_traces = [to_scattergl(trace) for trace in scatter]
+        figure.data = tuple(trace for trace in figure.data if id(trace) not in ids)
+        figure.add_traces(gl_traces)
+        self.converted += len(gl_traces)
+        if self.logger is not None:
+            self.logger.info(f"WebGL: converted {len(gl_traces)} scatter traces")
+        return len(gl_traces)
+
+    def remove(self):
+        """Stop converting new layers (converted traces stay)"""
+        self.viewer.state.remove_callback("layers", self.convert)
+        if "add_data" in vars(self.viewer):
+            del self.viewer.add_data
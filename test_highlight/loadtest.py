@@ -0,0 +1,244 @@
+"""
+Headless multi-session load test for ``test_highlight.pages.Page``.
+
+Starts N solara sessions in this process (each in its own virtual kernel
+context, no browser), then sends synthetic hover, click, slider (``nbins``,
+``bin_width``) and switch events at fixed rates through the viewers' selection
+layer callbacks and the Page's widgets. Events are scheduled on the wall clock,
+so when the server falls behind, the queueing delay shows up in the latency.
+
+Reports per event type: p50/p99 latency, comm messages and bytes sent per
+event, and the resident memory (RSS) added by each session.
+
+Usage:
+    python -m test_highlight.loadtest --sessions 10 --duration 30
+    python -m test_highlight.loadtest --sessions 5 --hover-rate 30 --slider-rate 0.5
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EVENT_TYPES = ("hover", "click", "slider", "switch")
+
+SLIDERS = {"Number of Bins": (1, 100, int), "Bin Width": (0.1, 1.0, float)}
+SWITCHES = ("Vertical Line Visible", "Highlight Bins", "Show Bins with Data Only", "Use Selection Layer", "Use Plotly Highlighter")
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # peak, not current, but the best we have without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class CommCounter:
+    """Counts the messages and bytes a kernel sends to the (absent) browser"""
+
+    def __init__(self, session):
+        self.messages = 0
+        self.bytes = 0
+        self._send = session.send
+        self._signature = inspect.signature(self._send)
+        session.send = self._counting_send
+
+    def _counting_send(self, *args, **kwargs):
+        bound = self._signature.bind_partial(*args, **kwargs).arguments
+        content = bound.get("content")
+        msg = bound.get("msg_or_type")
+        if content is None and isinstance(msg, dict):
+            content = msg.get("content")
+        self.messages += 1
+        self.bytes += len(json.dumps(content, default=str))
+        for buffer in bound.get("buffers") or []:
+            self.bytes += memoryview(buffer).nbytes
+        return self._send(*args, **kwargs)
+
+    def snapshot(self):
+        return self.messages, self.bytes
+
+
+class Session:
+    """One headless solara session rendering the Page"""
+
+    def __init__(self, index: int):
+        import ipyvuetify as v
+        import solara
+        from solara.server import kernel, kernel_context
+
+        from .components.viewer_pool import pools
+        from .pages import Page
+
+        self.index = index
+        self.v = v
+        session_id = f"loadtest-{index}"
+        self.context = kernel_context.VirtualKernelContext(id=session_id, kernel=kernel.Kernel(), session_id=session_id)
+        self.comm = CommCounter(self.context.kernel.session)
+
+        rss_before = rss_bytes()
+        existing = {id(pool) for pool in pools()}
+        with self.context:
+            self.box, self.rc = solara.render(Page(), handle_error=False)
+        self.pools = [pool for pool in pools() if id(pool) not in existing]
+        self.rss = rss_bytes() - rss_before
+
+    @property
+    def viewers(self) -> List:
+        return [viewer for pool in self.pools for viewer in pool.viewers_in_use]
+
+    def hover(self, rng: random.Random):
+        from plotly.callbacks import InputDeviceState, Points
+
+        viewer = rng.choice(self.viewers)
+        x = rng.uniform(viewer.state.x_min, viewer.state.x_max)
+        layer = viewer.selection_layer
+        points = Points(point_inds=[0], xs=[x], ys=[0], trace_name=layer.name, trace_index=0)
+        state = InputDeviceState(ctrl=False, alt=False, shift=False, meta=False, button=0, buttons=0)
+        layer._dispatch_on_hover(points, state)
+
+    def click(self, rng: random.Random):
+        from plotly.callbacks import InputDeviceState, Points
+
+        viewer = rng.choice(self.viewers)
+        x = rng.uniform(viewer.state.x_min, viewer.state.x_max)
+        layer = viewer.selection_layer
+        points = Points(point_inds=[0], xs=[x], ys=[0], trace_name=layer.name, trace_index=0)
+        state = InputDeviceState(ctrl=False, alt=False, shift=False, meta=False, button=0, buttons=1)
+        layer._dispatch_on_click(points, state)
+
+    def slider(self, rng: random.Random):
+        label = rng.choice(list(SLIDERS))
+        lo, hi, kind = SLIDERS[label]
+        value = rng.randint(lo, hi) if kind is int else round(rng.uniform(lo, hi), 2)
+        self.rc.find(self.v.Slider, label=label).widget.v_model = value
+
+    def switch(self, rng: random.Random):
+        widget = self.rc.find(self.v.Switch, label=rng.choice(SWITCHES)).widget
+        widget.v_model = not widget.v_model
+
+    def close(self):
+        with self.context:
+            self.rc.close()
+        self.context.close()
+
+
+class Stats:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.service: Dict[str, List[float]] = defaultdict(list)
+        self.messages: Dict[str, int] = defaultdict(int)
+        self.bytes: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def report(self, sessions: List[Session], duration: float) -> str:
+        lines = [
+            f"{len(sessions)} sessions, {duration:.0f} s",
+            f"{'event':>8} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'p50 svc ms':>11} {'msgs/ev':>8} {'bytes/ev':>9} {'errors':>7}",
+        ]
+        for kind in EVENT_TYPES:
+            n = len(self.latency[kind])
+            if n == 0 and self.errors[kind] == 0:
+                continue
+            latency = np.array(self.latency[kind]) * 1000
+            service = np.array(self.service[kind]) * 1000
+            lines.append(
+                f"{kind:>8} {n:>7} {np.percentile(latency, 50) if n else np.nan:8.1f} {np.percentile(latency, 99) if n else np.nan:8.1f} "
+                f"{np.percentile(service, 50) if n else np.nan:11.1f} {self.messages[kind] / max(n, 1):8.1f} "
+                f"{self.bytes[kind] / max(n, 1):9.0f} {self.errors[kind]:>7}"
+            )
+        rss = np.array([session.rss for session in sessions]) / 2**20
+        lines.append(f"rss per session: mean {rss.mean():.1f} MB, max {rss.max():.1f} MB, total {rss.sum():.1f} MB")
+        return "\n".join(lines)
+
+
+def schedule(n_sessions: int, duration: float, rates: Dict[str, float], rng: random.Random):
+    """(time, session index, event type) for every event, with Poisson arrivals per session and type"""
+    events = []
+    for index in range(n_sessions):
+        for kind, rate in rates.items():
+            if rate <= 0:
+                continue
+            t = rng.expovariate(rate)
+            while t < duration:
+                events.append((t, index, kind))
+                t += rng.expovariate(rate)
+    return sorted(events)
+
+
+async def run(n_sessions: int, duration: float, rates: Dict[str, float], seed: int = 0, verbose: bool = True) -> Stats:
+    import solara.server.patch
+
+    solara.server.patch.patch()
+    rng = random.Random(seed)
+
+    sessions = []
+    for index in range(n_sessions):
+        session = Session(index)
+        sessions.append(session)
+        if verbose:
+            print(f"session {index}: {session.rss / 2**20:.1f} MB, {len(session.viewers)} viewers")
+        # let effects and tasks scheduled by the render run
+        await asyncio.sleep(0)
+
+    stats = Stats()
+    start = time.perf_counter()
+    for t, index, kind in schedule(n_sessions, duration, rates, rng):
+        delay = start + t - time.perf_counter()
+        # yield to the loop either way, so debounced redraws and tasks get to run
+        await asyncio.sleep(max(delay, 0))
+        session = sessions[index]
+        messages, nbytes = session.comm.snapshot()
+        begin = time.perf_counter()
+        try:
+            with session.context:
+                getattr(session, kind)(rng)
+        except Exception as e:
+            stats.errors[kind] += 1
+            if verbose:
+                print(f"session {index} {kind} failed: {e!r}")
+            continue
+        end = time.perf_counter()
+        stats.latency[kind].append(end - (start + t))
+        stats.service[kind].append(end - begin)
+        messages_after, nbytes_after = session.comm.snapshot()
+        stats.messages[kind] += messages_after - messages
+        stats.bytes[kind] += nbytes_after - nbytes
+
+    if verbose:
+        print(stats.report(sessions, duration))
+    for session in sessions:
+        session.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--hover-rate", type=float, default=20, help="hover events per second per session")
+    parser.add_argument("--click-rate", type=float, default=0.5, help="click events per second per session")
+    parser.add_argument("--slider-rate", type=float, default=0.2, help="slider changes per second per session")
+    parser.add_argument("--switch-rate", type=float, default=0.05, help="switch toggles per second per session")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rates = {"hover": args.hover_rate, "click": args.click_rate, "slider": args.slider_rate, "switch": args.switch_rate}
+    asyncio.run(run(args.sessions, args.duration, rates, seed=args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,36 @@
 import solara
 from solara.alias import rv
 
-from ..components import DotplotViewer, TestViewer, PlotlyHighlighting
-
 from glue_jupyter import JupyterApplication
 from glue.core import Data
 import numpy as np
 import asyncio
 
 from cosmicds.utils import _debounce
+from cosmicds.logger import setup_logger
 
-from hubbleds.remote import LOCAL_API
 from hubbleds.data_management import EXAMPLE_GALAXY_SEED_DATA, DB_VELOCITY_FIELD
-from hubbleds.state import LOCAL_STATE
 from hubbleds.example_measurement_helpers import link_seed_data
 
+from ..components.binning import BINNING_ENGINE
+from ..precompute import PRECOMPUTED
+from ..seed_api import load_seed_datasets, seed_api
+from ..shared_data import SHARED_DATA
+from ..columnar import columnar_data, format_report, memory_report
+
+# rule edges and bin counts written by `python -m test_highlight.precompute --seed`
+# (the bin tables it writes are in SHARED_DATA)
+BINNING_ENGINE.precomputed = PRECOMPUTED
+PRECOMPUTED.preload()
+
+logger = setup_logger("PAGE")
+
 
 @solara.component
 def Page():
+    # imported on first render, so importing the page does not import the viewers (see components/__init__.py)
+    from ..components import DotplotViewer, TestViewer
+    from ..components.viewer_pool import viewer_pool
     
     solara.Title('Dotplot Testbed')
     
@@ -43,41 +56,43 @@ def Page():
     
     def _glue_setup():
         glue_app = JupyterApplication()
-        x = list(np.random.normal(0,3, 200)) + list(np.random.normal(20,1, 200))
+        x = np.concatenate([np.random.normal(0,3, 200), np.random.normal(20,1, 200)])
         data = Data(label='Dotplot Data', x = x)
         glue_app.data_collection.append(data)
-        
-        if EXAMPLE_GALAXY_SEED_DATA not in glue_app.data_collection:
-            example_seed_data = LOCAL_API.get_example_seed_measurement(LOCAL_STATE, which='both')
-            
-            data = Data(
-                label=EXAMPLE_GALAXY_SEED_DATA,
-                **{
-                    k: np.asarray([r[k] for r in example_seed_data])
-                    for k in example_seed_data[0].keys()
-                }
-            )
-            glue_app.data_collection.append(data)
-            # create 'first measurement' and 'second measurement' datasets
-            # create_measurement_subsets(gjapp, data)
-            first = Data(label = EXAMPLE_GALAXY_SEED_DATA + '_first', 
-                         **{k: np.asarray([r[k] for r in example_seed_data if r['measurement_number'] == 'first'])
-                            for k in example_seed_data[0].keys()}
-                            )
-            first.style.color = '#f6fd31'
-            glue_app.data_collection.append(first)
-            second = Data(label = EXAMPLE_GALAXY_SEED_DATA + '_second', 
-                         **{k: np.asarray([r[k] for r in example_seed_data if r['measurement_number'] == 'second'])
-                            for k in example_seed_data[0].keys()}
-                            )
-            second.style.color = '#d4a4dd'
-            glue_app.data_collection.append(second)
-            
-            link_seed_data(glue_app)
         return glue_app
     
     app = solara.use_memo(_glue_setup)  # type: ignore
     
+    # one pre-built viewer for each viewer on the page, built in a thread so the first
+    # render does not wait for it (a viewer mounted before it is done builds its own)
+    solara.use_thread(lambda: viewer_pool(app).prewarm(2), dependencies=[])
+    
+    # the seed data is fetched (or mapped from the shared store) in a thread, so the
+    # controls and the TestViewer on local data render without waiting for it
+    seed_loading = solara.use_thread(lambda: load_seed_datasets(seed_api()), dependencies=[])
+    seed_attached = solara.use_reactive(EXAMPLE_GALAXY_SEED_DATA in app.data_collection)
+    
+    def _attach_seed_data():
+        if seed_loading.state != solara.ResultState.FINISHED or seed_attached.value:
+            return
+        datasets = seed_loading.value
+        # the seed data is immutable, so it is fetched once and memory mapped by every worker.
+        # components are the mapped arrays (float32 plotting copies with TEST_HIGHLIGHT_DISPLAY_DTYPE=float32)
+        app.data_collection.append(columnar_data(EXAMPLE_GALAXY_SEED_DATA, datasets[EXAMPLE_GALAXY_SEED_DATA]))
+        # create 'first measurement' and 'second measurement' datasets
+        # create_measurement_subsets(gjapp, data)
+        for which, color in (('first', '#f6fd31'), ('second', '#d4a4dd')):
+            label = EXAMPLE_GALAXY_SEED_DATA + '_' + which
+            measurement = columnar_data(label, datasets[label])
+            measurement.style.color = color
+            app.data_collection.append(measurement)
+        logger.debug("seed data memory:\n" + format_report([memory_report(d) for d in app.data_collection if d.label.startswith(EXAMPLE_GALAXY_SEED_DATA)]))
+        
+        link_seed_data(app)
+        seed_attached.set(True)
+    
+    solara.use_effect(_attach_seed_data, dependencies=[seed_loading.state])
+    
     def click_callback(*args, **kwargs):
         print('clicked!')
         if len(args) == 3:
@@ -167,21 +182,31 @@ def Page():
                 )
         
         with solara.Row():
-            DotplotViewer(
-                app, 
-                data=app.data_collection[EXAMPLE_GALAXY_SEED_DATA], 
-                component_id=DB_VELOCITY_FIELD,
-                # data = app.data_collection[0],
-                # component_id='x',
-                title = 'Dotplot Viewer',
-                on_click_callback = click_callback,
-                vertical_line_visible=vertical_line_visible.value,
-                unit = '#',
-                x_label = 'Value',
-                y_label = 'Count',
-                highlight_bins=highlight_bins.value,
-                nbin=nbins.value,
-                )
+            if seed_loading.state == solara.ResultState.ERROR:
+                solara.Error(f"Could not load the seed data: {seed_loading.error}")
+            elif not seed_attached.value:
+                with solara.Card(style='width: 100%'):
+                    solara.Text('Loading seed data...')
+                    solara.ProgressLinear(True)
+            else:
+                DotplotViewer(
+                    app, 
+                    data=app.data_collection[EXAMPLE_GALAXY_SEED_DATA], 
+                    component_id=DB_VELOCITY_FIELD,
+                    # data = app.data_collection[0],
+                    # component_id='x',
+                    title = 'Dotplot Viewer',
+                    on_click_callback = click_callback,
+                    vertical_line_visible=vertical_line_visible.value,
+                    unit = '#',
+                    x_label = 'Value',
+                    y_label = 'Count',
+                    highlight_bins=highlight_bins.value,
+                    nbin=nbins.value,
+                    svg_preview=True,
+                    # bin tables of the (shared, static) seed data are shared between the workers too
+                    shared_store=SHARED_DATA,
+                    )
 
 
 
@@ -0,0 +1,260 @@
+"""
+Offline precomputation of the bins and bin counts of static datasets.
+
+The example seed data is the same on every server start, yet every session
+histograms it again. This module writes, per (dataset, attribute, bins), the bin
+``edges`` and ``counts``, and per (dataset, attribute, rule) the rule based edges.
+Every entry is a directory of memory-mappable ``.npy`` files (see
+`shared_data.SharedArrayStore`) with json metadata: the format version, the dataset
+label and attribute, summary statistics and the content hashes (`binning.data_version`)
+of the values and the edges. Entries are named by those hashes, so a lookup only hits
+when the data and the bins are exactly the same, and a changed dataset simply misses.
+
+`BinningEngine.precomputed` (set by the pages) looks the rule edges up here, and the
+SVG preview the counts. The bin tables of `BinManager` (its customdata, with the
+per-bin mean, min and max) are written
+to the shared store (`--shared-dir`, default `shared_data.SHARED_DATA`) as the
+``bin_tables/<hash>`` entries the seed data viewer maps, for a viewer that shows
+only the dataset.
+
+Usage:
+
+    python -m test_highlight.precompute --seed --bins 25 75 --rule fd
+    python -m test_highlight.precompute --file mydata=data.npz --attribute x --bins 30
+    python -m test_highlight.precompute --list
+"""
+import argparse
+import os
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .components.binning import BINNING_ENGINE, bin_statistics, bin_table, bin_table_key, bin_table_name, data_version
+from .seed_api import seed_datasets
+from .shared_data import SHARED_DATA_DIR, SharedArrayStore
+
+# 2: counts entries (no per-bin sums, mins, maxs or rows)
+FORMAT_VERSION = 2
+
+PRECOMPUTE_DIR = os.environ.get("TEST_HIGHLIGHT_PRECOMPUTE_DIR", os.path.join(os.path.dirname(__file__), "assets", "precomputed"))
+
+# hash characters used in entry names
+_NAME_HASH = 20
+
+
+def summary(values) -> Dict[str, float]:
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(values.size),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "median": float(np.median(values)),
+        "max": float(values.max()),
+    }
+
+
+class PrecomputedStore:
+    """
+    Precomputed bin counts and rule edges, found by the content hash of the values.
+
+    Example:
+        ```python
+        PRECOMPUTED.write_counts('seed', 'velocity_value', values, edges)
+        counts = PRECOMPUTED.counts(values, edges)  # None if not precomputed
+        ```
+    """
+
+    def __init__(self, root: str = PRECOMPUTE_DIR):
+        self.store = SharedArrayStore(root)
+        self._entries: Dict[str, Dict[str, np.ndarray]] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    @property
+    def root(self) -> str:
+        return self.store.root
+
+    @staticmethod
+    def counts_name(values_version: str, edges_version: str) -> str:
+        return f"counts-{values_version[:_NAME_HASH]}-{edges_version[:_NAME_HASH]}"
+
+    @staticmethod
+    def edges_name(values_version: str, rule: str, max_bins: int) -> str:
+        return f"edges-{values_version[:_NAME_HASH]}-{rule}-{max_bins}"
+
+    def names(self) -> List[str]:
+        if not os.path.exists(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if self.store.exists(name))
+
+    def _load(self, name: str) -> Optional[Dict[str, np.ndarray]]:
+        """The mapped arrays of an entry, None if missing or written by another format version"""
+        if name not in self._entries:
+            if not (self.store.exists(name) and self.store.meta(name).get("version") == FORMAT_VERSION):
+                # misses are not kept: every new subset or bin setting would add one
+                return None
+            self._entries[name] = self.store.load(name)
+        return self._entries[name]
+
+    def _entry(self, name: str) -> Optional[Dict[str, np.ndarray]]:
+        entry = self._load(name)
+        self.stats["hits" if entry is not None else "misses"] += 1
+        return entry
+
+    def preload(self) -> int:
+        """Map every entry (at startup), so lookups do not touch the disk. Returns the number of entries"""
+        for name in self.names():
+            self._load(name)
+        return len(self._entries)
+
+    def counts(self, values, edges, values_version: Optional[str] = None, edges_version: Optional[str] = None) -> Optional[np.ndarray]:
+        """Counts of `values` in `edges` if precomputed, else None. Pass the versions if they are known"""
+        if values_version is None:
+            values_version = data_version(values)
+        if edges_version is None:
+            edges_version = data_version(np.asarray(edges, dtype=float))
+        entry = self._entry(self.counts_name(values_version, edges_version))
+        return None if entry is None else entry["counts"]
+
+    def edges(self, values_version: str, rule: str, max_bins: int) -> Optional[np.ndarray]:
+        entry = self._entry(self.edges_name(values_version, rule, max_bins))
+        return None if entry is None else entry["edges"]
+
+    def _meta(self, label: str, attribute: str, values, values_version: str, **meta) -> dict:
+        return {"version": FORMAT_VERSION, "label": label, "attribute": attribute,
+                "values_version": values_version, "summary": summary(values), **meta}
+
+    def write_counts(self, label: str, attribute: str, values, edges) -> str:
+        values = np.asarray(values, dtype=float).ravel()
+        edges = np.asarray(edges, dtype=float)
+        values_version, edges_version = data_version(values), data_version(edges)
+        counts = bin_statistics(values, edges)[0]
+        name = self.counts_name(values_version, edges_version)
+        self.store.write(name, {"edges": edges, "counts": counts},
+                         meta=self._meta(label, attribute, values, values_version, edges_version=edges_version, nbins=len(edges) - 1))
+        self._entries.pop(name, None)
+        return name
+
+    def write_edges(self, label: str, attribute: str, values, rule: str, max_bins: int = BINNING_ENGINE.max_bins) -> Tuple[str, np.ndarray]:
+        values = np.asarray(values, dtype=float).ravel()
+        values_version = data_version(values)
+        func = BINNING_ENGINE._rule(rule)
+        # the edges the engine computes with `max_bins`, not with its own limit
+        edges = np.asarray(BINNING_ENGINE.compute(values, rule, max_bins=max_bins))
+        name = self.edges_name(values_version, func.__name__, max_bins)
+        self.store.write(name, {"edges": edges}, meta=self._meta(label, attribute, values, values_version, rule=func.__name__))
+        self._entries.pop(name, None)
+        return name, edges
+
+    def clear(self):
+        self._entries.clear()
+        self.store.clear()
+
+
+PRECOMPUTED = PrecomputedStore()
+
+
+def write_bin_table(tables: SharedArrayStore, label: str, values, edges) -> str:
+    """The `BinManager` bin table of a viewer showing only dataset `label`, as the entry the manager maps"""
+    layers = [(label, np.asarray(values, dtype=float).ravel(), False)]
+    edges = np.asarray(edges, dtype=float)
+    name = bin_table_name(bin_table_key(edges, layers))
+    tables.write(name, {"customdata": bin_table(edges, layers)})
+    return name
+
+
+# ---- datasets ----
+
+def load_file(path: str) -> Dict[str, np.ndarray]:
+    """Columns of a .npz, .npy (structured) or .csv file"""
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in f.files}
+    if path.endswith(".npy"):
+        values = np.load(path, allow_pickle=False)
+        return {k: values[k] for k in values.dtype.names}
+    values = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8")
+    return {k: values[k] for k in values.dtype.names}
+
+
+def precompute(datasets: Dict[str, Dict[str, np.ndarray]], attributes: Iterable[str], bins: Iterable[int] = (),
+               rules: Iterable[str] = (), value_range: Optional[Tuple[float, float]] = None,
+               store: PrecomputedStore = PRECOMPUTED, tables: Optional[SharedArrayStore] = None) -> List[str]:
+    """
+    Write the counts for `bins` equal width bins (over `value_range`, default the data range,
+    like the viewers) and for the edges of every rule, and the bin tables to `tables` if given.
+    Returns the written entry names.
+    """
+    written = []
+    for label, columns in datasets.items():
+        for attribute in attributes:
+            if attribute not in columns:
+                continue
+            values = np.asarray(columns[attribute], dtype=float).ravel()
+            finite = values[np.isfinite(values)]
+            if finite.size == 0:
+                continue
+            lo, hi = value_range if value_range is not None else (float(finite.min()), float(finite.max()))
+            all_edges = [np.linspace(lo, hi, nbins + 1) for nbins in bins]
+            for rule in rules:
+                name, edges = store.write_edges(label, attribute, values, rule)
+                written.append(name)
+                all_edges.append(edges)
+            for edges in all_edges:
+                written.append(store.write_counts(label, attribute, values, edges))
+                if tables is not None:
+                    written.append(write_bin_table(tables, label, values, edges))
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Precompute bins and bin counts of static datasets")
+    parser.add_argument("--seed", action="store_true", help="the example seed data the page loads")
+    parser.add_argument("--file", nargs="*", default=[], metavar="LABEL=PATH", help="datasets from .npz, .npy or .csv files")
+    parser.add_argument("--attribute", nargs="*", help="attributes to bin (default with --seed: the velocity)")
+    parser.add_argument("--bins", type=int, nargs="*", default=[], help="numbers of equal width bins")
+    parser.add_argument("--rule", nargs="*", default=[], help="binning rules, e.g. fd scott knuth bayesian_blocks")
+    parser.add_argument("--range", type=float, nargs=2, metavar=("LO", "HI"), help="range of the equal width bins (default: data range)")
+    parser.add_argument("--out", default=PRECOMPUTE_DIR, help=f"output directory (default: {PRECOMPUTE_DIR})")
+    parser.add_argument("--shared-dir", default=SHARED_DATA_DIR, help=f"shared store for the bin tables (default: {SHARED_DATA_DIR})")
+    parser.add_argument("--list", action="store_true", help="list the precomputed entries")
+    parser.add_argument("--clear", action="store_true", help="remove all precomputed entries")
+    args = parser.parse_args(argv)
+
+    store = PrecomputedStore(args.out)
+    if args.clear:
+        store.clear()
+
+    datasets: Dict[str, Dict[str, np.ndarray]] = {}
+    attributes = args.attribute
+    if args.seed:
+        datasets.update(seed_datasets())
+        if not attributes:
+            from hubbleds.data_management import DB_VELOCITY_FIELD
+            attributes = [DB_VELOCITY_FIELD]
+    for spec in args.file:
+        label, _, path = spec.partition("=")
+        datasets[label if path else os.path.splitext(os.path.basename(label))[0]] = load_file(path or label)
+
+    if len(datasets) > 0:
+        if not attributes:
+            parser.error("--attribute is required for --file datasets")
+        if len(args.bins) == 0 and len(args.rule) == 0:
+            parser.error("give --bins and/or --rule")
+        written = precompute(datasets, attributes, args.bins, args.rule, args.range, store=store, tables=SharedArrayStore(args.shared_dir))
+        print(f"wrote {len(written)} entries to {store.root}")
+
+    if args.list:
+        for name in store.names():
+            meta = store.store.meta(name)
+            detail = f"rule={meta['rule']}" if "rule" in meta else f"nbins={meta.get('nbins')}"
+            print(f"{name}: {meta.get('label')}[{meta.get('attribute')}] {detail} n={meta.get('summary', {}).get('n')} v{meta.get('version')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Measure the import (startup) time of the app, per module.
+
+Every module is imported in a fresh interpreter with ``python -X importtime``,
+so the numbers are cold-start times, like a new solara worker or a hot reload.
+
+Usage:
+    python -m test_highlight.profile_startup
+    python -m test_highlight.profile_startup test_highlight.components --top 30
+    python -m test_highlight.profile_startup --budget 1500   # exit 1 if over 1.5 s
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+DEFAULT_MODULES = ["test_highlight.components", "test_highlight.pages"]
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportTiming]:
+    """Parse the ``-X importtime`` report (``import time: self | cumulative | name``)"""
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # header line
+            continue
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        timings.append(ImportTiming(stripped, self_us, cumulative_us, depth))
+    return timings
+
+
+def measure(module: str, python: str = sys.executable) -> List[ImportTiming]:
+    """Import `module` in a fresh interpreter and return the timing of every module it imported"""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def by_package(timings: List[ImportTiming]) -> Dict[str, int]:
+    """Total self time (us) per top level package"""
+    totals: Dict[str, int] = defaultdict(int)
+    for timing in timings:
+        totals[timing.module.split(".")[0]] += timing.self_us
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def total_ms(timings: List[ImportTiming]) -> float:
+    return sum(timing.self_us for timing in timings) / 1000
+
+
+def report(module: str, timings: List[ImportTiming], top: int = 20) -> str:
+    lines = [f"== import {module}: {total_ms(timings):.0f} ms, {len(timings)} modules"]
+    lines.append(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for timing in sorted(timings, key=lambda t: -t.cumulative_us)[:top]:
+        lines.append(f"{timing.cumulative_us / 1000:14.1f} {timing.self_us / 1000:9.1f}  {timing.module}")
+    lines.append(f"{'self ms':>14}  package")
+    for package, self_us in list(by_package(timings).items())[:top]:
+        lines.append(f"{self_us / 1000:14.1f}  {package}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="modules to import")
+    parser.add_argument("--top", type=int, default=20, help="number of modules and packages to list")
+    parser.add_argument("--budget", type=float, default=None, help="startup budget in ms per module; exit 1 if exceeded")
+    args = parser.parse_args(argv)
+
+    over_budget = False
+    for module in args.modules:
+        timings = measure(module)
+        print(report(module, timings, top=args.top))
+        if args.budget is not None and total_ms(timings) > args.budget:
+            print(f"!! import {module} took {total_ms(timings):.0f} ms, over the budget of {args.budget:.0f} ms")
+            over_budget = True
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
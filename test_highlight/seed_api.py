@@ -0,0 +1,136 @@
+"""
+Loading the example seed data off the render path, and a local stub of the seed API.
+
+The page used to fetch the seed measurements (``LOCAL_API.get_example_seed_measurement``)
+and link them inside ``solara.use_memo`` while rendering, so the controls and the
+`TestViewer` on local data waited for the database. `load_seed_datasets` is the
+blocking part (fetch, or map from the shared store) and is run in a thread by the
+page; the glue datasets are added and linked when it is done.
+
+Set ``TEST_HIGHLIGHT_SEED_API=stub`` to use `StubSeedAPI` instead of the database:
+random measurements in the shape of the real records, with an optional delay
+(``TEST_HIGHLIGHT_SEED_DELAY`` seconds) to try the loading state.
+
+Example:
+    ```python
+    datasets = load_seed_datasets(StubSeedAPI(delay=2))  # {label: columns}
+    ```
+"""
+import os
+import time
+from hashlib import blake2b
+from typing import Dict, List, Optional
+
+import numpy as np
+from cosmicds.logger import setup_logger
+
+from .components.binning import data_version
+from .shared_data import SHARED_DATA
+
+logger = setup_logger("SEED")
+
+SEED_API = os.environ.get("TEST_HIGHLIGHT_SEED_API", "hubbleds")
+SEED_DELAY = float(os.environ.get("TEST_HIGHLIGHT_SEED_DELAY", 0))
+# seconds before the shared copy of the seed data is fetched again (new measurements upstream)
+SEED_MAX_AGE = float(os.environ.get("TEST_HIGHLIGHT_SEED_MAX_AGE", 24 * 3600))
+
+
+class StubSeedAPI:
+    """Stands in for hubbleds' LOCAL_API: seed measurements without a database"""
+
+    def __init__(self, n_students: int = 100, galaxies_per_student: int = 5, delay: float = 0.0, seed: int = 0):
+        self.n_students = n_students
+        self.galaxies_per_student = galaxies_per_student
+        # seconds, like a slow database
+        self.delay = delay
+        self.seed = seed
+        self.calls = 0
+
+    def get_example_seed_measurement(self, state=None, which: str = 'both') -> List[dict]:
+        """Records with the fields of the real seed measurements used by the page"""
+        self.calls += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+        rng = np.random.default_rng(self.seed)
+        n = self.n_students * self.galaxies_per_student
+        student_id = np.repeat(np.arange(self.n_students), self.galaxies_per_student)
+        distance = rng.uniform(20, 300, n)
+        # Hubble flow around 70 km/s/Mpc, and a second, more careful measurement
+        velocity = 70 * distance + rng.normal(0, 1500, n)
+        records = []
+        for measurement, noise in (('first', 1.0), ('second', 0.5)):
+            if which not in ('both', measurement):
+                continue
+            for i in range(n):
+                records.append({
+                    'student_id': int(student_id[i]),
+                    'galaxy_id': int(i),
+                    'measurement_number': measurement,
+                    'est_dist_value': float(distance[i] * (1 + rng.normal(0, 0.1 * noise))),
+                    'velocity_value': float(velocity[i] + rng.normal(0, 500 * noise)),
+                })
+        return records
+
+
+def seed_api():
+    """The API of TEST_HIGHLIGHT_SEED_API: None (hubbleds' LOCAL_API) or a `StubSeedAPI`"""
+    if SEED_API == "stub":
+        return StubSeedAPI(delay=SEED_DELAY)
+    return None
+
+
+def fetch_seed_columns(api=None) -> Dict[str, np.ndarray]:
+    """Columns of the example seed measurements (both measurements). `api` defaults to hubbleds' LOCAL_API"""
+    state = None
+    if api is None:
+        from hubbleds.remote import LOCAL_API as api
+        from hubbleds.state import LOCAL_STATE as state
+
+    example_seed_data = api.get_example_seed_measurement(state, which='both')
+    return {k: np.asarray([r[k] for r in example_seed_data]) for k in example_seed_data[0].keys()}
+
+
+def select_measurement(columns, which) -> Dict[str, np.ndarray]:
+    keep = np.asarray(columns['measurement_number']) == which
+    return {k: np.asarray(v)[keep] for k, v in columns.items()}
+
+
+def seed_version(columns) -> str:
+    """Content hash of the seed columns"""
+    digest = blake2b(digest_size=8)
+    for name in sorted(columns):
+        digest.update(f"{name}:{data_version(columns[name])}".encode())
+    return digest.hexdigest()
+
+
+def seed_datasets(api=None) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    The seed datasets the page loads, by label (from the shared store, like the page).
+    Another `api` (e.g. `StubSeedAPI`) is fetched directly, not stored under the real labels.
+    """
+    from hubbleds.data_management import EXAMPLE_GALAXY_SEED_DATA
+
+    if api is not None:
+        columns = fetch_seed_columns(api)
+        datasets = {EXAMPLE_GALAXY_SEED_DATA: columns}
+        for which in ('first', 'second'):
+            datasets[EXAMPLE_GALAXY_SEED_DATA + '_' + which] = select_measurement(columns, which)
+        return datasets
+
+    # the seed data changes upstream, so the shared copy is refetched after SEED_MAX_AGE,
+    # and the measurements are stored under the version of the columns they come from
+    columns = SHARED_DATA.get_or_create(EXAMPLE_GALAXY_SEED_DATA, lambda: fetch_seed_columns(api), max_age=SEED_MAX_AGE)
+    version = seed_version(columns)
+    datasets = {EXAMPLE_GALAXY_SEED_DATA: columns}
+    for which in ('first', 'second'):
+        label = EXAMPLE_GALAXY_SEED_DATA + '_' + which
+        datasets[label] = SHARED_DATA.get_or_create(f"{label}-{version}", lambda: select_measurement(columns, which))
+    return datasets
+
+
+def load_seed_datasets(api=None) -> Dict[str, Dict[str, np.ndarray]]:
+    """The seed datasets by label. Blocking (network or disk), so run it in a thread"""
+    start = time.perf_counter()
+    datasets = seed_datasets(api)
+    logger.info(f"Seed data loaded in {(time.perf_counter() - start) * 1000:.0f} ms ({SEED_API if api is not None else 'hubbleds'})")
+    return datasets
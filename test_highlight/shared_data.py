@@ -0,0 +1,230 @@
+"""
+Read-only datasets shared by all the workers of the app.
+
+Immutable arrays (the example seed data, precomputed bin tables) are written once
+as ``.npy`` files and memory mapped read-only by every worker, so N workers share
+one copy of the pages through the OS page cache instead of holding N copies. glue
+``Data`` built from the mapped arrays does not copy numeric columns.
+
+The first worker to ask for an entry computes it while holding a file lock; the
+others wait and then map the files. Entries of data that can change upstream (the
+seed data) are given a ``max_age`` and recomputed when older.
+
+Check the per-worker memory overhead with:
+
+    python -m test_highlight.shared_data --report
+
+which lists RSS, PSS (shared pages divided between the processes mapping them)
+and the part of each that comes from the shared files, for every solara process.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None  # type: ignore
+
+SHARED_DATA_DIR = os.environ.get("TEST_HIGHLIGHT_SHARED_DIR", os.path.join(tempfile.gettempdir(), "test_highlight_shared"))
+
+_META_FILE = "meta.json"
+
+
+def _storable(values) -> np.ndarray:
+    """Convert to an array that np.load can memory map (no object dtype)"""
+    values = np.asarray(values)
+    if values.dtype.kind != "O":
+        return values
+    missing = np.equal(values, None)
+    try:
+        # a numeric column with missing values (None) is a float column with NaNs
+        return np.where(missing, np.nan, values).astype(float)
+    except (TypeError, ValueError):
+        return np.where(missing, "", values).astype(str)
+
+
+class SharedArrayStore:
+    """
+    A directory of named entries, each a set of memory-mappable ``.npy`` arrays plus json metadata.
+
+    Example:
+        ```python
+        columns = SHARED_DATA.get_or_create('example_seed_data', fetch_seed_columns)
+        data = Data(label='seed', **columns)  # numeric columns are not copied
+        ```
+    """
+
+    def __init__(self, root: str = SHARED_DATA_DIR):
+        self.root = root
+        self._mapped: Dict[str, Dict[str, np.ndarray]] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.path(name), _META_FILE))
+
+    @contextmanager
+    def _lock(self, name: str):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, f".{name.replace(os.sep, '_')}.lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write(self, name: str, arrays: Mapping[str, np.ndarray], meta: Optional[dict] = None):
+        """Write an entry atomically (readers never see a partial entry)"""
+        final = self.path(name)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(final), prefix=".tmp-")
+        try:
+            for key, values in arrays.items():
+                np.save(os.path.join(tmp, f"{key}.npy"), _storable(values), allow_pickle=False)
+            with open(os.path.join(tmp, _META_FILE), "w") as f:
+                json.dump({"arrays": list(arrays.keys()), "meta": meta or {}, "created": time.time()}, f)
+            if os.path.exists(final):
+                shutil.rmtree(final)
+            os.rename(tmp, final)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        self._mapped.pop(name, None)
+
+    def meta(self, name: str) -> dict:
+        with open(os.path.join(self.path(name), _META_FILE)) as f:
+            return json.load(f)["meta"]
+
+    def age(self, name: str) -> float:
+        """Seconds since the entry was written (entries written before this was recorded count as new)"""
+        with open(os.path.join(self.path(name), _META_FILE)) as f:
+            return time.time() - json.load(f).get("created", time.time())
+
+    def _current(self, name: str, max_age: Optional[float]) -> bool:
+        return self.exists(name) and (max_age is None or self.age(name) <= max_age)
+
+    def load(self, name: str) -> Dict[str, np.ndarray]:
+        """Memory map (read-only) the arrays of an entry. Mapped once per process"""
+        if name not in self._mapped:
+            with open(os.path.join(self.path(name), _META_FILE)) as f:
+                keys = json.load(f)["arrays"]
+            self._mapped[name] = {key: np.load(os.path.join(self.path(name), f"{key}.npy"), mmap_mode="r") for key in keys}
+        return dict(self._mapped[name])
+
+    def get_or_create(self, name: str, factory: Callable[[], Mapping[str, np.ndarray]], meta: Optional[dict] = None,
+                      max_age: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Map an entry, computing and writing it first if no worker has done so yet, or if
+        it is older than `max_age` seconds
+        """
+        if not self._current(name, max_age):
+            with self._lock(name):
+                # another worker may have written it while we waited for the lock
+                if not self._current(name, max_age):
+                    self.write(name, factory(), meta=meta)
+        return self.load(name)
+
+    def clear(self):
+        self._mapped.clear()
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+
+
+SHARED_DATA = SharedArrayStore()
+
+
+# ---- memory report ----
+
+def _smaps_rollup(pid: int) -> Dict[str, int]:
+    """kB values of /proc/<pid>/smaps_rollup (linux)"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    return values
+
+
+def _shared_file_usage(pid: int, root: str) -> Tuple[int, int]:
+    """(Rss, Pss) in kB of the mappings of files under `root`"""
+    rss = pss = 0
+    in_root = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 0 and "-" in parts[0] and not parts[0].endswith(":"):
+                # mapping header: address perms offset dev inode [path]
+                in_root = len(parts) >= 6 and parts[5].startswith(root)
+            elif in_root and parts[0] == "Rss:":
+                rss += int(parts[1])
+            elif in_root and parts[0] == "Pss:":
+                pss += int(parts[1])
+    return rss, pss
+
+
+def solara_pids() -> List[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="ignore")
+        except OSError:
+            continue
+        if "solara" in cmdline and "shared_data" not in cmdline:
+            pids.append(int(entry))
+    return pids
+
+
+def memory_report(pids: List[int], root: str = SHARED_DATA_DIR) -> str:
+    lines = [f"{'pid':>8} {'rss MB':>9} {'pss MB':>9} {'shared rss MB':>14} {'shared pss MB':>14}"]
+    total_pss = 0
+    for pid in pids:
+        try:
+            rollup = _smaps_rollup(pid)
+            shared_rss, shared_pss = _shared_file_usage(pid, root)
+        except OSError as e:
+            lines.append(f"{pid:>8} {e}")
+            continue
+        total_pss += rollup.get("Pss", 0)
+        lines.append(f"{pid:>8} {rollup.get('Rss', 0) / 1024:9.1f} {rollup.get('Pss', 0) / 1024:9.1f} {shared_rss / 1024:14.1f} {shared_pss / 1024:14.1f}")
+    lines.append(f"total pss: {total_pss / 1024:.1f} MB over {len(pids)} processes")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Shared read-only datasets for multiple workers")
+    parser.add_argument("--report", action="store_true", help="print the memory use of the solara workers")
+    parser.add_argument("--pid", type=int, nargs="*", help="processes to report on (default: all solara processes)")
+    parser.add_argument("--list", action="store_true", help="list the shared entries and their size")
+    parser.add_argument("--clear", action="store_true", help="remove all shared entries")
+    args = parser.parse_args(argv)
+
+    if args.clear:
+        SHARED_DATA.clear()
+    if args.list and os.path.exists(SHARED_DATA.root):
+        for name in sorted(os.listdir(SHARED_DATA.root)):
+            if SHARED_DATA.exists(name):
+                size = sum(os.path.getsize(os.path.join(SHARED_DATA.path(name), f)) for f in os.listdir(SHARED_DATA.path(name)))
+                print(f"{name}: {size / 1024:.1f} kB")
+    if args.report:
+        print(memory_report(args.pid or solara_pids()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())